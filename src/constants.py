@@ -48,6 +48,13 @@ PERSON_COLLISION = 'PERSON COLLISION'
 OBJECT_COLLISION = 'OBJECT COLLISION'
 MOVABLE_WALL_COLLISION = 'MOVABLE WALL COLLISION'
 
+# COLLISION SHAPES (compiled office scene)
+SHAPE_OUTLINE = 'OUTLINE'
+SHAPE_POLYGON = 'POLYGON'
+SHAPE_SECTOR = 'SECTOR'
+SHAPE_CIRCLE = 'CIRCLE'
+SHAPE_POINT = 'POINT'
+
 # VISUALIZATION
 VISUALIZE_AS_ONE_IMAGE = 'VISUALIZE AS ONE IMAGE'
 VISUALIZE_AS_MULTIPLE_IMAGES = 'VISUALIZE AS MULTIPLE IMAGES'
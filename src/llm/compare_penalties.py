@@ -5,9 +5,11 @@ import random
 import path_helper
 path_helper.add_project_path()
 
-from office_score.check_collisions import detect_all_collisions
-from office_score.penalty_score import compute_separate_penalties
-import office_plans.office_plan as office_plan
+from office_score.check_collisions import is_valid_scene_layout
+from office_score.penalty_score import score_layouts
+from office_score.office_scene import load_office_scene
+from office_score.clearance_map import detect_collisions_with_clearance
+from office_score.free_space import get_free_space_map
 import constants
 # Type aliases
 WallConfig     = Tuple[float, float, float]         # (x, y, θ)
@@ -15,37 +17,45 @@ PenaltyTriple  = Tuple[float, float, float]         # (P_disturb, P_window, P_vi
 StatsDict      = Dict[str, Dict[str, float]]        # e.g. {"disturb": {"mean": ..., "std": ..., ...}, ...}
 MetricsDict    = Dict[str, Any]                     # final per‐wall report
 
-def generate_random_configurations(num_configs, office_coords, doors, desks, persons, objects) -> list[tuple[float, float, float]]:
+def generate_random_configurations(num_configs, scene, clearance_map=None, free_space=None) -> list[tuple[float, float, float]]:
     """
     Generate random valid configurations for movable walls in the office space.
 
     Args:
         num_configs (int): Number of random configurations to generate.
-        office_coords (tuple[Literal['RECTANGLE'], tuple[int, int]] | tuple[Literal['POLYGON'], list[tuple[int, int]]]).
-        doors (Any): List of door objects or coordinates.
-        desks (Any): List of desk objects or coordinates.
-        persons (Any): List of person objects or coordinates.
-        objects (Any): List of other objects in the office.
+        scene (OfficeScene): Compiled office plan, see office_score.office_scene.
+        clearance_map (ClearanceMap, optional): Precomputed clearance map of the scene, see
+            office_score.clearance_map. Candidates are then drawn in batches and decided with
+            the map, falling back to the exact check only for borderline walls. The draws and
+            the accepted configurations are the same as without the map.
+        free_space (FreeSpaceMap, optional): Configuration-space map of the scene, see
+            office_score.free_space. Configurations are then drawn from its feasible cells
+            only, so the cost grows with num_configs instead of the rejection rate. The
+            draws come from a generator seeded by the `random` module.
 
     Returns:
         List[Tuple[float, float, float]]: List of valid wall configurations as (x, y, theta).
     """
+    if free_space is not None:
+        samples, _ = free_space.sample(num_configs, rng=random.getrandbits(64))
+        return [tuple(sample) for sample in samples.tolist()]
+
     configurations = []
 
     # Get office bounding box
-    right_most = 0
-    top_most = 0
-    if office_coords[0] == constants.OFFICE_RECTANGLE:
-        office_length, office_width = office_coords[1]
-        right_most = office_length # highest x
-        top_most = office_width # highest y
-    
-    if office_coords[0] == constants.OFFICE_POLYGON:
-        right_most = max(office_coords[1], key=lambda p: p[0])[0] # highest x
-        top_most = max(office_coords[1], key=lambda p: p[1])[1] # highest y
-
+    right_most = float(scene.office_polygon[:, 0].max()) # highest x
+    top_most = float(scene.office_polygon[:, 1].max()) # highest y
 
     while len(configurations) < num_configs:
+        if clearance_map is not None:
+            batch_size = max(num_configs - len(configurations), 64)
+            candidates = [(random.uniform(0, right_most), random.uniform(0, top_most), random.uniform(-90, 90))
+                          for _ in range(batch_size)]
+            collides = detect_collisions_with_clearance(candidates, scene, clearance_map)
+            valid = [candidate for candidate, hit in zip(candidates, collides) if not hit]
+            configurations.extend(valid[:num_configs - len(configurations)])
+            continue
+
         x = random.uniform(0, right_most)
         y = random.uniform(0, top_most)
         theta = random.uniform(-90, 90)
@@ -54,8 +64,7 @@ def generate_random_configurations(num_configs, office_coords, doors, desks, per
         candidate = (x, y, theta)
 
         # Check for collisions
-        collisions = detect_all_collisions([candidate], office_coords, doors, desks, persons, objects)
-        if not collisions:
+        if is_valid_scene_layout([candidate], scene):
             configurations.append(candidate)
     return configurations
 
@@ -91,36 +100,29 @@ def compute_percentile(value: float, data: List[float]) -> float:
 
 def compare_penalties(moveable_walls: List[WallConfig], comparison_sample_size: int = 100) -> List[MetricsDict]:
     # Load static office elements
-    office_coords, windows, doors, desks, persons, disturbing_persons, objects, disturbing_points, _ = \
-        office_plan.define_office_plan()
+    scene = load_office_scene()
 
     # 1) Generate one big common baseline set
     total_samples = comparison_sample_size * len(moveable_walls)
-    common_baseline_confs = generate_random_configurations(
-        total_samples, office_coords, doors, desks, persons, objects
-    )
+    common_baseline_confs = generate_random_configurations(total_samples, scene, free_space=get_free_space_map(scene))
 
     # 2) Compute baseline penalties once (same for every wall)
     #    pd_list: list of disturbance penalties for each random conf
     #    pw_list: list of window obstruction penalties for each random conf
     #    pv_list: list of visibility reduction penalties for each random conf
-    baseline_penalties = [
-        compute_separate_penalties(windows, persons, disturbing_persons+disturbing_points, [conf])
-        for conf in common_baseline_confs
-    ]
+    baseline_penalties = [tuple(penalties) for penalties in
+                          score_layouts(scene, [[conf] for conf in common_baseline_confs]).tolist()]
     stats = compute_baseline_stats(baseline_penalties)
     pd_list, pw_list, pv_list = zip(*baseline_penalties)
 
     all_results: List[MetricsDict] = []
+    wall_penalties = score_layouts(scene, [[wall] for wall in moveable_walls]).tolist()
 
-    for wall in moveable_walls:
-        # 3) Compute penalties for this suggested wall
+    for wall, (pd_s, pw_s, pv_s) in zip(moveable_walls, wall_penalties):
+        # 3) Penalties of this suggested wall
         #    pd_s: disturbance penalty for this wall
         #    pw_s: window obstruction penalty for this wall
         #    pv_s: visibility reduction penalty for this wall
-        pd_s, pw_s, pv_s = compute_separate_penalties(
-            windows, persons, disturbing_persons+disturbing_points, [wall]
-        )
 
         # 4) Normalize & percentile
         normalized = {
@@ -136,7 +138,7 @@ def compare_penalties(moveable_walls: List[WallConfig], comparison_sample_size:
         percentiles = {
             "disturb_pct": compute_percentile(pd_s, pd_list),
             "window_pct":  compute_percentile(pw_s, pw_list),
-            "vis_pct":     compute_percentile(pv_s, pv_list) if len(persons) - len(disturbing_persons) > 1 else 0,
+            "vis_pct":     compute_percentile(pv_s, pv_list) if len(scene.persons) - len(scene.disturbing_persons) > 1 else 0,
         }
         # 5) Collect results
         all_results.append({
@@ -0,0 +1,207 @@
+import path_helper
+path_helper.add_project_path()
+
+import math
+from typing import NamedTuple
+import numpy as np
+
+from office_score.visibility import rays_blocked, blocker_segments
+
+"""
+Module: adaptive_visibility
+
+Adaptive sampling of the visibility between the two members of a pair, as an alternative
+to the fixed n x m sample rays of office_score.visibility. The samples of a member lie on
+a curve: the circle around a person or the segment of a window. Parametrizing both curves
+by [0, 1] turns the visible fraction of a pair into the visible area of the unit square
+(u, v), where every point is the ray from curve_a(u) to curve_b(v).
+
+The square starts as a coarse grid of cells and a ray is tested at every grid node. A cell
+whose four corner rays agree is taken as uniformly visible or blocked; a cell whose corners
+disagree is split into four, which adds rays only around the silhouettes of the blockers.
+A disagreeing cell of area A with a visible corner fraction f is counted as f * A, and the
+true value lies in [0, A], so max(f, 1 - f) * A bounds its error. Pairs are refined until
+the summed bound of their disagreeing cells falls below the tolerance or the cells reach
+the maximum depth; fully visible and fully blocked pairs stop after the coarse grid.
+
+Disagreeing cells lie along the silhouettes of the blockers, so the bound shrinks only
+linearly with the finest cell width while the rays grow the same way: a bound of 0.01 needs
+about a thousand rays on a contested pair, four times the fixed 16 x 16 sampling, whose
+actual error reaches 0.1 on some plans. The defaults guarantee 0.05 with depth to spare.
+A pair that reaches the maximum depth above the tolerance is reported as not converged.
+
+The bound assumes that a blocker never fits entirely between the corner rays of a cell,
+which the coarse grid has to be fine enough for.
+"""
+
+# Visibility error at which the refinement of a pair stops
+ADAPTIVE_TOLERANCE = 0.05
+# Cells along each axis of the coarse grid
+ADAPTIVE_INITIAL_CELLS = 8
+# Times a cell can be split; the finest grid has ADAPTIVE_INITIAL_CELLS << ADAPTIVE_MAX_DEPTH cells per axis.
+# The bound of the demo plans stays below half of ADAPTIVE_TOLERANCE at this depth
+ADAPTIVE_MAX_DEPTH = 4
+
+SAMPLE_CURVE_KINDS = ('circle', 'segment')
+
+
+class SampleCurves(NamedTuple):
+    """The sample curve of one member of P pairs, parametrized by [0, 1]."""
+    kind: str               # 'circle' (periodic, u is the angle / 2 pi) or 'segment'
+    geometry: np.ndarray    # (P, 3) centers and radii, or (P, 2, 2) segment end points
+
+
+class AdaptiveVisibility(NamedTuple):
+    """Visible fraction of P pairs, with the error bound reached and the rays tested for every pair."""
+    visibility: np.ndarray  # (P,)
+    error: np.ndarray       # (P,) bound on |visibility - true visible fraction|
+    rays: np.ndarray        # (P,) number of rays tested
+    converged: np.ndarray   # (P,) False where the maximum depth stopped the pair above the tolerance
+
+
+def circle_curves(centers, radius):
+    """SampleCurves of circles of the given radius around the centers, like generate_sample_points_around."""
+    centers = np.asarray(centers, dtype=float).reshape(-1, 2)
+    return SampleCurves('circle', np.column_stack([centers, np.full(len(centers), float(radius))]))
+
+
+def segment_curves(segments):
+    """SampleCurves along segments ((x1, y1), (x2, y2)), like sample_points_along_line."""
+    return SampleCurves('segment', np.asarray(segments, dtype=float).reshape(-1, 2, 2))
+
+
+def curve_points(curves, pairs, u):
+    """Points at parameters u of the curves of the given pairs; arrays of equal length, result (N, 2)."""
+    geometry = curves.geometry[pairs]
+    if curves.kind == 'circle':
+        angle = 2 * math.pi * u
+        return geometry[:, :2] + geometry[:, 2:] * np.column_stack([np.cos(angle), np.sin(angle)])
+    return geometry[:, 0] + u[:, None] * (geometry[:, 1] - geometry[:, 0])
+
+
+def adaptive_pairs_visibility(curves_a, curves_b, blockers, tolerance:float=ADAPTIVE_TOLERANCE,
+                              initial_cells:int=ADAPTIVE_INITIAL_CELLS, max_depth:int=ADAPTIVE_MAX_DEPTH,
+                              strict:bool=False):
+    """
+    Visible fraction of the rays between the sample curves of every pair, refined adaptively.
+
+    Parameters:
+      curves_a, curves_b : SampleCurves of the two members of P pairs.
+      blockers           : blocker segments shared by all pairs.
+      tolerance          : visibility error at which the refinement of a pair stops.
+      initial_cells      : cells along each axis of the coarse grid.
+      max_depth          : times a cell can be split.
+      strict             : raise a ValueError instead of returning pairs that did not converge.
+
+    Returns:
+      AdaptiveVisibility of the P pairs.
+    """
+    for curves in (curves_a, curves_b):
+        if curves.kind not in SAMPLE_CURVE_KINDS:
+            raise ValueError(f"Unknown sample curve kind {curves.kind!r}, expected one of {SAMPLE_CURVE_KINDS}.")
+    segments = blocker_segments(blockers)
+    num_pairs = len(curves_a.geometry)
+    visibility = np.zeros(num_pairs)
+    error = np.zeros(num_pairs)
+
+    # Nodes live on the integer grid of the finest depth; a node is a key into the sorted tested rays
+    finest = 1 << max_depth
+    intervals = initial_cells * finest
+    pair_stride = (intervals + 1) ** 2
+    keys = np.zeros(0, dtype=np.int64)
+    visible = np.zeros(0, dtype=bool)
+
+    def node_visible(pair, iu, iv):
+        nonlocal keys, visible
+        # On a circle, u = 1 is the same sample as u = 0
+        if curves_a.kind == 'circle':
+            iu = iu % intervals
+        if curves_b.kind == 'circle':
+            iv = iv % intervals
+        wanted, inverse = np.unique(pair * pair_stride + iu * (intervals + 1) + iv, return_inverse=True)
+        position = np.minimum(np.searchsorted(keys, wanted), max(len(keys) - 1, 0))
+        new = wanted[keys[position] != wanted] if len(keys) else wanted
+        if len(new):
+            new_pair, node = np.divmod(new, pair_stride)
+            new_u, new_v = np.divmod(node, intervals + 1)
+            new_visible = ~rays_blocked(curve_points(curves_a, new_pair, new_u / intervals),
+                                        curve_points(curves_b, new_pair, new_v / intervals), segments)
+            keys = np.concatenate([keys, new])
+            visible = np.concatenate([visible, new_visible])
+            order = np.argsort(keys, kind='stable')
+            keys, visible = keys[order], visible[order]
+        return visible[np.searchsorted(keys, wanted)][inverse.ravel()]
+
+    # Cells are (pair, lower-left node, depth)
+    grid_u, grid_v = np.meshgrid(np.arange(initial_cells) * finest, np.arange(initial_cells) * finest, indexing='ij')
+    pair = np.repeat(np.arange(num_pairs, dtype=np.int64), initial_cells ** 2)
+    iu = np.tile(grid_u.ravel(), num_pairs).astype(np.int64)
+    iv = np.tile(grid_v.ravel(), num_pairs).astype(np.int64)
+    depth = np.zeros(len(pair), dtype=np.int64)
+
+    while len(pair):
+        width = finest >> depth
+        corners = np.column_stack([node_visible(pair, iu + du * width, iv + dv * width)
+                                   for du in (0, 1) for dv in (0, 1)])
+        fraction = corners.mean(axis=1)
+        area = (width / intervals) ** 2
+        cell_error = np.where((fraction > 0) & (fraction < 1), area * np.maximum(fraction, 1 - fraction), 0.0)
+        visibility += np.bincount(pair, weights=area * fraction, minlength=num_pairs)
+
+        pair_error = error + np.bincount(pair, weights=cell_error, minlength=num_pairs)
+        split = (cell_error > 0) & (pair_error[pair] > tolerance) & (depth < max_depth)
+        # Cells that are not split are final: uniform cells, and the disagreeing ones of pairs within tolerance
+        error += np.bincount(pair[~split], weights=cell_error[~split], minlength=num_pairs)
+        visibility -= np.bincount(pair[split], weights=area[split] * fraction[split], minlength=num_pairs)
+
+        half = width[split] // 2
+        pair = np.repeat(pair[split], 4)
+        iu = (iu[split, None] + np.array([0, 1, 0, 1]) * half[:, None]).ravel()
+        iv = (iv[split, None] + np.array([0, 0, 1, 1]) * half[:, None]).ravel()
+        depth = np.repeat(depth[split] + 1, 4)
+
+    rays = np.bincount(keys // pair_stride, minlength=num_pairs) if num_pairs else np.zeros(0, dtype=int)
+    converged = error <= tolerance
+    if strict and not converged.all():
+        raise ValueError(f"{np.count_nonzero(~converged)} of {num_pairs} pairs stopped at depth {max_depth} with an "
+                         f"error bound up to {error.max():.4f} above the tolerance {tolerance}; "
+                         f"raise max_depth or the tolerance.")
+    return AdaptiveVisibility(visibility, error, rays, converged)
+
+
+# --------------------------
+# Example usage: adaptive against fixed sampling on the person pairs of some plans with their preset walls
+# --------------------------
+if __name__ == "__main__":
+    import time
+    from office_score.office_scene import load_office_scene
+    from office_score.visibility import pairs_visibility
+    from office_score.penalty_score import (generate_sample_points_around, movable_wall_segments, PERSON_SAMPLE_COUNT,
+                                            PERSON_SAMPLE_RADIUS)
+
+    reference_count = 128
+    for plan in (0, 4, 16, 21, 22):
+        scene = load_office_scene(plan)
+        persons = [tuple(p) for p in scene.persons]
+        pairs = [(p, q) for i, p in enumerate(persons) for q in persons[i + 1:]]
+        blockers = np.concatenate([scene.office_walls, blocker_segments(movable_wall_segments(scene.moveable_walls))])
+
+        def fixed(count):
+            start_time = time.perf_counter()
+            result = pairs_visibility([generate_sample_points_around(p, PERSON_SAMPLE_RADIUS, count) for p, _ in pairs],
+                                      [generate_sample_points_around(q, PERSON_SAMPLE_RADIUS, count) for _, q in pairs],
+                                      blockers)
+            return result, time.perf_counter() - start_time
+
+        reference, _ = fixed(reference_count)
+        fixed_visibility, fixed_time = fixed(PERSON_SAMPLE_COUNT)
+        start_time = time.perf_counter()
+        adaptive = adaptive_pairs_visibility(circle_curves([p for p, _ in pairs], PERSON_SAMPLE_RADIUS),
+                                             circle_curves([q for _, q in pairs], PERSON_SAMPLE_RADIUS), blockers)
+        adaptive_time = time.perf_counter() - start_time
+        print(f"Plan {plan:2d}, {len(pairs):4d} pairs: "
+              f"fixed {PERSON_SAMPLE_COUNT ** 2} rays/pair, max error {np.abs(fixed_visibility - reference).max():.4f}, "
+              f"{fixed_time * 1e3:.1f} ms | adaptive {adaptive.rays.mean():.1f} rays/pair, "
+              f"max error {np.abs(adaptive.visibility - reference).max():.4f} "
+              f"(bound {adaptive.error.max():.4f}, {np.count_nonzero(~adaptive.converged)} not converged), "
+              f"{adaptive_time * 1e3:.1f} ms")
@@ -0,0 +1,543 @@
+import pretty_errors
+
+import path_helper
+path_helper.add_project_path()
+
+import numpy as np
+import constants
+from office_score.check_collisions import detect_all_collisions
+from office_score.broad_phase import aabbs_overlap_batch, polygon_aabbs
+from office_plans.office_plan import define_office_plan
+
+# Number of candidate walls handled per kernel call. Bounds the size of the
+# (walls x obstacles x axes x vertices) projection arrays.
+DEFAULT_CHUNK_SIZE = 1024
+
+# Peak working memory in bytes the batched kernels size their chunks against
+DEFAULT_MEMORY_BUDGET = 64 << 20
+
+# Peak bytes per (wall, obstacle) column of the collision matrix, when every pair reaches the
+# exact test; measured with tracemalloc, per kernel dtype
+COLLISION_PAIR_BYTES = {np.dtype(np.float64): 640, np.dtype(np.float32): 400}
+
+# Machine epsilon of float32; the float32 kernels bound their rounding error with it
+FLOAT32_EPSILON = float(np.finfo(np.float32).eps)
+
+# --------------------------
+# Vectorized geometry kernels
+# --------------------------
+# All kernels broadcast over their leading dimensions, so the same code handles
+# "every wall against every obstacle" and "a list of (wall, obstacle) pairs".
+# The arithmetic is written out in the same order as the scalar helpers in
+# check_collisions.py so both paths make identical decisions.
+
+def rectangle_polygons(walls, length=constants.MOVABLE_WALL_LENGTH, width=constants.MOVABLE_WALL_WIDTH):
+    """
+    Vectorized get_rectangle_polygon.
+
+    Parameters:
+      walls  : array-like of shape (N, 3) with rows (x, y, angle), angle in degrees.
+      length : Length (x-direction) of every rectangle.
+      width  : Width (y-direction) of every rectangle.
+
+    Returns:
+      Array of shape (N, 4, 2) with the rotated corners (ll, lr, ur, ul) of every rectangle.
+    """
+    walls = np.asarray(walls, dtype=float).reshape(-1, 3)
+    x = walls[:, 0:1]
+    y = walls[:, 1:2]
+    rad = np.radians(walls[:, 2:3])
+    cos_a = np.cos(rad)
+    sin_a = np.sin(rad)
+
+    corner_x = np.hstack([x - length/2, x + length/2, x + length/2, x - length/2])
+    corner_y = np.hstack([y - width/2, y - width/2, y + width/2, y + width/2])
+    dx = corner_x - x
+    dy = corner_y - y
+    rx = dx * cos_a - dy * sin_a
+    ry = dx * sin_a + dy * cos_a
+    return np.stack([x + rx, y + ry], axis=-1)
+
+
+def polygon_axes(polys):
+    """
+    Returns the normalized edge normals of polygons of shape (..., n, 2) as an array of the same shape.
+    Degenerate (zero length) edges give a (0, 0) axis, exactly like the scalar SAT helper.
+    """
+    polys = np.asarray(polys, dtype=float)
+    edges = np.roll(polys, -1, axis=-2) - polys
+    normals = np.stack([-edges[..., 1], edges[..., 0]], axis=-1)
+    length = np.hypot(normals[..., 0], normals[..., 1])[..., None]
+    return np.divide(normals, length, out=normals.copy(), where=length != 0)
+
+
+def project_polygons(polys, axes):
+    """
+    Projects polygons (..., n, 2) onto axes (..., m, 2).
+
+    Returns:
+      (min, max) arrays of shape (..., m).
+    """
+    proj = (polys[..., None, :, 0] * axes[..., :, None, 0]
+            + polys[..., None, :, 1] * axes[..., :, None, 1])
+    return proj.min(axis=-1), proj.max(axis=-1)
+
+
+def polygons_intersect_batch(poly_a, poly_b, axes_a=None, axes_b=None, proj_b=None):
+    """
+    Separating Axis Theorem for many pairs of convex polygons at once.
+
+    Parameters:
+      poly_a, poly_b : arrays of shape (..., na, 2) and (..., nb, 2), broadcastable on the leading dims.
+      axes_a, axes_b : optional precomputed polygon_axes of poly_a and poly_b.
+      proj_b         : optional precomputed project_polygons(poly_b, axes_b).
+
+    Returns:
+      Boolean array with the broadcast leading shape, True where the polygons intersect.
+    """
+    if axes_a is None:
+        axes_a = polygon_axes(poly_a)
+    if axes_b is None:
+        axes_b = polygon_axes(poly_b)
+    if proj_b is None:
+        proj_b = project_polygons(poly_b, axes_b)
+
+    # Axes of polygon a
+    min1, max1 = project_polygons(poly_a, axes_a)
+    min2, max2 = project_polygons(poly_b, axes_a)
+    separated = ((max1 < min2) | (max2 < min1)).any(axis=-1)
+
+    # Axes of polygon b
+    min1, max1 = project_polygons(poly_a, axes_b)
+    min2, max2 = proj_b
+    separated = separated | ((max1 < min2) | (max2 < min1)).any(axis=-1)
+    return ~separated
+
+
+def polygons_intersect_batch_float32(poly_a, poly_b, axes_a, axes_b, scale=None):
+    """
+    polygons_intersect_batch in float32, for half the memory of the projection arrays.
+
+    The gap between the projections on an axis is off by at most 64 * FLOAT32_EPSILON * scale
+    in float32 for coordinates up to `scale`. A pair is certain when one gap is wider than that
+    (separated) or every gap is below minus that (overlapping); certain pairs give exactly the
+    float64 result.
+
+    Returns:
+      (intersect, uncertain): boolean arrays with the broadcast leading shape; recompute the
+      uncertain pairs with polygons_intersect_batch.
+    """
+    poly_a, poly_b, axes_a, axes_b = (np.asarray(v, dtype=np.float32) for v in (poly_a, poly_b, axes_a, axes_b))
+    if scale is None:
+        scale = max((float(np.abs(v).max()) if v.size else 0.0) for v in (poly_a, poly_b))
+    tolerance = 64 * FLOAT32_EPSILON * scale
+    separated = None
+    overlapping = None
+    for axes in (axes_a, axes_b):
+        min1, max1 = project_polygons(poly_a, axes)
+        min2, max2 = project_polygons(poly_b, axes)
+        gap = np.maximum(min2 - max1, min1 - max2)
+        axis_separated = (gap > tolerance).any(axis=-1)
+        axis_overlapping = (gap < -tolerance).all(axis=-1)
+        separated = axis_separated if separated is None else separated | axis_separated
+        overlapping = axis_overlapping if overlapping is None else overlapping & axis_overlapping
+    return ~separated, ~separated & ~overlapping
+
+
+def points_in_polygons(points, polys):
+    """
+    Vectorized ray-casting point_in_polygon.
+
+    Parameters:
+      points : array of shape (..., 2).
+      polys  : array of shape (..., n, 2), broadcastable against points.
+
+    Returns:
+      Boolean array with the broadcast leading shape.
+    """
+    x = points[..., 0, None]
+    y = points[..., 1, None]
+    p1x = polys[..., 0]
+    p1y = polys[..., 1]
+    p2x = np.roll(p1x, -1, axis=-1)
+    p2y = np.roll(p1y, -1, axis=-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        crossing = ((p1y > y) != (p2y > y)) & \
+                   (x < (p2x - p1x) * (y - p1y) / (p2y - p1y + 1e-9) + p1x)
+    return np.count_nonzero(crossing, axis=-1) % 2 == 1
+
+
+def distance_points_to_segments(points, a, b):
+    """
+    Vectorized distance_point_to_segment. All arguments are arrays of shape (..., 2) that broadcast together.
+    """
+    ap_x = points[..., 0] - a[..., 0]
+    ap_y = points[..., 1] - a[..., 1]
+    ab_x = b[..., 0] - a[..., 0]
+    ab_y = b[..., 1] - a[..., 1]
+    ab_len2 = ab_x**2 + ab_y**2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = (ap_x*ab_x + ap_y*ab_y) / ab_len2
+    t = np.clip(t, 0, 1)
+    dist = np.hypot(points[..., 0] - (a[..., 0] + t * ab_x), points[..., 1] - (a[..., 1] + t * ab_y))
+    return np.where(ab_len2 == 0, np.hypot(ap_x, ap_y), dist)
+
+
+def circles_intersect_polygons(centers, radii, polys):
+    """
+    Vectorized circle_intersects_polygon.
+
+    Parameters:
+      centers : array of shape (..., 2).
+      radii   : array broadcastable to the leading shape of centers.
+      polys   : array of shape (..., n, 2), broadcastable against centers.
+
+    Returns:
+      Boolean array, True where the circle's center is inside the polygon or the circle touches an edge.
+    """
+    inside = points_in_polygons(centers, polys)
+    a = polys
+    b = np.roll(polys, -1, axis=-2)
+    dist = distance_points_to_segments(centers[..., None, :], a, b)
+    near_edge = (dist <= np.asarray(radii)[..., None]).any(axis=-1)
+    return inside | near_edge
+
+def kernel_dtype(dtype):
+    """The np.dtype of a kernel dtype argument; the batched kernels run in float64 or float32."""
+    dtype = np.dtype(dtype)
+    if dtype not in (np.dtype(np.float64), np.dtype(np.float32)):
+        raise ValueError(f"Unsupported kernel dtype {dtype}, expected float64 or float32.")
+    return dtype
+
+
+def _orientation_values(a, b, c):
+    return (b[..., 1] - a[..., 1]) * (c[..., 0] - b[..., 0]) - (b[..., 0] - a[..., 0]) * (c[..., 1] - b[..., 1])
+
+
+def _orientations(a, b, c):
+    """Vectorized orientation test of segments_intersect: 0 collinear, 1 clockwise, 2 counterclockwise."""
+    val = _orientation_values(a, b, c)
+    return np.where(np.abs(val) < 1e-9, np.int8(0), np.where(val > 0, np.int8(1), np.int8(2)))
+
+
+def _on_segments(a, b, c):
+    return ((np.minimum(a[..., 0], c[..., 0]) <= b[..., 0]) & (b[..., 0] <= np.maximum(a[..., 0], c[..., 0])) &
+            (np.minimum(a[..., 1], c[..., 1]) <= b[..., 1]) & (b[..., 1] <= np.maximum(a[..., 1], c[..., 1])))
+
+
+def segments_intersect_batch(p, q, r, s):
+    """
+    Vectorized segments_intersect: does segment pq meet segment rs?
+    All arguments are arrays of shape (..., 2) that broadcast together; collinear and
+    touching segments count as intersecting, exactly like the scalar helper.
+    """
+    o1 = _orientations(p, q, r)
+    o2 = _orientations(p, q, s)
+    o3 = _orientations(r, s, p)
+    o4 = _orientations(r, s, q)
+    return (((o1 != o2) & (o3 != o4)) |
+            ((o1 == 0) & _on_segments(p, r, q)) |
+            ((o2 == 0) & _on_segments(p, s, q)) |
+            ((o3 == 0) & _on_segments(r, p, s)) |
+            ((o4 == 0) & _on_segments(r, q, s)))
+
+
+def segments_intersect_batch_float32(p, q, r, s, scale=None):
+    """
+    segments_intersect_batch in float32, for half the memory of the broadcast arrays.
+
+    An orientation value of points with coordinates up to `scale` is off by at most
+    64 * FLOAT32_EPSILON * scale**2 in float32; a test is certain when all four values are
+    farther than that from the collinear band. Certain tests give exactly the float64 result.
+
+    Returns:
+      (intersect, uncertain): boolean arrays with the broadcast shape; recompute the uncertain
+      tests with segments_intersect_batch.
+    """
+    p, q, r, s = (np.asarray(v, dtype=np.float32) for v in (p, q, r, s))
+    if scale is None:
+        scale = max((float(np.abs(v).max()) if v.size else 0.0) for v in (p, q, r, s))
+    tolerance = 1e-9 + 64 * FLOAT32_EPSILON * scale**2
+    intersect = None
+    uncertain = None
+    for a, b, c, d in ((p, q, r, s), (r, s, p, q)):
+        val_c = _orientation_values(a, b, c)
+        val_d = _orientation_values(a, b, d)
+        # Certain values are not collinear in float64 and have the float64 sign
+        straddles = (val_c > 0) != (val_d > 0)
+        near = (np.abs(val_c) <= tolerance) | (np.abs(val_d) <= tolerance)
+        intersect = straddles if intersect is None else intersect & straddles
+        uncertain = near if uncertain is None else uncertain | near
+    return intersect & ~uncertain, uncertain
+
+
+def segments_cross_batch(p, q, r, s):
+    """Vectorized segments_cross: do pq and rs cross at a single point inside both?"""
+    d1 = (q[..., 0] - p[..., 0]) * (r[..., 1] - p[..., 1]) - (q[..., 1] - p[..., 1]) * (r[..., 0] - p[..., 0])
+    d2 = (q[..., 0] - p[..., 0]) * (s[..., 1] - p[..., 1]) - (q[..., 1] - p[..., 1]) * (s[..., 0] - p[..., 0])
+    d3 = (s[..., 0] - r[..., 0]) * (p[..., 1] - r[..., 1]) - (s[..., 1] - r[..., 1]) * (p[..., 0] - r[..., 0])
+    d4 = (s[..., 0] - r[..., 0]) * (q[..., 1] - r[..., 1]) - (s[..., 1] - r[..., 1]) * (q[..., 0] - r[..., 0])
+    return (d1 * d2 < 0) & (d3 * d4 < 0)
+
+
+def polygons_inside_outline(polys, scene, aabbs=None):
+    """
+    Vectorized check_collisions.polygon_inside_outline against the scene's outline.
+
+    Parameters:
+      polys : array of shape (N, n, 2).
+      scene : compiled OfficeScene.
+      aabbs : (N, 4) bounding boxes of the polygons, computed when not given.
+
+    Returns:
+      An (N,) boolean array, True where the polygon lies inside the outline.
+    """
+    inside = points_in_polygons(polys, scene.office_polygon[None, None]).all(axis=-1)
+    edges = scene.outline_edges
+    if edges.convex:
+        return inside
+
+    # Concave outline: polygons with all corners inside may still straddle a notch
+    if aabbs is None:
+        aabbs = polygon_aabbs(polys)
+    candidates = np.flatnonzero(inside)
+    w, e = np.nonzero(aabbs_overlap_batch(aabbs[candidates, None], edges.aabbs[None]))
+    w = candidates[w]
+    starts = edges.starts[e]
+    ends = edges.ends[e]
+    crossing = points_in_polygons(starts, polys[w]) | \
+        segments_cross_batch(polys[w], np.roll(polys[w], -1, axis=1), starts[:, None], ends[:, None]).any(axis=1)
+    inside[w[crossing]] = False
+    return inside
+
+
+def angles_in_sweep(angles, start_angles, sweeps):
+    """Vectorized check_collisions.angle_in_sweep."""
+    counterclockwise = np.mod(angles - start_angles, 2 * np.pi) <= sweeps
+    clockwise = np.mod(start_angles - angles, 2 * np.pi) <= -sweeps
+    return (np.abs(sweeps) >= 2 * np.pi) | np.where(sweeps >= 0, counterclockwise, clockwise)
+
+
+def sectors_intersect_polygons(centers, radii, start_angles, sweeps, start_points, end_points, polys):
+    """
+    Vectorized check_collisions.sector_intersects_polygon.
+
+    Parameters:
+      centers, start_points, end_points : arrays of shape (..., 2).
+      radii, start_angles, sweeps       : arrays with the leading shape.
+      polys                             : array of shape (..., n, 2), broadcastable against the sectors.
+
+    Returns:
+      Boolean array, True where the sector and the convex polygon intersect.
+    """
+    radii = radii[..., None]
+    start_angles = start_angles[..., None]
+    sweeps = sweeps[..., None]
+    a = polys
+    b = np.roll(polys, -1, axis=-2)
+
+    # Polygon corners inside the sector
+    dx = a[..., 0] - centers[..., None, 0]
+    dy = a[..., 1] - centers[..., None, 1]
+    in_sweep = angles_in_sweep(np.arctan2(dy, dx), start_angles, sweeps) | ((dx == 0) & (dy == 0))
+    corner_inside = ((np.hypot(dx, dy) <= radii) & in_sweep).any(axis=-1)
+
+    # Sector centre inside the polygon
+    center_inside = points_in_polygons(centers, polys)
+
+    # Radius segments crossing a polygon edge
+    radius_crossing = (segments_intersect_batch(centers[..., None, :], start_points[..., None, :], a, b) |
+                       segments_intersect_batch(centers[..., None, :], end_points[..., None, :], a, b)).any(axis=-1)
+
+    # Arc crossing a polygon edge: solve |a + t (b - a) - center| = radius for t in [0, 1]
+    ex = b[..., 0] - a[..., 0]
+    ey = b[..., 1] - a[..., 1]
+    qa = ex*ex + ey*ey
+    qb = 2 * (dx*ex + dy*ey)
+    qc = dx*dx + dy*dy - radii*radii
+    discriminant = qb*qb - 4*qa*qc
+    root = np.sqrt(np.maximum(discriminant, 0))
+    arc_crossing = np.zeros(qa.shape, dtype=bool)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for t in ((-qb - root) / (2*qa), (-qb + root) / (2*qa)):
+            angle = np.arctan2(dy + t*ey, dx + t*ex)
+            arc_crossing |= (qa != 0) & (discriminant >= 0) & (0 <= t) & (t <= 1) & \
+                            angles_in_sweep(angle, start_angles, sweeps)
+    arc_crossing = arc_crossing.any(axis=-1)
+
+    return corner_inside | center_inside | radius_crossing | arc_crossing
+
+# --------------------------
+# Batch collision check
+# --------------------------
+def _polygon_pairs_intersect(wall_polys, wall_axes, wall_polys32, wall_axes32, w, polys, axes, proj=None, scale=None):
+    """
+    polygons_intersect_batch of the pairs (wall_polys[w], polys): in float64, or with the float32
+    kernel when wall_polys32 is given, recomputing its uncertain pairs in float64.
+    """
+    if wall_polys32 is None:
+        return polygons_intersect_batch(wall_polys[w], polys, wall_axes[w], axes, proj)
+    hit, uncertain = polygons_intersect_batch_float32(wall_polys32[w], polys, wall_axes32[w], axes, scale)
+    if uncertain.any():
+        w = w[uncertain]
+        hit[uncertain] = polygons_intersect_batch(wall_polys[w], polys[uncertain], wall_axes[w], axes[uncertain],
+                                                  None if proj is None else (proj[0][uncertain], proj[1][uncertain]))
+    return hit
+
+
+def _collision_matrix(walls, scene, fixed_polys, stats=None, length=constants.MOVABLE_WALL_LENGTH,
+                      width=constants.MOVABLE_WALL_WIDTH, dtype=np.float64):
+    """Collision matrix of shape (N, len(scene.obstacles) + len(fixed_polys)) for one chunk of walls."""
+    wall_polys = rectangle_polygons(walls, length, width)
+    wall_axes = polygon_axes(wall_polys)
+    wall_aabbs = polygon_aabbs(wall_polys)
+    hits = np.zeros((len(wall_polys), len(scene.obstacles) + len(fixed_polys)), dtype=bool)
+
+    # float32: the wall-polygon SAT tests, which dominate, run on float32 copies
+    wall_polys32 = wall_axes32 = scale = None
+    if dtype == np.float32:
+        wall_polys32 = wall_polys.astype(np.float32)
+        wall_axes32 = wall_axes.astype(np.float32)
+        scale = max(float(np.abs(wall_polys).max()) if wall_polys.size else 0.0,
+                    float(np.abs(scene.office_polygon).max()), float(np.abs(fixed_polys).max()) if len(fixed_polys) else 0.0)
+
+    # Office outline: always tested
+    hits[:, scene.outline_column] = ~polygons_inside_outline(wall_polys, scene, wall_aabbs)
+    narrow_phase_tests = len(wall_polys)
+
+    # Broad phase: only (wall, obstacle) pairs with overlapping boxes reach the exact tests
+    for group in scene.polygon_groups:
+        w, g = np.nonzero(aabbs_overlap_batch(wall_aabbs[:, None], scene.obstacle_aabbs[group.columns][None]))
+        hits[w, group.columns[g]] = _polygon_pairs_intersect(
+            wall_polys, wall_axes, wall_polys32, wall_axes32, w, group.polygons[g], group.axes[g],
+            (group.proj_min[g], group.proj_max[g]), scale)
+        narrow_phase_tests += len(w)
+
+    sectors = scene.sectors
+    if len(sectors.columns):
+        w, d = np.nonzero(aabbs_overlap_batch(wall_aabbs[:, None], scene.obstacle_aabbs[sectors.columns][None]))
+        hits[w, sectors.columns[d]] = sectors_intersect_polygons(
+            sectors.centers[d], sectors.radii[d], sectors.start_angles[d], sectors.sweeps[d],
+            sectors.start_points[d], sectors.end_points[d], wall_polys[w])
+        narrow_phase_tests += len(w)
+
+    if len(scene.circles.columns):
+        w, c = np.nonzero(aabbs_overlap_batch(wall_aabbs[:, None], scene.obstacle_aabbs[scene.circles.columns][None]))
+        hits[w, scene.circles.columns[c]] = circles_intersect_polygons(
+            scene.circles.centers[c], scene.circles.radii[c], wall_polys[w])
+        narrow_phase_tests += len(w)
+
+    if len(scene.points.columns):
+        w, p = np.nonzero(aabbs_overlap_batch(wall_aabbs[:, None], scene.obstacle_aabbs[scene.points.columns][None]))
+        hits[w, scene.points.columns[p]] = points_in_polygons(scene.points.points[p], wall_polys[w])
+        narrow_phase_tests += len(w)
+
+    if len(fixed_polys):
+        w, f = np.nonzero(aabbs_overlap_batch(wall_aabbs[:, None], polygon_aabbs(fixed_polys)[None]))
+        hits[w, len(scene.obstacles) + f] = _polygon_pairs_intersect(
+            wall_polys, wall_axes, wall_polys32, wall_axes32, w, fixed_polys[f], polygon_axes(fixed_polys[f]),
+            scale=scale)
+        narrow_phase_tests += len(w)
+
+    if stats is not None:
+        stats.candidate_pairs += hits.size
+        stats.narrow_phase_tests += narrow_phase_tests
+    return hits
+
+
+def collision_chunk_size(columns, dtype=np.float64, memory_budget=DEFAULT_MEMORY_BUDGET):
+    """Number of walls per _collision_matrix call that keeps `columns` obstacles within memory_budget bytes."""
+    return max(1, int(memory_budget // (max(columns, 1) * COLLISION_PAIR_BYTES[kernel_dtype(dtype)])))
+
+
+def detect_collisions_batch(walls, scene, fixed_walls=(), return_matrix=False, chunk_size=None,
+                            stats=None, length=constants.MOVABLE_WALL_LENGTH, width=constants.MOVABLE_WALL_WIDTH,
+                            dtype=np.float64, memory_budget=DEFAULT_MEMORY_BUDGET):
+    """
+    Checks many candidate movable walls against an office scene in one vectorized pass.
+
+    Every candidate is checked on its own against the office outline, desks, chairs,
+    doors, persons, objects and the already placed `fixed_walls`. Candidates are not
+    checked against each other; use check_collisions.detect_scene_collisions for a complete layout.
+
+    Parameters:
+      walls         : array-like of shape (N, 3) with rows (x, y, angle).
+      scene         : OfficeScene from office_scene.compile_office_scene / load_office_scene.
+      fixed_walls   : movable walls (x, y, angle) that are already part of the layout.
+      return_matrix : also return the (N, K) obstacle matrix.
+      chunk_size    : number of walls handled per kernel call, bounds peak memory; by default
+                      as many as fit memory_budget (at most DEFAULT_CHUNK_SIZE).
+      stats         : optional broad_phase.BroadPhaseStats that counts skipped exact tests.
+      length, width : size of the candidate rectangles; the fixed walls always have the movable wall size.
+      dtype         : np.float64, or np.float32 for the SAT tests of the walls against polygons and
+                      fixed walls; float32 decisions within rounding error are redone in float64,
+                      so the result is the same.
+      memory_budget : peak working memory in bytes the chunks are sized against.
+
+    Returns:
+      An (N,) boolean array, True where the wall collides with anything.
+      If return_matrix is True, a tuple (mask, matrix) where matrix[n, k] tells whether
+      wall n hits scene.obstacles[k]. The last len(fixed_walls) columns refer to the fixed walls.
+    """
+    walls = np.asarray(walls, dtype=float).reshape(-1, 3)
+    fixed_polys = rectangle_polygons(fixed_walls)
+    dtype = kernel_dtype(dtype)
+
+    matrix = np.zeros((len(walls), len(scene.obstacles) + len(fixed_polys)), dtype=bool)
+    if chunk_size is None:
+        chunk_size = min(DEFAULT_CHUNK_SIZE, collision_chunk_size(matrix.shape[1], dtype, memory_budget))
+    for start in range(0, len(walls), chunk_size):
+        matrix[start:start + chunk_size] = _collision_matrix(walls[start:start + chunk_size], scene, fixed_polys, stats,
+                                                                length, width, dtype)
+
+    mask = matrix.any(axis=1)
+    if return_matrix:
+        return mask, matrix
+    return mask
+
+
+# --------------------------
+# Example usage: compare against the scalar path on every bundled plan
+# --------------------------
+if __name__ == "__main__":
+    import time
+    from office_score.office_scene import load_office_scene
+    from office_score.broad_phase import BroadPhaseStats
+
+    rng = np.random.default_rng(0)
+    for plan in range(23):
+        scene = load_office_scene(plan)
+        outline = scene.office_polygon
+        random_walls = np.column_stack([
+            rng.uniform(outline[:, 0].min(), outline[:, 0].max(), 2000),
+            rng.uniform(outline[:, 1].min(), outline[:, 1].max(), 2000),
+            rng.uniform(-90, 90, 2000),
+        ])
+        grid_walls = np.array([(x, y, angle)
+                               for x in np.arange(0, outline[:, 0].max() + 0.5, 0.5)
+                               for y in np.arange(0, outline[:, 1].max() + 0.5, 0.5)
+                               for angle in (-45, 0, 45, 90)])
+        walls = np.vstack([random_walls, grid_walls])
+        fixed_walls = list(scene.moveable_walls)
+
+        stats = BroadPhaseStats()
+        start_time = time.perf_counter()
+        mask, matrix = detect_collisions_batch(walls, scene, fixed_walls=fixed_walls, return_matrix=True, stats=stats)
+        batch_time = time.perf_counter() - start_time
+
+        obstacles = list(scene.obstacles) + [(constants.MOVABLE_WALL_COLLISION, wall) for wall in fixed_walls]
+        office_coordinates, windows, doors, desks, persons, disturbing_persons, objects, disturbing_points, _ = \
+            define_office_plan(plan)
+        start_time = time.perf_counter()
+        mismatches = 0
+        for wall, row in zip(map(tuple, walls.tolist()), matrix):
+            collisions = detect_all_collisions(fixed_walls + [wall], office_coordinates, doors, desks, persons, objects)
+            expected = {(object_type, repr(info)) for mw, object_type, info in collisions if mw is wall}
+            expected |= {(object_type, repr(mw)) for mw, object_type, info in collisions if info is wall}
+            found = {(obstacles[k][0], repr(obstacles[k][1])) for k in np.flatnonzero(row)}
+            mismatches += expected != found
+        scalar_time = time.perf_counter() - start_time
+
+        print(f"Plan {plan:2d}: {len(walls)} walls, {mask.mean():.0%} colliding, {mismatches} mismatches, "
+              f"batch {batch_time*1000:.1f} ms, scalar {scalar_time*1000:.1f} ms, "
+              f"{stats.skipped_fraction:.0%} of exact tests skipped")
@@ -0,0 +1,104 @@
+import path_helper
+path_helper.add_project_path()
+
+import math
+from dataclasses import dataclass
+import numpy as np
+
+"""
+Module: broad_phase
+
+Bounding-box rejection for the collision checks. Obstacles are stored in a uniform
+grid of axis-aligned bounding boxes (AABBs); only obstacles whose box overlaps the
+box of a movable wall go on to the exact SAT / circle tests.
+"""
+
+# Obstacle boxes are grown by this margin so rounding in the exact tests can never
+# turn a touching pair into a rejected one.
+AABB_PADDING = 1e-9
+
+
+@dataclass
+class BroadPhaseStats:
+    """
+    Counters for the broad phase. Pass one instance to the detect functions to collect them
+    over any number of calls.
+    """
+    candidate_pairs: int = 0      # (wall, obstacle) pairs that a full scan would test
+    narrow_phase_tests: int = 0   # pairs that reached the exact test
+
+    @property
+    def skipped_tests(self) -> int:
+        """Exact tests avoided by the bounding-box rejection."""
+        return self.candidate_pairs - self.narrow_phase_tests
+
+    @property
+    def skipped_fraction(self) -> float:
+        return self.skipped_tests / self.candidate_pairs if self.candidate_pairs else 0.0
+
+    def reset(self):
+        self.candidate_pairs = 0
+        self.narrow_phase_tests = 0
+
+
+def polygon_aabb(poly, padding=0.0):
+    """Returns the bounding box (min_x, min_y, max_x, max_y) of a polygon."""
+    xs = [p[0] for p in poly]
+    ys = [p[1] for p in poly]
+    return (min(xs) - padding, min(ys) - padding, max(xs) + padding, max(ys) + padding)
+
+
+def aabbs_overlap(a, b):
+    """True if two boxes (min_x, min_y, max_x, max_y) overlap or touch."""
+    return not (a[2] < b[0] or b[2] < a[0] or a[3] < b[1] or b[3] < a[1])
+
+
+def aabbs_overlap_batch(a, b):
+    """Vectorized aabbs_overlap for box arrays of shape (..., 4) that broadcast together."""
+    return ~((a[..., 2] < b[..., 0]) | (b[..., 2] < a[..., 0]) | (a[..., 3] < b[..., 1]) | (b[..., 3] < a[..., 1]))
+
+
+def polygon_aabbs(polys):
+    """Bounding boxes of polygons of shape (..., n, 2) as an array of shape (..., 4)."""
+    return np.concatenate([polys.min(axis=-2), polys.max(axis=-2)], axis=-1)
+
+
+class ObstacleGrid:
+    """
+    Uniform grid over obstacle bounding boxes. Every obstacle is registered in all cells its
+    box touches; a query collects the obstacles of the cells touched by the query box and
+    keeps the ones whose box really overlaps it.
+
+    The grid is filled once in the constructor and only read afterwards.
+    """
+
+    def __init__(self, aabbs, columns, cell_size):
+        """
+        Parameters:
+          aabbs     : (K, 4) array of obstacle boxes (min_x, min_y, max_x, max_y).
+          columns   : (K,) obstacle index reported for every box.
+          cell_size : edge length of the square grid cells.
+        """
+        self.cell_size = float(cell_size)
+        self.aabbs = {int(column): tuple(map(float, aabb)) for column, aabb in zip(columns, aabbs)}
+        self.cells = {}
+        for column, aabb in self.aabbs.items():
+            for cell in self._cells(aabb):
+                self.cells.setdefault(cell, []).append(column)
+
+    def _cells(self, aabb):
+        x0 = math.floor(aabb[0] / self.cell_size)
+        y0 = math.floor(aabb[1] / self.cell_size)
+        x1 = math.floor(aabb[2] / self.cell_size)
+        y1 = math.floor(aabb[3] / self.cell_size)
+        return [(ix, iy) for ix in range(x0, x1 + 1) for iy in range(y0, y1 + 1)]
+
+    def query(self, aabb):
+        """Returns the sorted obstacle indices whose box overlaps `aabb`."""
+        found = set()
+        for cell in self._cells(aabb):
+            found.update(self.cells.get(cell, ()))
+        return sorted(column for column in found if aabbs_overlap(aabb, self.aabbs[column]))
+
+    def __len__(self):
+        return len(self.aabbs)
@@ -6,7 +6,9 @@ import math
 import constants
 import utils.utils_desk as utils_desk
 import importlib
+import weakref
 from office_plans.office_plan import define_office_plan
+from office_score.broad_phase import polygon_aabb, aabbs_overlap
 import time
 
 importlib.reload(utils_desk)
@@ -55,47 +57,111 @@ def get_rectangle_polygon(x, y, length, width, angle):
 # --------------------------
 # Helper: Check collision between two convex polygons using the Separating Axis Theorem (SAT)
 # --------------------------
-def polygons_intersect(poly1, poly2):
+def get_polygon_axes(poly):
+    """
+    Returns the normalized edge normals of a polygon, the candidate separating axes for SAT.
+    """
+    axes = []
+    n = len(poly)
+    for i in range(n):
+        p1 = poly[i]
+        p2 = poly[(i + 1) % n]
+        # Edge vector
+        edge = (p2[0] - p1[0], p2[1] - p1[1])
+        # The perpendicular (normal) axis
+        normal = (-edge[1], edge[0])
+        # Normalize the axis
+        length = math.hypot(normal[0], normal[1])
+        if length != 0:
+            normal = (normal[0] / length, normal[1] / length)
+        axes.append(normal)
+    return axes
+
+def project_polygon(poly, axis):
+    """
+    Returns the (min, max) interval of a polygon projected onto an axis.
+    """
+    min_val = float('inf')
+    max_val = -float('inf')
+    for p in poly:
+        proj = p[0] * axis[0] + p[1] * axis[1]
+        min_val = min(min_val, proj)
+        max_val = max(max_val, proj)
+    return min_val, max_val
+
+def minimum_translation(poly, axes, other_projection):
+    """
+    SAT on the given axes that also measures the overlap.
+
+    Parameters:
+      poly             : convex polygon that is to be moved.
+      axes             : candidate separating axes (normalized).
+      other_projection : function returning the (min, max) interval of the other shape on an axis.
+
+    Returns:
+      None if one of the axes separates the shapes, otherwise (mtv, depth): the shortest
+      translation of `poly` that separates it from the other shape, and its length.
+    """
+    best_axis = (0.0, 0.0)
+    best_push = math.inf
+    for axis in axes:
+        min1, max1 = project_polygon(poly, axis)
+        min2, max2 = other_projection(axis)
+        if max1 < min2 or max2 < min1:
+            return None
+        # Push poly out on whichever side of the other interval is closer
+        push = -(max1 - min2) if max1 - min2 < max2 - min1 else max2 - min1
+        if abs(push) < abs(best_push):
+            best_axis, best_push = axis, push
+    if best_push == math.inf:
+        return (0.0, 0.0), 0.0
+    return (best_axis[0] * best_push, best_axis[1] * best_push), abs(best_push)
+
+def polygons_intersect(poly1, poly2, return_mtv=False):
     """
     Uses the Separating Axis Theorem (SAT) to determine whether two convex polygons intersect.
     Reference: https://www.metanetsoftware.com/technique/tutorialA.html
-    """
-    def get_axes(poly):
-        axes = []
-        n = len(poly)
-        for i in range(n):
-            p1 = poly[i]
-            p2 = poly[(i + 1) % n]
-            # Edge vector
-            edge = (p2[0] - p1[0], p2[1] - p1[1])
-            # The perpendicular (normal) axis
-            normal = (-edge[1], edge[0])
-            # Normalize the axis
-            length = math.hypot(normal[0], normal[1])
-            if length != 0:
-                normal = (normal[0] / length, normal[1] / length)
-            axes.append(normal)
-        return axes
-
-    def project(poly, axis):
-        min_val = float('inf')
-        max_val = -float('inf')
-        for p in poly:
-            proj = p[0] * axis[0] + p[1] * axis[1]
-            min_val = min(min_val, proj)
-            max_val = max(max_val, proj)
-        return min_val, max_val
 
+    With return_mtv=True, returns (intersects, mtv, depth) instead: mtv is the shortest
+    translation of poly1 that separates it from poly2 and depth its length, both zero
+    when the polygons do not intersect.
+    """
     # Get the projection axes from both polygons
-    axes = get_axes(poly1) + get_axes(poly2)
+    axes = get_polygon_axes(poly1) + get_polygon_axes(poly2)
+    if return_mtv:
+        result = minimum_translation(poly1, axes, lambda axis: project_polygon(poly2, axis))
+        if result is None:
+            return False, (0.0, 0.0), 0.0
+        return True, result[0], result[1]
     for axis in axes:
-        min1, max1 = project(poly1, axis)
-        min2, max2 = project(poly2, axis)
+        min1, max1 = project_polygon(poly1, axis)
+        min2, max2 = project_polygon(poly2, axis)
         # If there is a gap on this axis, then no collision
         if max1 < min2 or max2 < min1:
             return False
     return True
 
+def polygons_intersect_precomputed(poly1, axes1, poly2, axes2, projections2):
+    """
+    polygons_intersect for a polygon whose axes and projections onto those axes are already known,
+    e.g. a static obstacle of a compiled office scene.
+
+    Parameters:
+      poly1, axes1  : moving polygon and its get_polygon_axes.
+      poly2, axes2  : static polygon and its get_polygon_axes.
+      projections2  : project_polygon(poly2, axis) for every axis in axes2.
+    """
+    for axis in axes1:
+        min1, max1 = project_polygon(poly1, axis)
+        min2, max2 = project_polygon(poly2, axis)
+        if max1 < min2 or max2 < min1:
+            return False
+    for axis, (min2, max2) in zip(axes2, projections2):
+        min1, max1 = project_polygon(poly1, axis)
+        if max1 < min2 or max2 < min1:
+            return False
+    return True
+
 # --------------------------
 # Helper: Check if a point is inside a polygon (ray-casting method)
 # --------------------------
@@ -143,6 +209,52 @@ def segments_intersect(p, q, r, s):
         return True
     return False
 
+def segments_cross(p, q, r, s):
+    """
+    True if segments pq and rs cross at a single point inside both. Unlike segments_intersect,
+    touching at an end point or running along each other does not count.
+    """
+    d1 = (q[0] - p[0]) * (r[1] - p[1]) - (q[1] - p[1]) * (r[0] - p[0])
+    d2 = (q[0] - p[0]) * (s[1] - p[1]) - (q[1] - p[1]) * (s[0] - p[0])
+    d3 = (s[0] - r[0]) * (p[1] - r[1]) - (s[1] - r[1]) * (p[0] - r[0])
+    d4 = (s[0] - r[0]) * (q[1] - r[1]) - (s[1] - r[1]) * (q[0] - r[0])
+    return d1 * d2 < 0 and d3 * d4 < 0
+
+# --------------------------
+# Helper: Check if a polygon lies inside the office outline
+# --------------------------
+def polygon_inside_outline(poly, outline, edges=None):
+    """
+    Exact containment test for convex and concave office outlines.
+
+    The polygon is inside when all its corners are inside the outline, no outline edge
+    crosses one of its edges and no outline corner lies inside it. The last two catch
+    walls that straddle a notch of a concave outline with all four corners inside.
+
+    Parameters:
+      poly    : polygon of the moveable wall.
+      outline : list of office corners.
+      edges   : indices of the outline edges to test (edge i runs from outline[i] to
+                outline[i + 1]); the edges near the polygon are enough. None tests all edges.
+
+    Returns:
+      True if the polygon lies inside the outline.
+    """
+    for point in poly:
+        if not point_in_polygon(point, outline):
+            return False
+
+    n = len(outline)
+    for e in (range(n) if edges is None else edges):
+        a = outline[e]
+        b = outline[(e + 1) % n]
+        if point_in_polygon(a, poly):
+            return False
+        for k in range(len(poly)):
+            if segments_cross(poly[k], poly[(k + 1) % len(poly)], a, b):
+                return False
+    return True
+
 # --------------------------
 # Helper: Check if a line segment intersects a polygon
 # --------------------------
@@ -170,12 +282,38 @@ def distance_point_to_segment(p, a, b):
     projection = (a[0] + t * ab[0], a[1] + t * ab[1])
     return math.hypot(p[0] - projection[0], p[1] - projection[1])
 
-def circle_intersects_polygon(center, radius, poly):
+def circle_intersects_polygon(center, radius, poly, return_mtv=False):
     """
     Checks whether a circle (center, radius) intersects a polygon.
     Returns True if the circle's center is inside the polygon or if the circle
     intersects any polygon edge.
+
+    With return_mtv=True, returns (intersects, mtv, depth) instead: mtv is the shortest
+    translation of the (convex) polygon that moves it off the circle and depth its length.
+    A radius of 0 gives the same for a point.
     """
+    if not return_mtv:
+        return _circle_intersects_polygon(center, radius, poly)
+    if not _circle_intersects_polygon(center, radius, poly):
+        return False, (0.0, 0.0), 0.0
+
+    # SAT for a circle: the polygon's edge normals and the axis towards its closest corner
+    axes = get_polygon_axes(poly)
+    closest = min(poly, key=lambda p: (p[0] - center[0])**2 + (p[1] - center[1])**2)
+    dx, dy = closest[0] - center[0], closest[1] - center[1]
+    length = math.hypot(dx, dy)
+    if length != 0:
+        axes.append((dx / length, dy / length))
+
+    def circle_projection(axis):
+        c = center[0] * axis[0] + center[1] * axis[1]
+        return c - radius, c + radius
+
+    # Touching shapes can be separated on an axis by rounding only
+    mtv, depth = minimum_translation(poly, axes, circle_projection) or ((0.0, 0.0), 0.0)
+    return True, mtv, depth
+
+def _circle_intersects_polygon(center, radius, poly):
     # If center is inside the polygon, there's a collision.
     if point_in_polygon(center, poly):
         return True
@@ -188,37 +326,107 @@ def circle_intersects_polygon(center, radius, poly):
             return True
     return False
 
-def arc_intersects_polygon(center, arc_startpoint, angle, rotation, poly, segments=30):
+def get_door_sector(hinge, door_end, opening_angle, rotation):
+    """
+    Describes the swing of a door as a circular sector.
+
+    Parameters:
+      hinge         : (x, y) centre of the swing.
+      door_end      : (x, y) end of the closed door, the start of the arc.
+      opening_angle : degrees the door can open.
+      rotation      : constants.CLOCKWISE or constants.COUNTERCLOCKWISE.
+
+    Returns:
+      (center, radius, start_angle, sweep, start_point, end_point), angles in radians.
+      The sweep is signed: positive counterclockwise, negative clockwise.
+    """
+    cx, cy = hinge
+    px, py = door_end
+    radius = math.hypot(px - cx, py - cy)
+    start_angle = math.atan2(py - cy, px - cx)
+    sweep = math.radians(opening_angle)
+    if rotation == constants.CLOCKWISE:
+        sweep = -sweep
+    end_angle = start_angle + sweep
+    end_point = (cx + radius * math.cos(end_angle), cy + radius * math.sin(end_angle))
+    return (cx, cy), radius, start_angle, sweep, (px, py), end_point
+
+def angle_in_sweep(angle, start_angle, sweep):
+    """
+    Checks whether the direction `angle` (radians) lies within the sweep that starts at
+    `start_angle` and turns by the signed angle `sweep`. Works for any sweep, also above 180°.
+    """
+    if abs(sweep) >= 2 * math.pi:
+        return True
+    if sweep >= 0:
+        return (angle - start_angle) % (2 * math.pi) <= sweep
+    return (start_angle - angle) % (2 * math.pi) <= -sweep
+
+def point_in_sector(point, center, radius, start_angle, sweep):
+    """Checks whether a point lies inside (or on the border of) a circular sector."""
+    dx = point[0] - center[0]
+    dy = point[1] - center[1]
+    if math.hypot(dx, dy) > radius:
+        return False
+    if dx == 0 and dy == 0:
+        return True
+    return angle_in_sweep(math.atan2(dy, dx), start_angle, sweep)
+
+def segment_crosses_arc(a, b, center, radius, start_angle, sweep):
+    """Checks whether the segment ab meets the arc of a circular sector."""
+    dx = b[0] - a[0]
+    dy = b[1] - a[1]
+    fx = a[0] - center[0]
+    fy = a[1] - center[1]
+    qa = dx*dx + dy*dy
+    qb = 2 * (fx*dx + fy*dy)
+    qc = fx*fx + fy*fy - radius*radius
+    discriminant = qb*qb - 4*qa*qc
+    if qa == 0 or discriminant < 0:
+        return False
+    root = math.sqrt(discriminant)
+    for t in ((-qb - root) / (2*qa), (-qb + root) / (2*qa)):
+        if 0 <= t <= 1:
+            angle = math.atan2(fy + t*dy, fx + t*dx)
+            if angle_in_sweep(angle, start_angle, sweep):
+                return True
+    return False
+
+def sector_intersects_polygon(sector, poly):
+    """
+    Exact test between a circular sector (see get_door_sector) and a convex polygon.
+
+    They intersect when a polygon corner lies in the sector, the sector centre lies in the
+    polygon, or the sector border crosses a polygon edge: one of the two radius segments or
+    the arc itself.
+    """
+    center, radius, start_angle, sweep, start_point, end_point = sector
+    for p in poly:
+        if point_in_sector(p, center, radius, start_angle, sweep):
+            return True
+    if point_in_polygon(center, poly):
+        return True
+    n = len(poly)
+    for i in range(n):
+        a = poly[i]
+        b = poly[(i + 1) % n]
+        if segments_intersect(center, start_point, a, b) or segments_intersect(center, end_point, a, b):
+            return True
+        if segment_crosses_arc(a, b, center, radius, start_angle, sweep):
+            return True
+    return False
+
+def arc_intersects_polygon(center, arc_startpoint, angle, rotation, poly):
     """
-    Checks if an arc (part of circle) intersects a polygon.
+    Checks if the area swept by an arc (part of circle), i.e. a door swing, intersects a polygon.
     - `center`: (x, y) centre of the circle.
     - `arc_startpoint`: (x, y) start of the arc.
     - `angle`: degrees of arc (e.g. 90° means quarter circle).
     - `rotation`: constants.CLOCKWISE or constants.COUNTERCLOCKWISE.
     - `poly`: array of (x, y).
-    - `segments`: generated points on arc.
     """
-    cx, cy = center
-    px, py = arc_startpoint
-    radius = math.hypot(px - cx, py - cy)
-
-    if rotation == constants.CLOCKWISE:
-        rotation_p = -1
-    else: rotation_p = 1
-    
-    # Calculate start angle
-    start_angle = math.atan2(py - cy, px - cx)
-
-    # Generate points on arc
-    arc_points = []
-    for i in range(segments + 1):
-        theta = start_angle + rotation_p * math.radians(angle) * (i / segments)
-        arc_x = cx + radius * math.cos(theta)
-        arc_y = cy + radius * math.sin(theta)
-        arc_points.append((arc_x, arc_y))
-
-    poly_arc = arc_points + [center]
-    return polygons_intersect(poly_arc, poly)
+    sector = get_door_sector(center, arc_startpoint, angle, rotation)
+    return sector_intersects_polygon(sector, poly)
 
 
 
@@ -298,9 +506,7 @@ def check_collision(moveable_wall, other_object, object_type):
             office_coordinates = [(0,0), (office_length, 0), (office_length, office_width), (0, office_width)]
         if other_object[0] == constants.OFFICE_POLYGON:
             office_coordinates = other_object[1]
-        for mw_point in mw_poly:
-            if not point_in_polygon(mw_point, office_coordinates):
-                return True
+        return not polygon_inside_outline(mw_poly, office_coordinates)
             
     elif object_type == constants.PERSON_COLLISION:
         # Person: defined as a point (x, y)
@@ -396,6 +602,290 @@ def detect_all_collisions(moveable_walls, office_coordinates, doors, desks, pers
 
 
 
+def check_scene_collision(mw_poly, mw_axes, shape, geometry):
+    """
+    Checks a moveable wall against one precompiled obstacle of an office scene
+    (see office_score.office_scene.OfficeScene.obstacle_shapes).
+
+    Parameters:
+      mw_poly  : polygon of the moveable wall, from get_rectangle_polygon.
+      mw_axes  : get_polygon_axes(mw_poly).
+      shape    : constants.SHAPE_OUTLINE, SHAPE_POLYGON, SHAPE_SECTOR, SHAPE_CIRCLE or SHAPE_POINT.
+      geometry : the precomputed data belonging to that shape.
+
+    Returns:
+      True if a collision is detected, False otherwise.
+    """
+    if shape == constants.SHAPE_POLYGON:
+        poly, axes, projections = geometry
+        return polygons_intersect_precomputed(mw_poly, mw_axes, poly, axes, projections)
+    elif shape == constants.SHAPE_SECTOR:
+        return sector_intersects_polygon(geometry, mw_poly)
+    elif shape == constants.SHAPE_CIRCLE:
+        center, radius = geometry
+        return circle_intersects_polygon(center, radius, mw_poly)
+    elif shape == constants.SHAPE_POINT:
+        return point_in_polygon(geometry, mw_poly)
+    elif shape == constants.SHAPE_OUTLINE:
+        # Convex outlines only need the corner test, concave ones the edges near the wall
+        outline, convex, edge_grid = geometry
+        edges = () if convex else edge_grid.query(polygon_aabb(mw_poly))
+        return not polygon_inside_outline(mw_poly, outline, edges)
+    else:
+        raise ValueError("Unsupported shape for collision detection.")
+
+
+def detect_scene_collisions(moveable_walls, scene, stats=None):
+    """
+    Same as detect_all_collisions, but takes the static obstacles from a compiled office scene
+    (office_score.office_scene.load_office_scene / compile_office_scene). Every moveable wall
+    polygon is built once; the scene's obstacle grid hands it only the obstacles whose bounding
+    box overlaps the wall's box, and only those reach the exact tests.
+
+    Parameters:
+      moveable_walls : list of (x, y, angle).
+      scene          : compiled OfficeScene.
+      stats          : optional broad_phase.BroadPhaseStats that counts skipped exact tests.
+
+    Returns:
+        A list of collisions. Each collision is represented as a tuple:
+        (movable_wall, object_type, other_object)
+    """
+    mw_polys = [get_rectangle_polygon(mw[0], mw[1], constants.MOVABLE_WALL_LENGTH, constants.MOVABLE_WALL_WIDTH, mw[2])
+                for mw in moveable_walls]
+    mw_axes = [get_polygon_axes(poly) for poly in mw_polys]
+    mw_aabbs = [polygon_aabb(poly) for poly in mw_polys]
+    collisions = []
+
+    for i, mw in enumerate(moveable_walls):
+        # The office outline is always tested, the other obstacles only when their boxes overlap
+        candidates = [scene.outline_column] + scene.obstacle_grid.query(mw_aabbs[i])
+        if stats is not None:
+            stats.candidate_pairs += len(scene.obstacles)
+            stats.narrow_phase_tests += len(candidates)
+
+        for k in candidates:
+            shape, geometry = scene.obstacle_shapes[k]
+            if check_scene_collision(mw_polys[i], mw_axes[i], shape, geometry):
+                object_type, info = scene.obstacles[k]
+                collisions.append((mw, object_type, info))
+
+        # Check collision with other moveable walls (avoid duplicate checks)
+        for j in range(i + 1, len(moveable_walls)):
+            overlap = aabbs_overlap(mw_aabbs[i], mw_aabbs[j])
+            if stats is not None:
+                stats.candidate_pairs += 1
+                stats.narrow_phase_tests += overlap
+            if overlap and polygons_intersect(mw_polys[i], mw_polys[j]):
+                collisions.append((mw, constants.MOVABLE_WALL_COLLISION, moveable_walls[j]))
+
+    return collisions
+
+
+# --------------------------
+# Penetration depth and minimum translation vectors
+# --------------------------
+# The translation vectors always move the movable wall. They tell an optimizer or the
+# feedback how far and where a wall has to move to clear one obstacle; depths are 0 for
+# walls that do not collide.
+
+SECTOR_POLYGON_SEGMENTS = 16
+
+def sector_polygon(sector, segments=SECTOR_POLYGON_SEGMENTS):
+    """
+    Polygon around a door sector (get_door_sector): the hinge and arc points on a radius
+    grown so that the polygon contains the whole sector. SAT treats it as its convex hull.
+    """
+    center, radius, start_angle, sweep, start_point, end_point = sector
+    step = sweep / segments
+    grown = radius / math.cos(step / 2)
+    points = [center, start_point]
+    for k in range(segments):
+        angle = start_angle + (k + 0.5) * step
+        points.append((center[0] + grown * math.cos(angle), center[1] + grown * math.sin(angle)))
+    points.append(end_point)
+    return points
+
+def outline_penetration(poly, outline, edges=None):
+    """
+    Depth by which a polygon leaves the office outline, with the translation of the deepest part.
+
+    Corners outside the outline are pulled to the closest point of the boundary. Outline edges
+    that cut into the polygon (a notch of a concave outline, `edges` as in polygon_inside_outline)
+    are treated as thin obstacles and pushed out of it.
+
+    Returns:
+      (mtv, depth) of the deepest violation, ((0.0, 0.0), 0.0) if the polygon is inside.
+    """
+    best = ((0.0, 0.0), 0.0)
+    n = len(outline)
+    for corner in poly:
+        if point_in_polygon(corner, outline):
+            continue
+        nearest = None
+        for i in range(n):
+            a, b = outline[i], outline[(i + 1) % n]
+            ab = (b[0] - a[0], b[1] - a[1])
+            ab_len2 = ab[0]**2 + ab[1]**2
+            t = 0 if ab_len2 == 0 else max(0, min(1, ((corner[0] - a[0]) * ab[0] + (corner[1] - a[1]) * ab[1]) / ab_len2))
+            pull = (a[0] + t * ab[0] - corner[0], a[1] + t * ab[1] - corner[1])
+            depth = math.hypot(pull[0], pull[1])
+            if nearest is None or depth < nearest[1]:
+                nearest = (pull, depth)
+        if nearest[1] > best[1]:
+            best = nearest
+
+    for e in (range(n) if edges is None else edges):
+        hit, mtv, depth = polygons_intersect(poly, [outline[e], outline[(e + 1) % n]], return_mtv=True)
+        if hit and depth > best[1]:
+            best = (mtv, depth)
+    return best
+
+def scene_penetration(mw_poly, mw_axes, shape, geometry):
+    """
+    Minimum translation vector and depth of a moveable wall into one obstacle of an office scene
+    (see check_scene_collision). Door sectors are measured against sector_polygon.
+
+    Returns:
+      (mtv, depth), ((0.0, 0.0), 0.0) if they do not collide.
+    """
+    if not check_scene_collision(mw_poly, mw_axes, shape, geometry):
+        return (0.0, 0.0), 0.0
+    if shape == constants.SHAPE_POLYGON:
+        _, mtv, depth = polygons_intersect(mw_poly, geometry[0], return_mtv=True)
+    elif shape == constants.SHAPE_SECTOR:
+        _, mtv, depth = polygons_intersect(mw_poly, sector_polygon(geometry), return_mtv=True)
+    elif shape == constants.SHAPE_CIRCLE:
+        center, radius = geometry
+        _, mtv, depth = circle_intersects_polygon(center, radius, mw_poly, return_mtv=True)
+    elif shape == constants.SHAPE_POINT:
+        _, mtv, depth = circle_intersects_polygon(geometry, 0, mw_poly, return_mtv=True)
+    else:
+        outline, convex, edge_grid = geometry
+        mtv, depth = outline_penetration(mw_poly, outline, () if convex else edge_grid.query(polygon_aabb(mw_poly)))
+    return mtv, depth
+
+def detect_scene_penetrations(moveable_walls, scene):
+    """
+    detect_scene_collisions with the penetration of every collision.
+
+    Returns:
+        A list of (movable_wall, object_type, other_object, mtv, depth) tuples in the order of
+        detect_scene_collisions. mtv moves movable_wall; for wall pairs it moves the first wall.
+    """
+    mw_polys = [get_rectangle_polygon(mw[0], mw[1], constants.MOVABLE_WALL_LENGTH, constants.MOVABLE_WALL_WIDTH, mw[2])
+                for mw in moveable_walls]
+    mw_aabbs = [polygon_aabb(poly) for poly in mw_polys]
+    penetrations = []
+
+    for i, mw in enumerate(moveable_walls):
+        mw_axes = get_polygon_axes(mw_polys[i])
+        for k in [scene.outline_column] + scene.obstacle_grid.query(mw_aabbs[i]):
+            shape, geometry = scene.obstacle_shapes[k]
+            if check_scene_collision(mw_polys[i], mw_axes, shape, geometry):
+                object_type, info = scene.obstacles[k]
+                penetrations.append((mw, object_type, info) + scene_penetration(mw_polys[i], mw_axes, shape, geometry))
+
+        for j in range(i + 1, len(moveable_walls)):
+            if aabbs_overlap(mw_aabbs[i], mw_aabbs[j]):
+                hit, mtv, depth = polygons_intersect(mw_polys[i], mw_polys[j], return_mtv=True)
+                if hit:
+                    penetrations.append((mw, constants.MOVABLE_WALL_COLLISION, moveable_walls[j], mtv, depth))
+
+    return penetrations
+
+def total_penetration(moveable_walls, scene):
+    """Sum of the penetration depths of all collisions of a wall set; 0 for a valid layout."""
+    return sum(penetration[4] for penetration in detect_scene_penetrations(moveable_walls, scene))
+
+
+class ObstacleHitStats:
+    """
+    Hit statistics of the obstacles of one scene. is_valid_scene_layout tests the obstacles
+    with the highest hit rate first, so most colliding candidates are rejected by the first test.
+    The order is refreshed every REORDER_INTERVAL recorded tests.
+    """
+    REORDER_INTERVAL = 256
+
+    def __init__(self, num_obstacles):
+        self.hits = [0] * num_obstacles
+        self.tests = [0] * num_obstacles
+        self.rank = list(range(num_obstacles))
+        self._pending = 0
+
+    def record(self, column, hit):
+        self.hits[column] += hit
+        self.tests[column] += 1
+        self._pending += 1
+        if self._pending >= self.REORDER_INTERVAL:
+            self.reorder()
+
+    def reorder(self):
+        """Ranks the obstacles by their smoothed hit rate, highest first."""
+        rates = [(hits + 1) / (tests + 2) for hits, tests in zip(self.hits, self.tests)]
+        for position, column in enumerate(sorted(range(len(rates)), key=lambda k: -rates[k])):
+            self.rank[column] = position
+        self._pending = 0
+
+    def order(self, columns):
+        """Returns the obstacle columns in the order they should be tested."""
+        return sorted(columns, key=self.rank.__getitem__)
+
+
+_HIT_STATS = weakref.WeakKeyDictionary()
+
+def get_hit_stats(scene):
+    """Returns the hit statistics of a scene, shared by all validity checks on it."""
+    if scene not in _HIT_STATS:
+        _HIT_STATS[scene] = ObstacleHitStats(len(scene.obstacles))
+    return _HIT_STATS[scene]
+
+
+def is_valid_scene_layout(moveable_walls, scene, hit_stats=None):
+    """
+    True if detect_scene_collisions(moveable_walls, scene) would find no collision.
+
+    Stops at the first collision instead of enumerating all of them. The candidate obstacles
+    of every wall are tested in the order of the scene's hit statistics, which are updated by
+    every call. Use detect_scene_collisions when the collisions themselves are needed, e.g.
+    for the feedback messages.
+
+    Parameters:
+      moveable_walls : list of (x, y, angle).
+      scene          : compiled OfficeScene.
+      hit_stats      : ObstacleHitStats to use and update, by default get_hit_stats(scene).
+
+    Returns:
+      True if no moveable wall collides with the scene or with another moveable wall.
+    """
+    if hit_stats is None:
+        hit_stats = get_hit_stats(scene)
+    mw_polys = []
+    mw_aabbs = []
+
+    # Walls appended last are usually the new candidates, so they are checked first
+    for mw in reversed(moveable_walls):
+        poly = get_rectangle_polygon(mw[0], mw[1], constants.MOVABLE_WALL_LENGTH, constants.MOVABLE_WALL_WIDTH, mw[2])
+        axes = get_polygon_axes(poly)
+        aabb = polygon_aabb(poly)
+
+        for k in hit_stats.order([scene.outline_column] + scene.obstacle_grid.query(aabb)):
+            shape, geometry = scene.obstacle_shapes[k]
+            hit = check_scene_collision(poly, axes, shape, geometry)
+            hit_stats.record(k, hit)
+            if hit:
+                return False
+
+        # Check against the walls checked before this one
+        for other_poly, other_aabb in zip(mw_polys, mw_aabbs):
+            if aabbs_overlap(aabb, other_aabb) and polygons_intersect(poly, other_poly):
+                return False
+        mw_polys.append(poly)
+        mw_aabbs.append(aabb)
+
+    return True
+
+
 # --------------------------
 # Example usage:
 # --------------------------
@@ -418,10 +908,11 @@ if __name__ == "__main__":
     # collision_with_person = check_collision(mw, person, "person")
     # print("Collision with person:", collision_with_person)
     
-    start_time = time.time()
+    # Full per-plan benchmarks: office_score/collision_benchmark.py
+    office_coordinates, windows, doors, desks, persons, disturbing_persons, objects, disturbing_points, moveable_walls = define_office_plan()
+    start_time = time.perf_counter()
     for _ in range(100):
-        office_coordinates, windows, doors, desks, persons, disturbing_persons, objects, disturbing_points, moveable_walls = define_office_plan()
         collisions_found = detect_all_collisions(moveable_walls, office_coordinates, doors, desks, persons, objects)
-    print("Time taken:", (time.time() - start_time)/1000)
+    print(f"Time per call: {(time.perf_counter() - start_time) / 100 * 1000:.3f} ms")
     print("Collisions found:", collisions_found)
     
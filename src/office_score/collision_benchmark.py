@@ -0,0 +1,188 @@
+import path_helper
+path_helper.add_project_path()
+
+import argparse
+import json
+import math
+import os
+import platform
+import time
+from datetime import datetime, timezone
+import numpy as np
+
+from office_plans.office_plan import define_office_plan
+from office_score.office_scene import load_office_scene
+from office_score.check_collisions import detect_all_collisions, detect_scene_collisions, is_valid_scene_layout
+from office_score.batch_collisions import detect_collisions_batch
+
+"""
+Module: collision_benchmark
+
+Times the collision paths on every bundled office plan with fixed-seed candidate walls:
+
+  legacy     : detect_all_collisions on the raw plan, one call per candidate
+  scene      : detect_scene_collisions on the compiled scene, one call per candidate
+  early_exit : is_valid_scene_layout, one call per candidate
+  batch      : one detect_collisions_batch call for the whole candidate set
+
+Every candidate is checked on its own against the static scene (plan 0's preset walls
+already collide, so layouts including them would all be rejected). Every call is timed
+on its own: a call checks one wall on the per-candidate paths and the whole set on the
+batch path. The candidate set is checked repeatedly until a path has made at least
+BENCHMARK_MIN_CALLS calls. The report gives the mean and standard deviation of the
+call latency, percentiles only when there are enough calls to back them, and the
+throughput in walls per second. It is written as JSON under results/ so runs can be
+compared.
+
+Usage: python collision_benchmark.py [--plans 0 4 21] [--sizes 1 100] [--repeats 5] [--output results.json]
+"""
+
+BENCHMARK_PLANS = tuple(range(23))
+BENCHMARK_SIZES = (1, 10, 100, 1000)
+BENCHMARK_SEED = 0
+BENCHMARK_REPEATS = 5           # passes over the candidate set, at least
+BENCHMARK_MIN_CALLS = 200       # timed calls per path, at least
+PERCENTILES = (50, 90, 99)
+PERCENTILE_MIN_CALLS = 100      # fewer calls report the mean and standard deviation only
+RESULTS_FOLDER = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'results'))
+
+
+def candidate_walls(scene, plan, size, seed=BENCHMARK_SEED):
+    """Fixed-seed candidate walls (x, y, angle), drawn like llm.compare_penalties.generate_random_configurations."""
+    rng = np.random.default_rng([seed, plan, size])
+    max_x, max_y = scene.office_polygon.max(axis=0)
+    return np.column_stack([rng.uniform(0, max_x, size), rng.uniform(0, max_y, size), rng.uniform(-90, 90, size)])
+
+
+def collision_paths(plan, scene):
+    """
+    Returns {path name: (function, per_wall)} for one plan. A per_wall function takes one wall
+    (x, y, angle) and returns whether it collides; the others take the (N, 3) candidate set and
+    return its (N,) collision mask.
+    """
+    office_coordinates, windows, doors, desks, persons, disturbing_persons, objects, disturbing_points, moveable_walls = \
+        define_office_plan(plan)
+
+    def legacy(wall):
+        return bool(detect_all_collisions([wall], office_coordinates, doors, desks, persons, objects))
+
+    def scene_path(wall):
+        return bool(detect_scene_collisions([wall], scene))
+
+    def early_exit(wall):
+        return not is_valid_scene_layout([wall], scene)
+
+    def batch(walls):
+        return detect_collisions_batch(walls, scene)
+
+    return {'legacy': (legacy, True), 'scene': (scene_path, True), 'early_exit': (early_exit, True),
+            'batch': (batch, False)}
+
+
+def time_calls(function, arguments, passes):
+    """
+    Calls function on every argument, `passes` times over the list, and times every call.
+
+    Returns:
+      (results of the last pass, call latencies in seconds).
+    """
+    latencies = []
+    for _ in range(passes):
+        results = []
+        for argument in arguments:
+            start_time = time.perf_counter()
+            results.append(function(argument))
+            latencies.append(time.perf_counter() - start_time)
+    return results, latencies
+
+
+def latency_summary(latencies):
+    """Mean, standard deviation and minimum of latencies in ms, plus PERCENTILES if there are enough calls."""
+    latencies_ms = np.asarray(latencies) * 1000
+    summary = {
+        'mean': float(latencies_ms.mean()),
+        'stdev': float(latencies_ms.std(ddof=1)) if len(latencies_ms) > 1 else 0.0,
+        'min': float(latencies_ms.min()),
+    }
+    if len(latencies_ms) >= PERCENTILE_MIN_CALLS:
+        summary.update({f'p{q}': float(np.percentile(latencies_ms, q)) for q in PERCENTILES})
+    return summary
+
+
+def run_benchmark(plans=BENCHMARK_PLANS, sizes=BENCHMARK_SIZES, repeats=BENCHMARK_REPEATS, seed=BENCHMARK_SEED,
+                  min_calls=BENCHMARK_MIN_CALLS, verbose=True):
+    """
+    Benchmarks every collision path on every (plan, candidate set size), with at least `repeats`
+    passes over the candidate set and at least `min_calls` timed calls per path.
+
+    Returns:
+      A JSON-serializable dict with the environment and one result entry per (plan, size, path).
+      `agrees` tells whether the path gave the same collision mask as the legacy path.
+    """
+    results = []
+    for plan in plans:
+        scene = load_office_scene(plan)
+        paths = collision_paths(plan, scene)
+        for size in sizes:
+            walls = candidate_walls(scene, plan, size, seed)
+            reference = None
+            for name, (function, per_wall) in paths.items():
+                arguments = [tuple(wall) for wall in walls.tolist()] if per_wall else [walls]
+                passes = max(repeats, math.ceil(min_calls / len(arguments)))
+                # One untimed call warms up per-scene caches
+                function(arguments[0] if per_wall else walls[:1])
+                results_of_pass, latencies = time_calls(function, arguments, passes)
+                mask = np.array(results_of_pass, dtype=bool) if per_wall else results_of_pass[0]
+                if reference is None:
+                    reference = mask
+                entry = {
+                    'plan': plan,
+                    'size': size,
+                    'path': name,
+                    'call': 'wall' if per_wall else 'set',
+                    'calls': len(latencies),
+                    'latency_ms': latency_summary(latencies),
+                    'throughput_walls_per_s': float(size * passes / sum(latencies)),
+                    'collision_fraction': float(mask.mean()),
+                    'agrees': bool(np.array_equal(mask, reference)),
+                }
+                results.append(entry)
+                if verbose:
+                    latency = entry['latency_ms']
+                    tail = f"p{PERCENTILES[-1]}"
+                    tail = f", {tail} {latency[tail]:9.3f} ms" if tail in latency else ""
+                    print(f"Plan {plan:2d} size {size:5d} {name:10s}: {entry['calls']:5d} calls of one {entry['call']:4s} "
+                          f"{latency['mean']:9.3f} +- {latency['stdev']:7.3f} ms{tail}, "
+                          f"{entry['throughput_walls_per_s']:10.0f} walls/s"
+                          f"{'' if entry['agrees'] else '  MISMATCH'}")
+
+    return {
+        'created': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'seed': seed,
+        'repeats': repeats,
+        'min_calls': min_calls,
+        'results': results,
+    }
+
+
+# --------------------------
+# Example usage
+# --------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the collision paths on the bundled office plans.")
+    parser.add_argument('--plans', type=int, nargs='+', default=list(BENCHMARK_PLANS))
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(BENCHMARK_SIZES))
+    parser.add_argument('--repeats', type=int, default=BENCHMARK_REPEATS)
+    parser.add_argument('--seed', type=int, default=BENCHMARK_SEED)
+    parser.add_argument('--min-calls', type=int, default=BENCHMARK_MIN_CALLS)
+    parser.add_argument('--output', default=os.path.join(RESULTS_FOLDER, 'collision_benchmark.json'))
+    args = parser.parse_args()
+
+    report = run_benchmark(args.plans, args.sizes, args.repeats, args.seed, args.min_calls)
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=2)
+    print(f"Results written to {args.output}")
@@ -0,0 +1,155 @@
+import path_helper
+path_helper.add_project_path()
+
+import constants
+from office_score.check_collisions import (get_rectangle_polygon, get_polygon_axes, polygons_intersect,
+                                           check_scene_collision)
+from office_score.broad_phase import polygon_aabb, aabbs_overlap
+
+"""
+Module: collision_state
+
+Incremental collision bookkeeping for a layout of movable walls in one office scene.
+Optimizers and the LLM loop usually change one wall at a time; CollisionState keeps
+the obstacle hits of every wall and the wall-pair matrix, so a move only recomputes
+the row and column of the moved wall: O(obstacles + k) instead of O(k * obstacles + k^2).
+"""
+
+
+class CollisionState:
+    """
+    Collisions of a list of movable walls (x, y, angle) in a compiled OfficeScene.
+
+    `collisions` always equals check_collisions.detect_scene_collisions(walls, scene),
+    including the order of the entries.
+    """
+
+    def __init__(self, scene, moveable_walls=()):
+        self.scene = scene
+        self.walls = []
+        self._polys = []
+        self._aabbs = []
+        self._obstacle_hits = []   # per wall: sorted obstacle columns it hits
+        self._pair_hits = []       # k x k symmetric matrix of wall-wall collisions
+        self._num_collisions = 0
+        for wall in moveable_walls:
+            self.add_wall(wall)
+
+    def __len__(self):
+        return len(self.walls)
+
+    def _obstacle_row(self, poly, aabb):
+        axes = get_polygon_axes(poly)
+        hits = []
+        # The office outline is always tested, the other obstacles only when their boxes overlap
+        for k in [self.scene.outline_column] + self.scene.obstacle_grid.query(aabb):
+            shape, geometry = self.scene.obstacle_shapes[k]
+            if check_scene_collision(poly, axes, shape, geometry):
+                hits.append(k)
+        return hits
+
+    def _pair_row(self, i):
+        poly = self._polys[i]
+        aabb = self._aabbs[i]
+        return [j != i and aabbs_overlap(aabb, self._aabbs[j]) and polygons_intersect(poly, self._polys[j])
+                for j in range(len(self.walls))]
+
+    def _set_wall(self, i, wall):
+        poly = get_rectangle_polygon(wall[0], wall[1], constants.MOVABLE_WALL_LENGTH, constants.MOVABLE_WALL_WIDTH,
+                                     wall[2])
+        self.walls[i] = wall
+        self._polys[i] = poly
+        self._aabbs[i] = polygon_aabb(poly)
+
+        self._num_collisions -= len(self._obstacle_hits[i]) + sum(self._pair_hits[i])
+        self._obstacle_hits[i] = self._obstacle_row(poly, self._aabbs[i])
+        row = self._pair_row(i)
+        for j, hit in enumerate(row):
+            self._pair_hits[j][i] = hit
+        self._pair_hits[i] = row
+        self._num_collisions += len(self._obstacle_hits[i]) + sum(row)
+
+    def add_wall(self, wall):
+        """Appends a wall (x, y, angle) to the layout and returns its index."""
+        self.walls.append(None)
+        self._polys.append(None)
+        self._aabbs.append(None)
+        self._obstacle_hits.append([])
+        for row in self._pair_hits:
+            row.append(False)
+        self._pair_hits.append([False] * len(self.walls))
+        self._set_wall(len(self.walls) - 1, wall)
+        return len(self.walls) - 1
+
+    def remove_wall(self, i):
+        """Removes wall i; the walls after it move up by one index."""
+        self._num_collisions -= len(self._obstacle_hits[i]) + sum(self._pair_hits[i])
+        for row in self._pair_hits:
+            del row[i]
+        for lst in (self.walls, self._polys, self._aabbs, self._obstacle_hits, self._pair_hits):
+            del lst[i]
+
+    def move_wall(self, i, x, y, angle):
+        """Moves wall i to (x, y, angle), recomputing only its obstacle row and its pair row/column."""
+        self._set_wall(i, (x, y, angle))
+
+    @property
+    def is_valid(self) -> bool:
+        """True if no wall collides with the scene or with another wall."""
+        return self._num_collisions == 0
+
+    @property
+    def collisions(self):
+        """
+        The current collisions in the format of detect_scene_collisions:
+        a list of (movable_wall, object_type, other_object) tuples.
+        """
+        collisions = []
+        for i, mw in enumerate(self.walls):
+            for k in self._obstacle_hits[i]:
+                object_type, info = self.scene.obstacles[k]
+                collisions.append((mw, object_type, info))
+            for j in range(i + 1, len(self.walls)):
+                if self._pair_hits[i][j]:
+                    collisions.append((mw, constants.MOVABLE_WALL_COLLISION, self.walls[j]))
+        return collisions
+
+
+# --------------------------
+# Example usage: random single-wall moves against full recomputation
+# --------------------------
+if __name__ == "__main__":
+    import random
+    import time
+    from office_score.office_scene import load_office_scene
+    from office_score.check_collisions import detect_scene_collisions
+
+    random.seed(0)
+    for plan in (0, 4, 21, 22):
+        scene = load_office_scene(plan)
+        max_x, max_y = scene.office_polygon.max(axis=0)
+
+        def random_wall():
+            return (random.uniform(0, max_x), random.uniform(0, max_y), random.uniform(-90, 90))
+
+        state = CollisionState(scene, list(scene.moveable_walls) + [random_wall() for _ in range(5)])
+        moves = [(random.randrange(len(state)), *random_wall()) for _ in range(2000)]
+
+        mismatches = 0
+        incremental_time = 0.0
+        full_time = 0.0
+        for i, x, y, angle in moves:
+            start_time = time.perf_counter()
+            state.move_wall(i, x, y, angle)
+            incremental_time += time.perf_counter() - start_time
+
+            start_time = time.perf_counter()
+            expected = detect_scene_collisions(state.walls, scene)
+            full_time += time.perf_counter() - start_time
+            mismatches += state.collisions != expected or state.is_valid != (not expected)
+
+        state.remove_wall(0)
+        state.add_wall(random_wall())
+        mismatches += state.collisions != detect_scene_collisions(state.walls, scene)
+        print(f"Plan {plan:2d}: {len(state)} walls, {mismatches} mismatches, "
+              f"move {incremental_time / len(moves) * 1e6:.0f} us vs full {full_time / len(moves) * 1e6:.0f} us")
@@ -0,0 +1,215 @@
+import path_helper
+path_helper.add_project_path()
+
+import math
+import weakref
+from dataclasses import dataclass
+import numpy as np
+
+import constants
+from office_score.batch_collisions import detect_collisions_batch, distance_points_to_segments, points_in_polygons
+
+"""
+Module: free_space
+
+Configuration-space map of a single movable wall. The sampling domain of
+generate_random_configurations, x in [0, max_x], y in [0, max_y], angle in [-90, 90],
+is divided into cells. A cell is marked feasible unless every wall in it is certain to
+collide. Sampling uniformly from the marked cells and verifying each draw exactly
+then gives uniform samples of the free space, without the waste of drawing over the
+whole bounding box.
+
+A whole cell is proven infeasible in two ways:
+  - a core rectangle that lies inside every wall of the cell hits a static obstacle;
+  - the region swept by one wall corner across the cell lies entirely outside the outline.
+"""
+
+DEFAULT_CELL_SIZE = 0.1     # metres, in x and y
+DEFAULT_ANGLE_BINS = 36     # 5 degree bins over [-90, 90)
+ANGLE_RANGE = (-90.0, 90.0)
+
+# Extra shrink of the core rectangle, keeps touching cores from rejecting a cell on rounding
+CORE_MARGIN = 1e-6
+
+
+@dataclass(frozen=True, eq=False)
+class FreeSpaceMap:
+    """
+    Occupancy of the (x, y, angle) cells of one scene.
+
+    feasible[i, j, k] covers x in [i, i+1) * cell_x, y in [j, j+1) * cell_y and
+    angle in ANGLE_RANGE[0] + [k, k+1) * cell_angle. False cells contain no valid wall.
+    """
+    scene: object
+    cell_x: float
+    cell_y: float
+    cell_angle: float
+    feasible: np.ndarray
+    feasible_cells: np.ndarray   # flat indices of the feasible cells
+
+    @property
+    def cell_fraction(self) -> float:
+        """Share of the sampling domain covered by feasible cells; an upper bound of the free share."""
+        return len(self.feasible_cells) / self.feasible.size
+
+    def sample(self, num_samples, rng=None, batch_size=None):
+        """
+        Draws valid walls uniformly from the free configuration space.
+
+        Cells are chosen uniformly among the feasible ones, a wall is drawn uniformly inside
+        the cell and kept only if the exact batch collision check accepts it.
+
+        Returns:
+          (samples, draws): an array of shape (num_samples, 3) and the number of candidates drawn.
+        """
+        rng = np.random.default_rng(rng)
+        if not len(self.feasible_cells):
+            raise ValueError("The scene has no feasible wall placement.")
+        batch_size = batch_size or max(num_samples, 64)
+
+        samples = []
+        found = 0
+        draws = 0
+        while found < num_samples:
+            cells = rng.choice(self.feasible_cells, batch_size)
+            i, j, k = np.unravel_index(cells, self.feasible.shape)
+            offsets = rng.random((batch_size, 3))
+            candidates = np.column_stack([
+                (i + offsets[:, 0]) * self.cell_x,
+                (j + offsets[:, 1]) * self.cell_y,
+                ANGLE_RANGE[0] + (k + offsets[:, 2]) * self.cell_angle,
+            ])
+            valid = candidates[~detect_collisions_batch(candidates, self.scene)]
+            samples.append(valid[:num_samples - found])
+            found += len(samples[-1])
+            draws += batch_size
+        return np.concatenate(samples), draws
+
+    def feasible_volume_fraction(self, num_samples=2000, rng=None) -> float:
+        """
+        Estimates the share of the sampling domain where a single wall is valid, as
+        cell_fraction times the acceptance rate of exact verification inside feasible cells.
+        """
+        rng = np.random.default_rng(rng)
+        cells = rng.choice(self.feasible_cells, num_samples)
+        i, j, k = np.unravel_index(cells, self.feasible.shape)
+        offsets = rng.random((num_samples, 3))
+        candidates = np.column_stack([
+            (i + offsets[:, 0]) * self.cell_x,
+            (j + offsets[:, 1]) * self.cell_y,
+            ANGLE_RANGE[0] + (k + offsets[:, 2]) * self.cell_angle,
+        ])
+        accepted = np.count_nonzero(~detect_collisions_batch(candidates, self.scene))
+        return self.cell_fraction * accepted / num_samples
+
+
+def _outline_signed_distance(points, polygon):
+    """Distance of points (..., 2) to the outline, negative outside the office."""
+    edges_a = polygon
+    edges_b = np.roll(polygon, -1, axis=0)
+    distance = distance_points_to_segments(points[..., None, :], edges_a, edges_b).min(axis=-1)
+    inside = points_in_polygons(points, polygon[None])
+    return np.where(inside, distance, -distance)
+
+
+def build_free_space_map(scene, cell_size=DEFAULT_CELL_SIZE, angle_bins=DEFAULT_ANGLE_BINS) -> FreeSpaceMap:
+    """
+    Marks the feasible cells of a scene with the batch collision path.
+
+    Every configuration in a cell lies within `translation` of the cell centre and within
+    `rotation` (radians) of its angle, so a point p of the wall moves by at most
+    translation + |p| * rotation. Shrinking the wall by that amount gives a core
+    rectangle contained in every wall of the cell.
+
+    Raises:
+      ValueError: if the cells are too coarse to leave a core inside the wall.
+    """
+    max_x = float(scene.office_polygon[:, 0].max())
+    max_y = float(scene.office_polygon[:, 1].max())
+    nx = max(1, math.ceil(max_x / cell_size))
+    ny = max(1, math.ceil(max_y / cell_size))
+    cell_x = max_x / nx
+    cell_y = max_y / ny
+    cell_angle = (ANGLE_RANGE[1] - ANGLE_RANGE[0]) / angle_bins
+
+    half_length = constants.MOVABLE_WALL_LENGTH / 2
+    half_width = constants.MOVABLE_WALL_WIDTH / 2
+    translation = math.hypot(cell_x, cell_y) / 2
+    rotation = math.radians(cell_angle / 2)
+    shrink = translation + math.hypot(half_length, half_width) * rotation + CORE_MARGIN
+    if shrink >= half_width:
+        raise ValueError(f"Cells of {cell_size} m and {cell_angle} degrees are too coarse for a wall of width "
+                         f"{constants.MOVABLE_WALL_WIDTH}.")
+
+    xs = (np.arange(nx) + 0.5) * cell_x
+    ys = (np.arange(ny) + 0.5) * cell_y
+    angles = ANGLE_RANGE[0] + (np.arange(angle_bins) + 0.5) * cell_angle
+    grid = np.stack(np.meshgrid(xs, ys, angles, indexing='ij'), axis=-1).reshape(-1, 3)
+
+    # Static obstacles: the core rectangle lies in every wall of the cell
+    _, matrix = detect_collisions_batch(grid, scene, return_matrix=True,
+                                        length=2 * (half_length - shrink), width=2 * (half_width - shrink))
+    matrix[:, scene.outline_column] = False
+    infeasible = matrix.any(axis=1)
+
+    # Outline: a corner moves by at most translation + |corner| * rotation
+    rad = np.radians(grid[:, 2])
+    cos_a = np.cos(rad)[:, None]
+    sin_a = np.sin(rad)[:, None]
+    dx = np.array([-half_length, half_length, half_length, -half_length])[None]
+    dy = np.array([-half_width, -half_width, half_width, half_width])[None]
+    corners = np.stack([grid[:, 0:1] + dx * cos_a - dy * sin_a, grid[:, 1:2] + dx * sin_a + dy * cos_a], axis=-1)
+    corner_reach = translation + math.hypot(half_length, half_width) * rotation + CORE_MARGIN
+    outline_distance = _outline_signed_distance(corners, np.asarray(scene.office_polygon, dtype=float))
+    infeasible |= (outline_distance < -corner_reach).any(axis=1)
+
+    feasible = ~infeasible.reshape(nx, ny, angle_bins)
+    feasible.setflags(write=False)
+    feasible_cells = np.flatnonzero(feasible)
+    feasible_cells.setflags(write=False)
+    return FreeSpaceMap(scene, cell_x, cell_y, cell_angle, feasible, feasible_cells)
+
+
+_FREE_SPACE_MAPS = weakref.WeakKeyDictionary()
+
+def get_free_space_map(scene, cell_size=DEFAULT_CELL_SIZE, angle_bins=DEFAULT_ANGLE_BINS) -> FreeSpaceMap:
+    """Returns the free-space map of a scene, building it on first use and caching it per scene."""
+    maps = _FREE_SPACE_MAPS.setdefault(scene, {})
+    if (cell_size, angle_bins) not in maps:
+        maps[(cell_size, angle_bins)] = build_free_space_map(scene, cell_size, angle_bins)
+    return maps[(cell_size, angle_bins)]
+
+
+# --------------------------
+# Example usage: no valid wall outside the feasible cells, sampling cost per plan
+# --------------------------
+if __name__ == "__main__":
+    import time
+    from office_score.office_scene import load_office_scene
+
+    rng = np.random.default_rng(0)
+    for plan in range(23):
+        scene = load_office_scene(plan)
+        start_time = time.perf_counter()
+        free_space = get_free_space_map(scene)
+        build_time = time.perf_counter() - start_time
+
+        # Every valid uniform draw must fall in a feasible cell
+        max_x, max_y = scene.office_polygon.max(axis=0)
+        walls = np.column_stack([rng.uniform(0, max_x, 20000), rng.uniform(0, max_y, 20000),
+                                 rng.uniform(-90, 90, 20000)])
+        valid = walls[~detect_collisions_batch(walls, scene)]
+        i = np.minimum((valid[:, 0] / free_space.cell_x).astype(int), free_space.feasible.shape[0] - 1)
+        j = np.minimum((valid[:, 1] / free_space.cell_y).astype(int), free_space.feasible.shape[1] - 1)
+        k = np.minimum(((valid[:, 2] - ANGLE_RANGE[0]) / free_space.cell_angle).astype(int),
+                       free_space.feasible.shape[2] - 1)
+        missed = np.count_nonzero(~free_space.feasible[i, j, k])
+
+        start_time = time.perf_counter()
+        samples, draws = free_space.sample(1000, rng)
+        sample_time = time.perf_counter() - start_time
+
+        print(f"Plan {plan:2d}: built in {build_time:.2f} s, {free_space.cell_fraction:.1%} cells feasible, "
+              f"free volume ~{free_space.feasible_volume_fraction(rng=rng):.1%} "
+              f"(rejection acceptance {len(valid) / len(walls):.1%}), {missed} valid walls outside, "
+              f"1000 samples from {draws} draws in {sample_time*1000:.0f} ms")
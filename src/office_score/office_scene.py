@@ -0,0 +1,337 @@
+import path_helper
+path_helper.add_project_path()
+
+import math
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import NamedTuple
+import numpy as np
+
+import constants
+import utils.utils_desk as utils_desk
+from office_score.check_collisions import get_rectangle_polygon, get_polygon_axes, project_polygon, get_door_sector, angle_in_sweep
+from office_score.broad_phase import ObstacleGrid, polygon_aabb, AABB_PADDING
+from office_plans.office_plan import define_office_plan
+
+"""
+Module: office_scene
+
+Compiles the static part of an office plan (outline, desks, chairs, doors, persons
+and objects) into NumPy arrays once, so collision and penalty checks only have to
+do work for the movable walls.
+"""
+
+# --------------------------
+# Compiled obstacle groups
+# --------------------------
+class PolygonGroup(NamedTuple):
+    """Convex polygons with the same vertex count, tested with SAT."""
+    columns: np.ndarray    # (G,) obstacle index of every polygon
+    polygons: np.ndarray   # (G, n, 2) vertices
+    axes: np.ndarray       # (G, n, 2) normalized edge normals
+    proj_min: np.ndarray   # (G, n) projection of each polygon onto its own axes
+    proj_max: np.ndarray   # (G, n)
+
+
+class CircleGroup(NamedTuple):
+    """Chairs and round objects."""
+    columns: np.ndarray    # (C,)
+    centers: np.ndarray    # (C, 2)
+    radii: np.ndarray      # (C,)
+
+
+class SectorGroup(NamedTuple):
+    """Door swings as exact circular sectors, see check_collisions.get_door_sector."""
+    columns: np.ndarray       # (D,)
+    centers: np.ndarray       # (D, 2) hinges
+    radii: np.ndarray         # (D,)
+    start_angles: np.ndarray  # (D,) radians
+    sweeps: np.ndarray        # (D,) signed radians, positive counterclockwise
+    start_points: np.ndarray  # (D, 2) end of the closed door
+    end_points: np.ndarray    # (D, 2) end of the fully opened door
+
+
+class OutlineEdges(NamedTuple):
+    """Edges of the office outline, tested against walls that straddle a notch of a concave outline."""
+    convex: bool           # convex outlines only need the corner test
+    starts: np.ndarray     # (E, 2) edge e runs from starts[e] to ends[e]
+    ends: np.ndarray       # (E, 2)
+    aabbs: np.ndarray      # (E, 4) padded bounding boxes of the edges
+
+
+class PointGroup(NamedTuple):
+    """Persons, which collide when they stand inside a wall."""
+    columns: np.ndarray    # (P,)
+    points: np.ndarray     # (P, 2)
+
+
+@dataclass(frozen=True, eq=False)
+class OfficeScene:
+    """
+    Immutable, precompiled version of the tuple returned by define_office_plan().
+
+    The plain plan data is kept as tuples. `obstacles` lists every static obstacle as
+    (object_type, info) in the order detect_all_collisions checks them.
+    `obstacle_shapes` holds the matching precomputed geometry as (shape, geometry) for the
+    scalar path (check_collisions.detect_scene_collisions); the array groups hold the same
+    geometry for the batch path and refer back into `obstacles` through their `columns`.
+    `obstacle_aabbs` and `obstacle_grid` are the broad phase: padded bounding boxes of all
+    obstacles and a uniform grid over them (the office outline is not in the grid, it is
+    always tested). `outline_edges` indexes the outline edges for the exact containment test.
+    `office_walls` holds the same edges as one contiguous (E, 2, 2) segment array, the
+    static line-of-sight blockers of the penalty score.
+    """
+    office_coordinates: tuple
+    windows: tuple
+    doors: tuple
+    desks: tuple
+    persons: tuple
+    disturbing_persons: tuple
+    objects: tuple
+    disturbing_points: tuple
+    moveable_walls: tuple
+
+    office_polygon: np.ndarray
+    obstacles: tuple
+    obstacle_shapes: tuple
+    outline_column: int
+    outline_edges: OutlineEdges
+    office_walls: np.ndarray
+    polygon_groups: tuple
+    sectors: SectorGroup
+    circles: CircleGroup
+    points: PointGroup
+    obstacle_aabbs: np.ndarray
+    obstacle_grid: ObstacleGrid
+
+    @property
+    def office_plan(self):
+        """The scene as the 9-tuple returned by define_office_plan()."""
+        return (self.office_coordinates, list(self.windows), list(self.doors), list(self.desks), list(self.persons),
+                list(self.disturbing_persons), list(self.objects), list(self.disturbing_points), list(self.moveable_walls))
+
+# --------------------------
+# Helpers
+# --------------------------
+def office_polygon(office_coordinates):
+    """Returns the corners of the office outline as a list of (x, y) tuples."""
+    if office_coordinates[0] == constants.OFFICE_RECTANGLE:
+        office_length, office_width = office_coordinates[1]
+        return [(0, 0), (office_length, 0), (office_length, office_width), (0, office_width)]
+    return list(office_coordinates[1])
+
+
+def list_obstacles(office_coordinates, doors, desks, persons, objects):
+    """
+    Lists every static obstacle of an office plan in the order detect_all_collisions checks them.
+
+    Returns:
+      A list of (object_type, info) tuples. The info part is the same value
+      detect_all_collisions puts in its collision tuples.
+    """
+    obstacles = [(constants.WALL_COLLISION, office_coordinates)]
+    obstacles += [(constants.DESK_COLLISION, desk) for desk in desks]
+    for desk in desks:
+        chair_center = utils_desk.get_chair_coordinate(desk)
+        obstacles.append((constants.CHAIR_COLLISION, (chair_center[0], chair_center[1], constants.CHAIR_RADIUS)))
+    obstacles += [(constants.DOOR_COLLISION, door) for door in doors]
+    obstacles += [(constants.PERSON_COLLISION, person) for person in persons]
+    obstacles += [(constants.OBJECT_COLLISION, obj) for obj in objects]
+    return obstacles
+
+
+def compile_obstacle_shape(object_type, info):
+    """
+    Precomputes the geometry of one static obstacle.
+
+    Returns:
+      (shape, geometry) where geometry is
+        SHAPE_OUTLINE : (office corners, convex flag, ObstacleGrid over the outline edges)
+        SHAPE_POLYGON : (polygon, axes, projections of the polygon onto its own axes)
+        SHAPE_SECTOR  : check_collisions.get_door_sector of a door
+        SHAPE_CIRCLE  : (center, radius)
+        SHAPE_POINT   : (x, y)
+    """
+    def polygon_shape(poly):
+        poly = tuple(poly)
+        axes = tuple(get_polygon_axes(poly))
+        projections = tuple(project_polygon(poly, axis) for axis in axes)
+        return constants.SHAPE_POLYGON, (poly, axes, projections)
+
+    if object_type == constants.WALL_COLLISION:
+        return constants.SHAPE_OUTLINE, compile_outline(office_polygon(info))
+    elif object_type == constants.DESK_COLLISION:
+        x, y, orientation, desk_length, desk_width = info
+        return polygon_shape([
+            (x - desk_length/2, y - desk_width/2),
+            (x + desk_length/2, y - desk_width/2),
+            (x + desk_length/2, y + desk_width/2),
+            (x - desk_length/2, y + desk_width/2)
+        ])
+    elif object_type == constants.CHAIR_COLLISION:
+        return constants.SHAPE_CIRCLE, ((info[0], info[1]), info[2])
+    elif object_type == constants.DOOR_COLLISION:
+        return constants.SHAPE_SECTOR, get_door_sector(*info)
+    elif object_type == constants.PERSON_COLLISION:
+        return constants.SHAPE_POINT, info
+    elif object_type == constants.OBJECT_COLLISION:
+        if info[0] == constants.OBJECT_POLYGON:
+            return polygon_shape(list(info[1]))
+        if info[0] == constants.OBJECT_RECTANGLE:
+            x, y, length, width = info[1]
+            return polygon_shape(get_rectangle_polygon(x, y, length, width, 0))
+        if info[0] == constants.OBJECT_ROUND:
+            x, y, radius = info[1]
+            return constants.SHAPE_CIRCLE, ((x, y), radius)
+    raise ValueError("Unsupported object_type for collision detection.")
+
+
+def polygon_is_convex(poly):
+    """True if the corners of the polygon turn in one direction only."""
+    turns = set()
+    n = len(poly)
+    for i in range(n):
+        a, b, c = poly[i], poly[(i + 1) % n], poly[(i + 2) % n]
+        cross = (b[0] - a[0]) * (c[1] - b[1]) - (b[1] - a[1]) * (c[0] - b[0])
+        if cross:
+            turns.add(cross > 0)
+    return len(turns) <= 1
+
+
+def outline_edge_aabbs(outline):
+    """Padded bounding boxes of the outline edges, edge i running from outline[i] to outline[i + 1]."""
+    n = len(outline)
+    return [polygon_aabb([outline[e], outline[(e + 1) % n]], AABB_PADDING) for e in range(n)]
+
+
+def compile_outline(outline):
+    """Office corners, convex flag and a uniform grid over the outline edges, see check_collisions.polygon_inside_outline."""
+    outline = tuple(outline)
+    edge_grid = ObstacleGrid(outline_edge_aabbs(outline), range(len(outline)), cell_size=constants.MOVABLE_WALL_LENGTH)
+    return outline, polygon_is_convex(outline), edge_grid
+
+
+def _frozen(array):
+    array.setflags(write=False)
+    return array
+
+
+def compile_polygon_groups(obstacle_shapes):
+    """Groups the SHAPE_POLYGON obstacles by vertex count into arrays for the batch path."""
+    grouped = {}
+    for column, (shape, geometry) in enumerate(obstacle_shapes):
+        if shape == constants.SHAPE_POLYGON:
+            grouped.setdefault(len(geometry[0]), []).append((column, geometry))
+
+    groups = []
+    for members in grouped.values():
+        columns = np.asarray([column for column, _ in members], dtype=int)
+        polys = np.asarray([poly for _, (poly, axes, projections) in members], dtype=float)
+        axes = np.asarray([axes for _, (poly, axes, projections) in members], dtype=float)
+        projections = np.asarray([projections for _, (poly, axes, projections) in members], dtype=float)
+        groups.append(PolygonGroup(*(_frozen(array) for array in
+                                     (columns, polys, axes, projections[..., 0], projections[..., 1]))))
+    return tuple(groups)
+
+def compile_sector_group(obstacle_shapes):
+    """Collects the SHAPE_SECTOR obstacles (door swings) into arrays for the batch path."""
+    members = [(column, sector) for column, (shape, sector) in enumerate(obstacle_shapes)
+               if shape == constants.SHAPE_SECTOR]
+
+    def field(index, shape):
+        return _frozen(np.asarray([sector[index] for _, sector in members], dtype=float).reshape(shape))
+
+    return SectorGroup(
+        columns=_frozen(np.asarray([column for column, _ in members], dtype=int)),
+        centers=field(0, (-1, 2)),
+        radii=field(1, (-1,)),
+        start_angles=field(2, (-1,)),
+        sweeps=field(3, (-1,)),
+        start_points=field(4, (-1, 2)),
+        end_points=field(5, (-1, 2)),
+    )
+
+
+def obstacle_aabb(shape, geometry):
+    """Padded bounding box (min_x, min_y, max_x, max_y) of a compiled obstacle."""
+    if shape == constants.SHAPE_POLYGON:
+        return polygon_aabb(geometry[0], AABB_PADDING)
+    if shape == constants.SHAPE_SECTOR:
+        # Hinge, both radius ends, and every axis-extreme point of the circle inside the sweep
+        center, radius, start_angle, sweep, start_point, end_point = geometry
+        points = [center, start_point, end_point]
+        for quarter in range(4):
+            angle = quarter * math.pi / 2
+            if angle_in_sweep(angle, start_angle, sweep):
+                points.append((center[0] + radius * math.cos(angle), center[1] + radius * math.sin(angle)))
+        return polygon_aabb(points, AABB_PADDING)
+    if shape == constants.SHAPE_CIRCLE:
+        (x, y), radius = geometry
+        return polygon_aabb([(x - radius, y - radius), (x + radius, y + radius)], AABB_PADDING)
+    if shape == constants.SHAPE_POINT:
+        return polygon_aabb([geometry], AABB_PADDING)
+    if shape == constants.SHAPE_OUTLINE:
+        return polygon_aabb(geometry[0], AABB_PADDING)
+    raise ValueError("Unsupported shape for collision detection.")
+
+# --------------------------
+# Scene compiler
+# --------------------------
+def compile_office_scene(office_plan) -> OfficeScene:
+    """
+    Builds an OfficeScene from the tuple returned by define_office_plan().
+
+    Parameters:
+      office_plan: (office_coordinates, windows, doors, desks, persons, disturbing_persons,
+                    objects, disturbing_points, moveable_walls)
+    """
+    office_coordinates, windows, doors, desks, persons, disturbing_persons, objects, disturbing_points, moveable_walls = \
+        office_plan
+
+    obstacles = list_obstacles(office_coordinates, doors, desks, persons, objects)
+    obstacle_shapes = [compile_obstacle_shape(object_type, info) for object_type, info in obstacles]
+    circles = [(column, geometry) for column, (shape, geometry) in enumerate(obstacle_shapes)
+               if shape == constants.SHAPE_CIRCLE]
+    points = [(column, geometry) for column, (shape, geometry) in enumerate(obstacle_shapes)
+              if shape == constants.SHAPE_POINT]
+    aabbs = np.asarray([obstacle_aabb(shape, geometry) for shape, geometry in obstacle_shapes], dtype=float)
+    grid_columns = [column for column, (shape, _) in enumerate(obstacle_shapes) if shape != constants.SHAPE_OUTLINE]
+    outline, convex, _ = obstacle_shapes[0][1]
+
+    return OfficeScene(
+        office_coordinates=office_coordinates,
+        windows=tuple(windows),
+        doors=tuple(doors),
+        desks=tuple(desks),
+        persons=tuple(persons),
+        disturbing_persons=tuple(disturbing_persons),
+        objects=tuple(objects),
+        disturbing_points=tuple(disturbing_points),
+        moveable_walls=tuple(moveable_walls),
+        office_polygon=_frozen(np.asarray(office_polygon(office_coordinates), dtype=float)),
+        obstacles=tuple(obstacles),
+        obstacle_shapes=tuple(obstacle_shapes),
+        outline_column=0,
+        outline_edges=OutlineEdges(convex,
+                                   _frozen(np.asarray(outline, dtype=float)),
+                                   _frozen(np.roll(np.asarray(outline, dtype=float), -1, axis=0)),
+                                   _frozen(np.asarray(outline_edge_aabbs(outline), dtype=float))),
+        office_walls=_frozen(np.ascontiguousarray(np.stack([np.asarray(outline, dtype=float),
+                                                            np.roll(np.asarray(outline, dtype=float), -1, axis=0)],
+                                                           axis=1))),
+        polygon_groups=compile_polygon_groups(obstacle_shapes),
+        sectors=compile_sector_group(obstacle_shapes),
+        circles=CircleGroup(_frozen(np.asarray([column for column, _ in circles], dtype=int)),
+                            _frozen(np.asarray([center for _, (center, radius) in circles], dtype=float).reshape(-1, 2)),
+                            _frozen(np.asarray([radius for _, (center, radius) in circles], dtype=float))),
+        points=PointGroup(_frozen(np.asarray([column for column, _ in points], dtype=int)),
+                          _frozen(np.asarray([point for _, point in points], dtype=float).reshape(-1, 2))),
+        obstacle_aabbs=_frozen(aabbs),
+        obstacle_grid=ObstacleGrid(aabbs[grid_columns], grid_columns, cell_size=constants.MOVABLE_WALL_LENGTH),
+    )
+
+
+@lru_cache(maxsize=None)
+def load_office_scene(current_office_plan=constants.CURRENT_OFFICE_PLAN) -> OfficeScene:
+    """Returns the compiled scene of a bundled office plan. Scenes are built once and cached."""
+    return compile_office_scene(define_office_plan(current_office_plan))
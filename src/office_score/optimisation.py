@@ -2,62 +2,347 @@ import pretty_errors
 
 import path_helper
 path_helper.add_project_path()
-from office_score.penalty_score import compute_office_penalty
-from office_plans.office_plan import define_office_plan
-from check_collisions import detect_all_collisions
+
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from typing import NamedTuple
 import numpy as np
 from scipy.optimize import basinhopping
-import time
 
-i = 0
-def objective_function(params):
+import constants
+from office_score.penalty_score import get_penalty_rays, compute_precomputed_penalties
+from office_score.office_scene import load_office_scene
+from office_score.check_collisions import is_valid_scene_layout, detect_scene_collisions
+from office_score.free_space import get_free_space_map
+
+"""
+Module: optimisation
+
+Optimizes the position of added movable walls in an office scene. LayoutObjective is the
+objective of the search: it is built once per scene and keeps the compiled scene, the
+walls that stay in place and the penalty rays with the office-wall occlusion already
+resolved, so an evaluation is one collision check and one penalty computation of the
+open rays. It counts its evaluations and times every one of them.
+
+basinhopping_search runs scipy's basinhopping on it from one initial guess.
+multistart_search places k walls by running many short basinhopping chains from feasible
+layouts drawn from the free-space map. Every start has its own random stream, spawned from
+one seed, so a start gives the same result on any worker and with any number of workers.
+The starts are spread over a process pool. The parent builds the free-space map and the
+penalty rays, and every worker receives them once with the scene instead of rebuilding
+them. The best results are merged as the starts finish. A wall-clock budget stops the running chains
+at their next iteration and skips the starts that have not begun.
+
+Nothing runs on import; running the module places constants.NUMBER_OF_MOVABLE_WALLS walls
+in the current office plan and draws the result.
+"""
+
+DEFAULT_INITIAL_GUESS = (3.0, 3.0, 90.0)  # (x, y, angle) of the added wall
+DEFAULT_NITER = 1000                      # basinhopping iterations
+DEFAULT_STEPSIZE = 1.0                    # basinhopping step size
+DEFAULT_TEMPERATURE = 3.0                 # basinhopping temperature T
+DEFAULT_STARTS = 32                       # independent starts of multistart_search
+DEFAULT_START_NITER = 50                  # basinhopping iterations per start
+DEFAULT_KEEP = 8                          # best results multistart_search returns
+SEED_ATTEMPTS = 1000                      # free-space draws of an initial layout before giving up
+
+
+@dataclass
+class ObjectiveStats:
+    """
+    Counters and timings of the evaluations of a LayoutObjective.
+    """
+    evaluations: int = 0
+    infeasible: int = 0                 # evaluations rejected by the collision check
+    collision_time: float = 0.0         # seconds in the collision check
+    penalty_time: float = 0.0           # seconds in the penalty computation
+    evaluation_times: list = field(default_factory=list)   # seconds of every evaluation, in call order
+    best_score: float = math.inf
+    best_walls: tuple = ()              # added walls of the best evaluation
+
+    @property
+    def total_time(self) -> float:
+        return sum(self.evaluation_times)
+
+    @property
+    def mean_evaluation_time(self) -> float:
+        return self.total_time / self.evaluations if self.evaluations else 0.0
+
+    def reset(self):
+        self.evaluations = 0
+        self.infeasible = 0
+        self.collision_time = 0.0
+        self.penalty_time = 0.0
+        self.evaluation_times = []
+        self.best_score = math.inf
+        self.best_walls = ()
+
+
+class LayoutObjective:
+    """
+    Penalty score of a scene with k added walls, as a function of params = [x1, y1, angle1, ..., xk, yk, anglek].
+    Infeasible layouts (any collision) score np.inf.
+
+    fixed_walls stay in every layout; by default they are the scene's movable walls. penalty_rays
+    are those of get_penalty_rays(scene, disturbing_points) unless given.
+    """
+
+    def __init__(self, scene, fixed_walls=None, alpha:float=10, beta:float=0.5, gamma:float=0.5,
+                 disturbing_points:bool=False, penalty_rays=None):
+        self.scene = scene
+        self.fixed_walls = [tuple(wall) for wall in (scene.moveable_walls if fixed_walls is None else fixed_walls)]
+        self.alpha = alpha
+        self.beta = beta
+        self.gamma = gamma
+        self.penalty_rays = get_penalty_rays(scene, disturbing_points) if penalty_rays is None else penalty_rays
+        self.stats = ObjectiveStats()
+
+    def walls(self, params):
+        """The added walls of params as a list of (x, y, angle) tuples."""
+        return [tuple(wall) for wall in np.reshape(np.asarray(params, dtype=float), (-1, 3)).tolist()]
+
+    def __call__(self, params):
+        start_time = time.perf_counter()
+        added_walls = self.walls(params)
+        movable_walls = self.fixed_walls + added_walls
+
+        valid = is_valid_scene_layout(movable_walls, self.scene)
+        collision_end = time.perf_counter()
+        if valid:
+            score = sum(compute_precomputed_penalties(self.penalty_rays, movable_walls,
+                                                      self.alpha, self.beta, self.gamma))
+        else:
+            score = np.inf
+        end_time = time.perf_counter()
+
+        stats = self.stats
+        stats.evaluations += 1
+        stats.infeasible += not valid
+        stats.collision_time += collision_end - start_time
+        stats.penalty_time += end_time - collision_end
+        stats.evaluation_times.append(end_time - start_time)
+        if score < stats.best_score:
+            stats.best_score = score
+            stats.best_walls = tuple(added_walls)
+        return score
+
+
+class SearchResult(NamedTuple):
+    """Outcome of an optimizer run."""
+    walls: np.ndarray       # (k, 3) best added walls (x, y, angle)
+    score: float
+    evaluations: int
+    elapsed: float          # wall-clock seconds
+    stats: ObjectiveStats
+
+
+def basinhopping_search(scene, initial_guess=DEFAULT_INITIAL_GUESS, niter:int=DEFAULT_NITER,
+                        stepsize:float=DEFAULT_STEPSIZE, temperature:float=DEFAULT_TEMPERATURE, seed=None,
+                        fixed_walls=None, alpha:float=10, beta:float=0.5, gamma:float=0.5,
+                        disturbing_points:bool=False) -> SearchResult:
+    """
+    Optimizes the added walls of initial_guess ([x, y, angle] per wall) with scipy's basinhopping.
+
+    Returns:
+      SearchResult with the best layout basinhopping found and the objective's statistics.
+    """
+    objective = LayoutObjective(scene, fixed_walls, alpha, beta, gamma, disturbing_points)
+    start_time = time.perf_counter()
+    result = basinhopping(objective, np.asarray(initial_guess, dtype=float).ravel(), niter=niter, stepsize=stepsize,
+                          T=temperature, rng=seed)
+    elapsed = time.perf_counter() - start_time
+    return SearchResult(np.reshape(result.x, (-1, 3)), float(result.fun), objective.stats.evaluations, elapsed,
+                        objective.stats)
+
+
+
+def valid_fixed_walls(scene, fixed_walls=None):
+    """
+    The walls that stay in every layout, by default the scene's movable walls, as a list of (x, y, angle).
+    Raises ValueError if they collide already, since no layout that keeps them can be valid.
+    """
+    fixed_walls = [tuple(wall) for wall in (scene.moveable_walls if fixed_walls is None else fixed_walls)]
+    if not is_valid_scene_layout(fixed_walls, scene):
+        wall, object_type, _ = detect_scene_collisions(fixed_walls, scene)[0]
+        raise ValueError(f"The fixed walls do not form a valid layout: {wall} collides ({object_type}). "
+                         f"Pass other fixed_walls, e.g. fixed_walls=() to place the walls in the empty plan.")
+    return fixed_walls
+
+
+def sample_feasible_layout(scene, count:int, rng=None, fixed_walls=None, attempts:int=SEED_ATTEMPTS,
+                           free_space=None) -> np.ndarray:
+    """
+    Draws `count` walls from the free-space map of the scene (get_free_space_map unless given)
+    until they form a valid layout together with fixed_walls (by default the scene's movable
+    walls, see valid_fixed_walls).
+
+    Returns:
+      (count, 3) array of walls (x, y, angle).
+    """
+    rng = np.random.default_rng(rng)
+    fixed_walls = valid_fixed_walls(scene, fixed_walls)
+    if free_space is None:
+        free_space = get_free_space_map(scene)
+    for _ in range(attempts):
+        walls, _ = free_space.sample(count, rng)
+        if is_valid_scene_layout(fixed_walls + [tuple(wall) for wall in walls.tolist()], scene):
+            return walls
+    raise ValueError(f"No valid layout of {count} walls found in {attempts} draws.")
+
+
+def start_search(scene, seed_sequence, count:int, niter:int=DEFAULT_START_NITER, stepsize:float=DEFAULT_STEPSIZE,
+                 temperature:float=DEFAULT_TEMPERATURE, deadline=None, fixed_walls=None, alpha:float=10,
+                 beta:float=0.5, gamma:float=0.5, disturbing_points:bool=False, free_space=None, penalty_rays=None):
+    """
+    One start of multistart_search: a basinhopping chain from a feasible layout of `count` walls,
+    both drawn from the random stream of seed_sequence.
+
+    deadline is a time.time() value; the chain stops at the first iteration after it, and a start
+    that begins after it returns None. free_space and penalty_rays are the scene's free-space map
+    and penalty rays, looked up in the per-scene caches unless given.
+    """
+    if deadline is not None and time.time() >= deadline:
+        return None
+    rng = np.random.default_rng(seed_sequence)
+    initial_guess = sample_feasible_layout(scene, count, rng, fixed_walls, free_space=free_space)
+    objective = LayoutObjective(scene, fixed_walls, alpha, beta, gamma, disturbing_points, penalty_rays)
+    callback = None if deadline is None else lambda x, f, accept: time.time() >= deadline
+
+    start_time = time.perf_counter()
+    result = basinhopping(objective, initial_guess.ravel(), niter=niter, stepsize=stepsize, T=temperature,
+                          callback=callback, rng=rng)
+    elapsed = time.perf_counter() - start_time
+    return SearchResult(np.reshape(result.x, (-1, 3)), float(result.fun), objective.stats.evaluations, elapsed,
+                        objective.stats)
+
+
+# Scene of the worker processes with its free-space map and penalty rays, built by the parent
+# and sent once per pool by _init_worker, so the workers do not rebuild them
+_WORKER_SCENE = None
+_WORKER_FREE_SPACE = None
+_WORKER_PENALTY_RAYS = None
+
+def _init_worker(scene, free_space, penalty_rays):
+    global _WORKER_SCENE, _WORKER_FREE_SPACE, _WORKER_PENALTY_RAYS
+    _WORKER_SCENE = scene
+    _WORKER_FREE_SPACE = free_space
+    _WORKER_PENALTY_RAYS = penalty_rays
+
+def _worker_start(arguments):
+    return start_search(_WORKER_SCENE, *arguments, free_space=_WORKER_FREE_SPACE, penalty_rays=_WORKER_PENALTY_RAYS)
+
+
+def available_cores() -> int:
+    """Cores this process may run on, which can be fewer than os.cpu_count() in a container."""
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+class MultistartResult(NamedTuple):
+    """Outcome of multistart_search."""
+    best: SearchResult      # best layout over all starts, None if no start finished
+    results: list           # best-so-far SearchResults of the finished starts, best first
+    starts: int             # starts that finished
+    evaluations: int        # objective evaluations over all finished starts
+    elapsed: float          # wall-clock seconds
+
+    @property
+    def evaluations_per_second(self) -> float:
+        return self.evaluations / self.elapsed if self.elapsed else 0.0
+
+
+def multistart_search(scene, count:int=constants.NUMBER_OF_MOVABLE_WALLS, starts:int=DEFAULT_STARTS,
+                      niter:int=DEFAULT_START_NITER, stepsize:float=DEFAULT_STEPSIZE,
+                      temperature:float=DEFAULT_TEMPERATURE, time_budget=None, seed=None, workers:int=None,
+                      keep:int=DEFAULT_KEEP, fixed_walls=None, alpha:float=10, beta:float=0.5, gamma:float=0.5,
+                      disturbing_points:bool=False) -> MultistartResult:
     """
-    Objective function for the office layout problem.
+    Places `count` walls with independent basinhopping starts from feasible free-space layouts.
 
     Parameters:
-        params: A numpy array [x, y, angle] representing the movable wall's position.
+      scene        : compiled OfficeScene.
+      count        : walls to place.
+      starts       : independent starts; start i uses the i-th stream spawned from seed.
+      niter        : basinhopping iterations per start.
+      time_budget  : wall-clock seconds for the whole search, None for no limit.
+      workers      : processes the starts are spread over; 1 runs them here, None uses available_cores().
+      keep         : best results kept in the best-so-far set.
+      fixed_walls  : movable walls that stay in every layout; by default the scene's movable walls.
+                     Raises ValueError if they collide (valid_fixed_walls).
 
     Returns:
-        Negative heuristic score (because we want to maximize).
+      MultistartResult; without a time budget it depends only on seed, not on workers.
     """
-    x, y, angle = params  # Unpack x, y, angle
-    global i
-    i += 1
+    start_time = time.perf_counter()
+    deadline = None if time_budget is None else time.time() + time_budget
+    fixed_walls = valid_fixed_walls(scene, fixed_walls)
+    workers = min(workers or available_cores(), starts)
+    # Built once here and counted against the budget; the workers receive them with the scene
+    free_space = get_free_space_map(scene)
+    penalty_rays = get_penalty_rays(scene, disturbing_points)
+    tasks = [(seed_sequence, count, niter, stepsize, temperature, deadline, fixed_walls, alpha, beta, gamma,
+              disturbing_points) for seed_sequence in np.random.SeedSequence(seed).spawn(starts)]
 
-    # Get the current office plan
-    office_coordinates, windows, doors, desks, persons, disturbing_persons, objects, dist_points, movable_walls = define_office_plan()
+    # Ties are broken by start index, so the set does not depend on the order the starts finish in
+    best = []
+    finished = 0
+    evaluations = 0
 
-    # Instead of modifying moveable_walls in-place, create a new list
-    movable_walls = movable_walls + [(x, y, angle)]  # This avoids modifying the original list
+    def merge(index, result):
+        nonlocal best, finished, evaluations
+        if result is None:
+            return
+        finished += 1
+        evaluations += result.evaluations
+        best = sorted(best + [(result.score, index, result)], key=lambda entry: entry[:2])[:keep]
 
-    # Check for collisions -> if there are any, return infinity
-    if detect_all_collisions(movable_walls, office_coordinates, doors, desks, persons, objects):
-        return np.inf
-    
-    # Compute the heuristic score
-    score = compute_office_penalty(windows, persons, disturbing_persons, movable_walls)
+    if workers <= 1:
+        for index, task in enumerate(tasks):
+            merge(index, start_search(scene, *task, free_space=free_space, penalty_rays=penalty_rays))
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(scene, free_space, penalty_rays)) as executor:
+            futures = {executor.submit(_worker_start, task): index for index, task in enumerate(tasks)}
+            for future in as_completed(futures):
+                merge(futures[future], future.result())
 
-    return score  # Negate because basinhopping minimizes by default
+    results = [result for _, _, result in best]
+    return MultistartResult(results[0] if results else None, results, finished, evaluations,
+                            time.perf_counter() - start_time)
 
-# Initial guess: (x, y, angle)
-initial_guess = np.array([3.0, 3.0, 90.0])
 
+# --------------------------
+# Example usage: place the movable walls in the current office plan
+# --------------------------
+if __name__ == "__main__":
+    import argparse
 
-# Run optimization
-print("Starting optimization...")
-start_time = time.time()
-result = basinhopping(objective_function, initial_guess, niter=1000, stepsize=1.0, T=3)
-end_time = time.time()
+    parser = argparse.ArgumentParser(description="Place added walls in the current office plan.")
+    parser.add_argument('--walls', type=int, default=constants.NUMBER_OF_MOVABLE_WALLS)
+    parser.add_argument('--starts', type=int, default=DEFAULT_STARTS)
+    parser.add_argument('--niter', type=int, default=DEFAULT_START_NITER, help="basinhopping iterations per start")
+    parser.add_argument('--budget', type=float, default=None, help="wall-clock seconds")
+    parser.add_argument('--workers', type=int, default=None, help="processes, all cores by default")
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
 
-print(f"Optimization took {end_time - start_time:.2f} seconds")
+    scene = load_office_scene()
+    print("Starting optimization...")
+    search = multistart_search(scene, args.walls, args.starts, args.niter, time_budget=args.budget, seed=args.seed,
+                               workers=args.workers)
+    if search.best is None:
+        raise SystemExit("No start finished within the time budget.")
 
-# Get optimized coordinates
-optimized_coords = result.x
-print(f"Optimal coordinates: {optimized_coords[0]:.3f}, {optimized_coords[1]:.3f}, {optimized_coords[2]:.3f}")
-print(f"Best heuristic value: {result.fun:.3f}")
-print(f"Number of iterations: {i}")
+    print(f"Optimization took {search.elapsed:.2f} seconds, {search.starts} starts, "
+          f"{search.evaluations} evaluations ({search.evaluations_per_second:.0f} per second)")
+    for x, y, angle in search.best.walls:
+        print(f"Optimal coordinates: {x:.3f}, {y:.3f}, {angle:.3f}")
+    print(f"Best heuristic value: {search.best.score:.3f}")
+    print("Best scores of the other starts: " + ", ".join(f"{result.score:.3f}" for result in search.results[1:]))
 
-from llm.llm_visualization import visualize_llm_solution
-# Get the current office plan
-office_coordinates, windows, doors, desks, persons, disturbing_persons, objects, dist_points, movable_walls = define_office_plan()
-visualize_llm_solution(-1, movable_walls + [(optimized_coords[0], optimized_coords[1], optimized_coords[2])])
+    from llm.llm_visualization import visualize_llm_solution
+    visualize_llm_solution(-1, list(scene.moveable_walls) + [tuple(wall) for wall in search.best.walls.tolist()])
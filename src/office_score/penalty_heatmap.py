@@ -0,0 +1,195 @@
+import path_helper
+path_helper.add_project_path()
+
+import os
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+from typing import NamedTuple
+import numpy as np
+
+from office_score.batch_collisions import detect_collisions_batch
+from office_score.penalty_score import score_layouts
+
+"""
+Module: penalty_heatmap
+
+Penalty landscape of one additional movable wall over a dense (x, y, angle) grid of a
+plan. Every angle is one slice: the grid walls of the slice are checked with one
+detect_collisions_batch call, and the feasible ones are scored together with
+score_layouts, so a slice costs a few batched kernel calls instead of one
+compute_separate_penalties call per cell. Slices are independent and can be spread over
+a process pool; the scene is sent to every worker once.
+
+Heatmaps are cached per scene (get_penalty_heatmap) and can be stored next to a plan
+with save_heatmap / load_heatmap. They show where a wall helps, and their best cells
+seed the optimizers. Like LayoutObjective and BatchLayoutObjective, they leave the
+disturbing points of the plan out of the disturbing persons by default, so the cells are
+ranked on the objective the optimizers minimize.
+"""
+
+DEFAULT_HEATMAP_RESOLUTION = 0.25                # metres between grid nodes in x and y
+DEFAULT_HEATMAP_ANGLES = (-90.0, -45.0, 0.0, 45.0)  # walls are symmetric, [-90, 90) covers every orientation
+
+
+class PenaltyHeatmap(NamedTuple):
+    """
+    The penalties of a single wall at every grid node: penalties[a, j, i] holds the three
+    components of compute_scene_penalties with the wall (xs[i], ys[j], angles[a]) added to the
+    fixed walls, and NaN where the wall collides (feasible[a, j, i] is False).
+    """
+    xs: np.ndarray          # (X,)
+    ys: np.ndarray          # (Y,)
+    angles: np.ndarray      # (A,)
+    feasible: np.ndarray    # (A, Y, X) bool
+    penalties: np.ndarray   # (A, Y, X, 3)
+
+    @property
+    def scores(self):
+        """(A, Y, X) sum of the three penalties, NaN where infeasible."""
+        return self.penalties.sum(axis=3)
+
+    def best_walls(self, count=1):
+        """The `count` feasible walls (x, y, angle) with the lowest score, best first, as a (count, 3) array."""
+        scores = self.scores.ravel()
+        order = np.argsort(np.where(np.isnan(scores), np.inf, scores), kind='stable')[:count]
+        order = order[~np.isnan(scores[order])]
+        a, j, i = np.unravel_index(order, self.feasible.shape)
+        return np.column_stack([self.xs[i], self.ys[j], self.angles[a]])
+
+
+def heatmap_grid(scene, resolution=DEFAULT_HEATMAP_RESOLUTION):
+    """Grid nodes (xs, ys) over the bounding box of the office outline, `resolution` metres apart."""
+    low = scene.office_polygon.min(axis=0)
+    high = scene.office_polygon.max(axis=0)
+    return (np.arange(low[0], high[0] + resolution / 2, resolution),
+            np.arange(low[1], high[1] + resolution / 2, resolution))
+
+
+def heatmap_slice(scene, xs, ys, angle, fixed_walls=(), alpha:float=10, beta:float=0.5, gamma:float=0.5,
+                  disturbing_points:bool=False, chunk_size:int=None):
+    """
+    One angle of the heatmap.
+
+    Returns:
+      (feasible, penalties): a (Y, X) boolean array and a (Y, X, 3) array, NaN where infeasible.
+    """
+    grid_x, grid_y = np.meshgrid(xs, ys)
+    walls = np.column_stack([grid_x.ravel(), grid_y.ravel(), np.full(grid_x.size, float(angle))])
+    fixed_walls = np.asarray(fixed_walls, dtype=float).reshape(-1, 3)
+    feasible = ~detect_collisions_batch(walls, scene, fixed_walls)
+
+    penalties = np.full((len(walls), 3), np.nan)
+    candidates = walls[feasible]
+    layouts = np.concatenate([np.broadcast_to(fixed_walls, (len(candidates),) + fixed_walls.shape),
+                              candidates[:, None]], axis=1)
+    penalties[feasible] = score_layouts(scene, layouts, alpha, beta, gamma, disturbing_points, chunk_size)
+    return feasible.reshape(grid_x.shape), penalties.reshape(grid_x.shape + (3,))
+
+
+# Scene of the worker processes, sent once per pool by _init_worker
+_WORKER_SCENE = None
+
+def _init_worker(scene):
+    global _WORKER_SCENE
+    _WORKER_SCENE = scene
+
+def _worker_slice(arguments):
+    return heatmap_slice(_WORKER_SCENE, *arguments)
+
+
+def compute_penalty_heatmap(scene, xs=None, ys=None, angles=DEFAULT_HEATMAP_ANGLES, fixed_walls=(),
+                            alpha:float=10, beta:float=0.5, gamma:float=0.5, disturbing_points:bool=False,
+                            resolution:float=DEFAULT_HEATMAP_RESOLUTION, workers:int=1,
+                            chunk_size:int=None) -> PenaltyHeatmap:
+    """
+    Evaluates a single additional wall on the (xs, ys, angles) grid of a compiled scene.
+
+    Parameters:
+      scene        : compiled OfficeScene.
+      xs, ys       : grid nodes; by default heatmap_grid(scene, resolution).
+      angles       : wall angles in degrees, one slice each.
+      fixed_walls  : movable walls (x, y, angle) that stay in the layout, e.g. scene.moveable_walls.
+      disturbing_points : also count the plan's disturbing points as disturbing persons, as
+                     compute_scene_penalties does by default; off like in the optimizers.
+      workers      : processes the slices are spread over; 1 computes them here, None uses every core.
+      chunk_size   : layouts per score_layouts kernel call; by default sized to its memory budget.
+
+    Returns:
+      PenaltyHeatmap of the grid.
+    """
+    if xs is None or ys is None:
+        grid_xs, grid_ys = heatmap_grid(scene, resolution)
+        xs = grid_xs if xs is None else xs
+        ys = grid_ys if ys is None else ys
+    xs = np.asarray(xs, dtype=float)
+    ys = np.asarray(ys, dtype=float)
+    angles = np.asarray(angles, dtype=float).reshape(-1)
+    fixed_walls = np.asarray(fixed_walls, dtype=float).reshape(-1, 3)
+    workers = min(workers or os.cpu_count() or 1, len(angles))
+
+    tasks = [(xs, ys, angle, fixed_walls, alpha, beta, gamma, disturbing_points, chunk_size) for angle in angles]
+    if workers <= 1:
+        slices = [heatmap_slice(scene, *task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(scene,)) as executor:
+            slices = list(executor.map(_worker_slice, tasks))
+
+    feasible = np.stack([feasible for feasible, _ in slices]) if slices else np.zeros((0, len(ys), len(xs)), dtype=bool)
+    penalties = np.stack([penalties for _, penalties in slices]) if slices else np.zeros((0, len(ys), len(xs), 3))
+    return PenaltyHeatmap(xs, ys, angles, feasible, penalties)
+
+
+_HEATMAPS = weakref.WeakKeyDictionary()
+
+def get_penalty_heatmap(scene, resolution:float=DEFAULT_HEATMAP_RESOLUTION, angles=DEFAULT_HEATMAP_ANGLES,
+                        fixed_walls=(), alpha:float=10, beta:float=0.5, gamma:float=0.5, disturbing_points:bool=False,
+                        workers:int=1) -> PenaltyHeatmap:
+    """Returns the heatmap_grid heatmap of a compiled scene, computed on first use and cached per scene."""
+    cache = _HEATMAPS.setdefault(scene, {})
+    key = (resolution, tuple(np.asarray(angles, dtype=float).ravel().tolist()),
+           tuple(map(tuple, np.asarray(fixed_walls, dtype=float).reshape(-1, 3).tolist())),
+           alpha, beta, gamma, disturbing_points)
+    if key not in cache:
+        cache[key] = compute_penalty_heatmap(scene, angles=angles, fixed_walls=fixed_walls, alpha=alpha, beta=beta,
+                                             gamma=gamma, disturbing_points=disturbing_points, resolution=resolution,
+                                             workers=workers)
+    return cache[key]
+
+
+def save_heatmap(heatmap, path):
+    """Stores a PenaltyHeatmap as a compressed .npz file."""
+    np.savez_compressed(path, **heatmap._asdict())
+
+
+def load_heatmap(path) -> PenaltyHeatmap:
+    """Loads a PenaltyHeatmap stored by save_heatmap."""
+    with np.load(path) as data:
+        return PenaltyHeatmap(*(data[field] for field in PenaltyHeatmap._fields))
+
+
+# --------------------------
+# Example usage: heatmaps of some plans, spot-checked against compute_scene_penalties
+# --------------------------
+if __name__ == "__main__":
+    import time
+    from office_score.office_scene import load_office_scene
+    from office_score.penalty_score import compute_scene_penalties
+
+    rng = np.random.default_rng(0)
+    for plan in (4, 16, 21):
+        scene = load_office_scene(plan)
+        fixed_walls = list(scene.moveable_walls)
+        for workers in (1, 2):
+            start_time = time.perf_counter()
+            heatmap = compute_penalty_heatmap(scene, fixed_walls=fixed_walls, workers=workers)
+            elapsed = time.perf_counter() - start_time
+            print(f"Plan {plan:2d}, workers {workers}: {heatmap.feasible.size} cells, "
+                  f"{np.count_nonzero(heatmap.feasible)} feasible, {elapsed:.2f} s")
+
+        a, j, i = np.unravel_index(rng.choice(np.flatnonzero(heatmap.feasible), 20), heatmap.feasible.shape)
+        mismatches = sum(tuple(heatmap.penalties[a[n], j[n], i[n]]) !=
+                         compute_scene_penalties(scene, fixed_walls + [(heatmap.xs[i[n]], heatmap.ys[j[n]],
+                                                                        heatmap.angles[a[n]])],
+                                                 disturbing_points=False)
+                         for n in range(len(a)))
+        print(f"         {mismatches} mismatches in 20 cells, best wall {heatmap.best_walls()[0].round(2).tolist()}")
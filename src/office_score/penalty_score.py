@@ -3,15 +3,45 @@ import pretty_errors
 import path_helper
 path_helper.add_project_path()
 
+import functools
 import math
+import weakref
+from typing import NamedTuple
 from office_score.check_collisions import get_rectangle_polygon, segments_intersect
+from office_score.visibility import (rays_blocked, pairs_visibility, PairRays, build_pair_rays, pair_rays_visibility,
+                                     layouts_pair_rays_visibility, select_pair_rays, LAYOUT_TEST_BYTES)
+from office_score.visibility_polygon import pairs_visibility_sweep, windows_visibility_sweep
+from office_score.adaptive_visibility import (adaptive_pairs_visibility, circle_curves, segment_curves,
+                                              AdaptiveVisibility, ADAPTIVE_TOLERANCE)
+from office_score.batch_collisions import rectangle_polygons, kernel_dtype, DEFAULT_MEMORY_BUDGET
+import numpy as np
 import constants
 from utils import utils_window
 from office_plans.office_plan import define_office_plan
+from office_score.office_scene import office_polygon
 import time
 
+# Sampling parameters of the visibility checks
+PERSON_SAMPLE_COUNT = 16      # number of sample points around a person
+PERSON_SAMPLE_RADIUS = .5     # radius for person sampling (in SI units)
+WINDOW_SAMPLE_COUNT = 8       # number of sample points along a window
+
+# Visibility engines: 'rays' tests sampled rays, 'sweep' uses exact visibility polygons (office_score.visibility_polygon),
+# 'adaptive' refines the rays of every pair until its error is below a tolerance (office_score.adaptive_visibility)
+VISIBILITY_ENGINES = ('rays', 'sweep', 'adaptive')
+SWEEP_PERSON_SAMPLE_COUNT = 64   # the sweep is linear in the samples, so persons are sampled densely
+
+# Peak bytes per (layout, scored pair) of score_layouts: ray counts, visibilities and their temporaries
+LAYOUT_PAIR_BYTES = 32
+# Open rays a chunk of layouts must be able to test per kernel call within the memory budget
+MIN_LAYOUT_RAY_CHUNK = 256
+
+# Number of plans whose sample points and distances penalty_samples keeps
+PENALTY_SAMPLE_CACHE_SIZE = 32
+
 def compute_office_penalty(windows: list, persons: list, disturbing_persons: list, moveable_walls: list, 
-                           alpha:float=10, beta:float=0.5, gamma:float=0.5) -> float:
+                           alpha:float=10, beta:float=0.5, gamma:float=0.5, office_coordinates=None,
+                           engine:str='rays', prune_tolerance:float=0.0) -> float:
     """
     Computes a penalty score for an office layout to evaluate its quality.
 
@@ -32,6 +62,9 @@ def compute_office_penalty(windows: list, persons: list, disturbing_persons: lis
         alpha (float, optional): Weight for penalizing disturbing exposure. Default is 10.
         beta (float, optional): Weight for rewarding window visibility. Default is 0.5.
         gamma (float, optional): Weight for rewarding visibility between people. Default is 0.5.
+        office_coordinates (tuple, optional): The office outline of the plan, (OFFICE_RECTANGLE, (length, width)) or (OFFICE_POLYGON, corners). Default is the OFFICE_LENGTH x OFFICE_WIDTH rectangle.
+        engine (str, optional): Visibility engine, one of VISIBILITY_ENGINES. 'rays' (default) samples PERSON_SAMPLE_COUNT x PERSON_SAMPLE_COUNT rays per pair; 'sweep' uses exact visibility polygons with SWEEP_PERSON_SAMPLE_COUNT samples per person and the exact visible length of the windows; 'adaptive' samples every pair until its visibility error is below ADAPTIVE_TOLERANCE and raises a ValueError if a pair cannot reach it (see compute_adaptive_penalties).
+        prune_tolerance (float, optional): Bound on the total error of exposure_to_windows + exposure_to_non_disturbing. Pairs whose largest possible contribution (fully visible) is negligible are skipped while the skipped contributions sum to at most prune_tolerance (see reward_pairs). Default is 0, scoring every pair.
 
     Returns:
         float: The computed penalty score. Lower values indicate better office arrangements.
@@ -45,7 +78,8 @@ def compute_office_penalty(windows: list, persons: list, disturbing_persons: lis
         >>> print(f"Penalty Score: {score}")
     """
 
-    a, b, c = compute_separate_penalties(windows, persons, disturbing_persons, moveable_walls, alpha, beta, gamma)
+    a, b, c = compute_separate_penalties(windows, persons, disturbing_persons, moveable_walls, alpha, beta, gamma, office_coordinates,
+                                         engine, prune_tolerance)
     # Combine the penalties into a single score.
     # The three penalties are already weighted by their respective alpha, beta, and gamma values.
     # The final score is the sum of these penalties.
@@ -54,7 +88,8 @@ def compute_office_penalty(windows: list, persons: list, disturbing_persons: lis
     return penalty_score    
 
 def compute_separate_penalties(windows: list, persons: list, disturbing_persons: list, moveable_walls: list, 
-                           alpha:float=10, beta:float=0.5, gamma:float=0.5) -> tuple[float, float, float]:
+                           alpha:float=10, beta:float=0.5, gamma:float=0.5, office_coordinates=None,
+                           engine:str='rays', prune_tolerance:float=0.0) -> tuple[float, float, float]:
     """
     Computes the penalty scores for an office layout to evaluate its quality.
 
@@ -75,6 +110,9 @@ def compute_separate_penalties(windows: list, persons: list, disturbing_persons:
         alpha (float, optional): Weight for penalizing disturbing exposure. Default is 10.
         beta (float, optional): Weight for rewarding window visibility. Default is 0.5.
         gamma (float, optional): Weight for rewarding visibility between people. Default is 0.5.
+        office_coordinates (tuple, optional): The office outline of the plan, (OFFICE_RECTANGLE, (length, width)) or (OFFICE_POLYGON, corners). Default is the OFFICE_LENGTH x OFFICE_WIDTH rectangle.
+        engine (str, optional): Visibility engine, one of VISIBILITY_ENGINES. 'rays' (default) samples PERSON_SAMPLE_COUNT x PERSON_SAMPLE_COUNT rays per pair; 'sweep' uses exact visibility polygons with SWEEP_PERSON_SAMPLE_COUNT samples per person and the exact visible length of the windows; 'adaptive' samples every pair until its visibility error is below ADAPTIVE_TOLERANCE and raises a ValueError if a pair cannot reach it (see compute_adaptive_penalties).
+        prune_tolerance (float, optional): Bound on the total error of exposure_to_windows + exposure_to_non_disturbing. Pairs whose largest possible contribution (fully visible) is negligible are skipped while the skipped contributions sum to at most prune_tolerance (see reward_pairs). Default is 0, scoring every pair.
 
     Returns:
         tuple[float, float, float]: The computed penalty scores, containing: exposure_to_disturbing_people, exposure_to_windows, exposure_to_non_disturbing. Lower values indicate better office arrangements.
@@ -87,73 +125,527 @@ def compute_separate_penalties(windows: list, persons: list, disturbing_persons:
         >>> scores = compute_separate_penalties(windows, persons, disturbing_persons, moveable_walls)
         >>> print(f"Penalty Score: {scores}")
     """
+    if engine not in VISIBILITY_ENGINES:
+        raise ValueError(f"Unknown visibility engine {engine!r}, expected one of {VISIBILITY_ENGINES}.")
+    if engine == 'adaptive':
+        return compute_adaptive_penalties(windows, persons, disturbing_persons, moveable_walls, alpha, beta, gamma,
+                                          office_coordinates, prune_tolerance=prune_tolerance, strict=True).penalties
     epsilon = 1e-6  # To avoid division by zero
     penalty = 0.0
-    # Blockers used in most checks (including office walls)
-    blockers_all = compute_office_blockers(moveable_walls, include_office=True)
     # For window checks, ignore the office walls to avoid false blocking.
-    blockers_no_office = compute_office_blockers(moveable_walls, include_office=False)
+    blockers_no_office = movable_wall_segments(moveable_walls)
+    # Blockers used in most checks (including office walls)
+    blockers_all = office_wall_segments(office_coordinates) + blockers_no_office
     
     # Sampling parameters
-    person_sample_count = 16         # number of sample points around a person
-    person_sample_radius = .5        # radius for person sampling (in SI units)
-    window_sample_count = 8           # number of sample points along a window
+    person_sample_count = PERSON_SAMPLE_COUNT if engine == 'rays' else SWEEP_PERSON_SAMPLE_COUNT
+    person_sample_radius = PERSON_SAMPLE_RADIUS
+    window_sample_count = WINDOW_SAMPLE_COUNT
+
+    # Sample points and distances of the plan, computed once per plan
+    samples = penalty_samples(windows, persons, disturbing_persons, person_sample_count, person_sample_radius, window_sample_count)
+
+    # Pairs of the reward terms, without the negligible ones when pruning
+    pairs = reward_pairs(windows, persons, disturbing_persons, beta, gamma, prune_tolerance, epsilon, samples)
 
     # 1. Penalize exposure to disturbing persons.
-    exposure_to_disturbing_people = calculate_exposure_to_disturbing_people(persons, disturbing_persons, alpha, epsilon, blockers_all, person_sample_count, person_sample_radius)
+    exposure_to_disturbing_people = calculate_exposure_to_disturbing_people(persons, disturbing_persons, alpha, epsilon, blockers_all, person_sample_count, person_sample_radius, engine, samples)
     
     # 2. Reward exposure to windows.
-    exposure_to_windows = calculate_exposure_to_windows(windows, persons, beta, epsilon, blockers_no_office, person_sample_count, person_sample_radius, window_sample_count)
+    exposure_to_windows = calculate_exposure_to_windows(windows, persons, beta, epsilon, blockers_no_office, person_sample_count, person_sample_radius, window_sample_count, engine, pairs.window_pairs, samples)
     
     # 3. Reward visibility among non-disturbing persons.
-    exposure_to_non_disturbing = calculate_exposure_to_friendlies(persons, disturbing_persons, gamma, epsilon, blockers_all, person_sample_count, person_sample_radius)
+    exposure_to_non_disturbing = calculate_exposure_to_friendlies(persons, disturbing_persons, gamma, epsilon, blockers_all, person_sample_count, person_sample_radius, engine, pairs.friendly_pairs, samples)
     
     return exposure_to_disturbing_people, exposure_to_windows, exposure_to_non_disturbing
 
-def calculate_exposure_to_disturbing_people(persons, disturbing_persons, alpha, epsilon, blockers_all, person_sample_count, person_sample_radius):
+class AdaptivePenalties(NamedTuple):
+    """
+    The penalties of compute_adaptive_penalties with a bound on the error of each of them, and the
+    visibility, error and rays spent of every pair, in the pair order of compute_separate_penalties.
+    """
+    penalties: tuple
+    errors: tuple
+    disturbing: AdaptiveVisibility
+    windows: AdaptiveVisibility
+    friendlies: AdaptiveVisibility
+
+def compute_adaptive_penalties(windows: list, persons: list, disturbing_persons: list, moveable_walls: list,
+                               alpha:float=10, beta:float=0.5, gamma:float=0.5, office_coordinates=None,
+                               tolerance:float=ADAPTIVE_TOLERANCE, prune_tolerance:float=0.0,
+                               strict:bool=False) -> AdaptivePenalties:
+    """
+    compute_separate_penalties with adaptive visibility sampling (office_score.adaptive_visibility).
+
+    Instead of PERSON_SAMPLE_COUNT x PERSON_SAMPLE_COUNT rays for every pair, the rays between the
+    circle around a person and the circle around the other person (or the window segment) start on
+    a coarse grid and are refined only where neighbouring rays disagree, until the visibility error
+    of the pair is below `tolerance`. Fully visible and fully blocked pairs cost the coarse grid only.
+    Reward pairs are pruned with prune_tolerance as in compute_separate_penalties. Pairs that reach
+    the maximum depth above the tolerance are marked in the `converged` arrays, or raise a ValueError
+    with strict.
+
+    Returns:
+        AdaptivePenalties: the three penalties, their error bounds (the pair errors weighted like the
+        visibilities, plus the skipped mass of the pruned pairs), and the per-pair visibility, error and
+        number of rays tested of the scored pairs.
+    """
+    epsilon = 1e-6  # To avoid division by zero
+    blockers_no_office = movable_wall_segments(moveable_walls)
+    blockers_all = office_wall_segments(office_coordinates) + blockers_no_office
+
+    disturbing_pairs = [(p, d) for p in persons for d in disturbing_persons if p != d]
+    window_pairs, friendly_pairs, skipped_windows, skipped_friendlies = reward_pairs(
+        windows, persons, disturbing_persons, beta, gamma, prune_tolerance, epsilon)
+    window_segments = {window: utils_window.get_window_coordinates_2d(window[0], window[1], window[2], window[3])
+                       for window in windows}
+
+    def person_curves(points):
+        return circle_curves(points, PERSON_SAMPLE_RADIUS)
+
+    disturbing = adaptive_pairs_visibility(person_curves([p for p, _ in disturbing_pairs]),
+                                           person_curves([d for _, d in disturbing_pairs]), blockers_all, tolerance,
+                                           strict=strict)
+    # Windows are checked without the office walls
+    window_visibility = adaptive_pairs_visibility(person_curves([p for p, _ in window_pairs]),
+                                                  segment_curves([window_segments[w] for _, w in window_pairs]),
+                                                  blockers_no_office, tolerance, strict=strict)
+    friendlies = adaptive_pairs_visibility(person_curves([p for p, _ in friendly_pairs]),
+                                           person_curves([q for _, q in friendly_pairs]), blockers_all, tolerance,
+                                           strict=strict)
+
+    penalties = [0, 0, 0]
+    # The skipped pairs count against the reward terms they were taken from
+    errors = [0, skipped_windows, skipped_friendlies]
+    for (p, d), visibility, error in zip(disturbing_pairs, disturbing.visibility.tolist(), disturbing.error.tolist()):
+        weight = alpha / (euclidean_distance(p, d) + epsilon)
+        penalties[0] += weight * visibility
+        errors[0] += weight * error
+    for (p, window), visibility, error in zip(window_pairs, window_visibility.visibility.tolist(),
+                                              window_visibility.error.tolist()):
+        weight = beta / (euclidean_distance(p, window_midpoint(window)) + epsilon)**2
+        penalties[1] -= weight * visibility
+        errors[1] += weight * error
+    for (p, q), visibility, error in zip(friendly_pairs, friendlies.visibility.tolist(), friendlies.error.tolist()):
+        weight = gamma / (euclidean_distance(p, q) + epsilon)**2
+        penalties[2] -= weight * visibility
+        errors[2] += weight * error
+
+    return AdaptivePenalties(tuple(penalties), tuple(errors), disturbing, window_visibility, friendlies)
+
+class RewardPairs(NamedTuple):
+    """
+    The pairs scored by calculate_exposure_to_windows and calculate_exposure_to_friendlies, in the
+    order of compute_separate_penalties, and the largest possible contribution of the skipped ones.
+    """
+    window_pairs: list
+    friendly_pairs: list
+    skipped_windows: float
+    skipped_friendlies: float
+
+def prune_negligible_pairs(bounds, tolerance:float):
+    """
+    Skips the pairs with the smallest contribution bounds as long as the skipped bounds sum to at most tolerance.
+
+    Returns:
+        (keep, skipped): a boolean mask of the kept pairs in the given order, and the sum of the skipped bounds.
+    """
+    bounds = np.asarray(bounds, dtype=float)
+    order = np.argsort(bounds, kind='stable')
+    skipped = order[np.cumsum(bounds[order]) <= tolerance]
+    keep = np.ones(len(bounds), dtype=bool)
+    keep[skipped] = False
+    return keep, float(bounds[skipped].sum())
+
+def reward_pairs(windows: list, persons: list, disturbing_persons: list, beta:float=0.5, gamma:float=0.5,
+                 prune_tolerance:float=0.0, epsilon:float=1e-6, samples=None) -> RewardPairs:
+    """
+    The (person, window) and (person, person) pairs of the two reward terms, without the negligible ones.
+
+    A pair contributes weight * visibility with visibility <= 1, so beta / (dist + epsilon)**2 and
+    gamma / (dist + epsilon)**2 bound what a window pair and a friendly pair can add. The bounds of
+    both terms are taken from the person-window and person-person distance matrices and ranked
+    together; the smallest are skipped while they sum to at most prune_tolerance, so
+    exposure_to_windows + exposure_to_non_disturbing stays within prune_tolerance of the full sum.
+    The distances come from the PenaltySamples of the plan (penalty_samples unless given).
+    """
+    window_pairs = [(p, window) for p in persons for window in windows]
+    non_disturbing = [p for p in persons if p not in disturbing_persons]
+    n = len(non_disturbing)
+    friendly_pairs = [(non_disturbing[i], non_disturbing[j]) for i in range(n) for j in range(i + 1, n)]
+    if prune_tolerance <= 0 or not (window_pairs or friendly_pairs):
+        return RewardPairs(window_pairs, friendly_pairs, 0.0, 0.0)
+
+    # Rows of the distance matrices; their row-major entries (upper triangle for the persons) follow the pair order
+    if samples is None:
+        samples = penalty_samples(windows, persons, disturbing_persons)
+    person_rows = samples.point_rows(persons)
+    window_distances = samples.window_distances[np.ix_(person_rows, samples.window_rows(windows))]
+    friendly_rows = samples.point_rows(non_disturbing)
+    friendly_distances = samples.point_distances[np.ix_(friendly_rows, friendly_rows)][np.triu_indices(n, 1)]
+
+    bounds = np.concatenate([beta / (window_distances.ravel() + epsilon)**2,
+                             gamma / (friendly_distances + epsilon)**2])
+    keep, _ = prune_negligible_pairs(bounds, prune_tolerance)
+    window_keep, friendly_keep = keep[:len(window_pairs)], keep[len(window_pairs):]
+    return RewardPairs([pair for pair, kept in zip(window_pairs, window_keep) if kept],
+                       [pair for pair, kept in zip(friendly_pairs, friendly_keep) if kept],
+                       float(bounds[:len(window_pairs)][~window_keep].sum()),
+                       float(bounds[len(window_pairs):][~friendly_keep].sum()))
+
+def compute_scene_penalties(scene, moveable_walls: list, alpha:float=10, beta:float=0.5, gamma:float=0.5,
+                            disturbing_points:bool=True, prune_tolerance:float=0.0) -> tuple[float, float, float]:
+    """
+    Same as compute_separate_penalties, with the windows and persons taken from a compiled
+    office scene (office_score.office_scene.load_office_scene / compile_office_scene).
+    The disturbing points of the plan count as disturbing persons, as in llm.compare_penalties,
+    unless disturbing_points is False.
+
+    The sample rays and the rays already blocked by the office walls are computed once per
+    scene (get_penalty_rays); a call only tests the open rays against the movable walls.
+    With prune_tolerance > 0, the negligible reward pairs are skipped (get_pruned_penalty_rays).
+
+    Returns:
+        tuple[float, float, float]: exposure_to_disturbing_people, exposure_to_windows, exposure_to_non_disturbing.
+    """
+    penalty_rays = get_pruned_penalty_rays(scene, disturbing_points, beta, gamma, prune_tolerance).penalty_rays
+    return compute_precomputed_penalties(penalty_rays, moveable_walls, alpha, beta, gamma)
+
+class PenaltySamples(NamedTuple):
+    """
+    The sample points of a plan and their distances, which the penalty terms index into instead of
+    generating them for every pair. Row i of person_samples and of the distance matrices belongs to
+    points[i], row w of the window arrays to windows[w].
+    """
+    points: tuple                   # the persons, then the disturbing persons that are not persons
+    windows: tuple
+    person_samples: np.ndarray      # (N, person_sample_count, 2), the unit-circle template around every point
+    window_samples: np.ndarray      # (W, window_sample_count, 2)
+    window_segments: np.ndarray     # (W, 2, 2)
+    point_distances: np.ndarray     # (N, N)
+    window_distances: np.ndarray    # (N, W), from every point to every window midpoint
+    point_index: dict               # point -> row
+    window_index: dict              # window -> row
+
+    def point_rows(self, points):
+        """The rows of the given points, as an int array."""
+        return np.array([self.point_index[p] for p in points], dtype=int)
+
+    def window_rows(self, windows):
+        """The rows of the given windows, as an int array."""
+        return np.array([self.window_index[window] for window in windows], dtype=int)
+
+def circle_template(count):
+    """The offsets of generate_sample_points_around on the unit circle, as a (count, 2) array."""
+    angles = [2 * math.pi * i / count for i in range(count)]
+    return np.array([(math.cos(angle), math.sin(angle)) for angle in angles], dtype=float).reshape(count, 2)
+
+def build_penalty_samples(windows: list, persons: list, disturbing_persons: list,
+                          person_sample_count:int=PERSON_SAMPLE_COUNT, person_sample_radius:float=PERSON_SAMPLE_RADIUS,
+                          window_sample_count:int=WINDOW_SAMPLE_COUNT) -> PenaltySamples:
+    """
+    Computes the PenaltySamples of a plan. The points equal generate_sample_points_around,
+    sample_points_along_line and window_midpoint, and the distances euclidean_distance, exactly.
+    """
+    points = tuple(dict.fromkeys(list(persons) + list(disturbing_persons)))
+    windows = tuple(windows)
+    centers = np.asarray(points, dtype=float).reshape(-1, 2)
+    person_samples = centers[:, None] + person_sample_radius * circle_template(person_sample_count)[None]
+
+    window_segments = np.array([utils_window.get_window_coordinates_2d(window[0], window[1], window[2], window[3])
+                                for window in windows], dtype=float).reshape(-1, 2, 2)
+    first, second = window_segments[:, None, 0], window_segments[:, None, 1]
+    if window_sample_count < 2:
+        window_samples = (first + second) / 2
+    else:
+        t = np.array([i / (window_sample_count - 1) for i in range(window_sample_count)])[None, :, None]
+        window_samples = first + t * (second - first)
+
+    midpoints = [window_midpoint(window) for window in windows]
+    point_distances = np.array([[euclidean_distance(p, q) for q in points] for p in points],
+                               dtype=float).reshape(len(points), len(points))
+    window_distances = np.array([[euclidean_distance(p, mid) for mid in midpoints] for p in points],
+                                dtype=float).reshape(len(points), len(windows))
+
+    arrays = (person_samples, window_samples, window_segments, point_distances, window_distances)
+    for array in arrays:
+        # Shared through the caches
+        array.setflags(write=False)
+    # A window listed twice maps to its first row
+    return PenaltySamples(points, windows, *arrays, {p: i for i, p in enumerate(points)},
+                          {window: w for w, window in reversed(list(enumerate(windows)))})
+
+_cached_penalty_samples = functools.lru_cache(maxsize=PENALTY_SAMPLE_CACHE_SIZE)(build_penalty_samples)
+
+def penalty_samples(windows: list, persons: list, disturbing_persons: list,
+                    person_sample_count:int=PERSON_SAMPLE_COUNT, person_sample_radius:float=PERSON_SAMPLE_RADIUS,
+                    window_sample_count:int=WINDOW_SAMPLE_COUNT) -> PenaltySamples:
+    """
+    build_penalty_samples, cached for the last PENALTY_SAMPLE_CACHE_SIZE plans, so repeated scoring of
+    the same plan only indexes into the arrays. Persons and windows are tuples, as in define_office_plan.
+    """
+    return _cached_penalty_samples(tuple(windows), tuple(persons), tuple(disturbing_persons),
+                                   person_sample_count, person_sample_radius, window_sample_count)
+
+class PenaltyRays(NamedTuple):
+    """
+    Everything of compute_separate_penalties that does not depend on the movable walls:
+    the scored pairs as sample rays with the office-wall blocking precomputed, and their distances.
+    """
+    disturbing: PairRays
+    disturbing_distances: tuple
+    windows: PairRays
+    window_distances: tuple
+    friendlies: PairRays
+    friendly_distances: tuple
+
+def build_penalty_rays(windows: list, persons: list, disturbing_persons: list, office_walls=None,
+                       samples: PenaltySamples=None) -> PenaltyRays:
+    """
+    Precomputes the sample rays of all pairs scored by compute_separate_penalties, in the same
+    pair order, and tests the ones that see the office walls against them once.
+
+    office_walls are the office wall segments, e.g. OfficeScene.office_walls; by default
+    office_wall_segments() of the default rectangle. The sample points and distances are indexed
+    from samples, by default penalty_samples() of the plan.
+    """
+    if office_walls is None:
+        office_walls = office_wall_segments()
+    if samples is None:
+        samples = penalty_samples(windows, persons, disturbing_persons)
+
+    persons_rows = samples.point_rows(persons)
+    disturbing_rows = samples.point_rows(disturbing_persons)
+    disturbing_a, disturbing_b = (rows.ravel() for rows in np.meshgrid(persons_rows, disturbing_rows, indexing='ij'))
+    # Skip the pairs of a person with itself
+    distinct = np.array([p != d for p in persons for d in disturbing_persons], dtype=bool)
+    disturbing_a, disturbing_b = disturbing_a[distinct], disturbing_b[distinct]
+    window_a, window_b = (rows.ravel() for rows in np.meshgrid(persons_rows, samples.window_rows(windows), indexing='ij'))
+    friendly_rows = samples.point_rows([p for p in persons if p not in disturbing_persons])
+    friendly_a, friendly_b = (friendly_rows[i] for i in np.triu_indices(len(friendly_rows), 1))
+
+    return PenaltyRays(
+        disturbing=build_pair_rays(samples.person_samples[disturbing_a], samples.person_samples[disturbing_b],
+                                   office_walls),
+        disturbing_distances=tuple(samples.point_distances[disturbing_a, disturbing_b].tolist()),
+        # Windows are checked without the office walls
+        windows=build_pair_rays(samples.person_samples[window_a], samples.window_samples[window_b]),
+        window_distances=tuple(samples.window_distances[window_a, window_b].tolist()),
+        friendlies=build_pair_rays(samples.person_samples[friendly_a], samples.person_samples[friendly_b],
+                                   office_walls),
+        friendly_distances=tuple(samples.point_distances[friendly_a, friendly_b].tolist()),
+    )
+
+_PENALTY_SAMPLES = weakref.WeakKeyDictionary()
+_PENALTY_RAYS = weakref.WeakKeyDictionary()
+
+def get_penalty_samples(scene, disturbing_points:bool=True) -> PenaltySamples:
+    """Returns the PenaltySamples of a compiled scene, built on first use and cached per scene."""
+    cache = _PENALTY_SAMPLES.setdefault(scene, {})
+    if disturbing_points not in cache:
+        disturbing = list(scene.disturbing_persons) + (list(scene.disturbing_points) if disturbing_points else [])
+        cache[disturbing_points] = build_penalty_samples(list(scene.windows), list(scene.persons), disturbing)
+    return cache[disturbing_points]
+
+def get_penalty_rays(scene, disturbing_points:bool=True) -> PenaltyRays:
+    """Returns the PenaltyRays of a compiled scene, built on first use and cached per scene."""
+    cache = _PENALTY_RAYS.setdefault(scene, {})
+    if disturbing_points not in cache:
+        disturbing = list(scene.disturbing_persons) + (list(scene.disturbing_points) if disturbing_points else [])
+        cache[disturbing_points] = build_penalty_rays(list(scene.windows), list(scene.persons), disturbing,
+                                                      scene.office_walls, get_penalty_samples(scene, disturbing_points))
+    return cache[disturbing_points]
+
+class PrunedPenaltyRays(NamedTuple):
+    """PenaltyRays without the negligible reward pairs, and the largest possible contribution of the skipped ones."""
+    penalty_rays: PenaltyRays
+    skipped_windows: float
+    skipped_friendlies: float
+
+def prune_penalty_rays(penalty_rays: PenaltyRays, beta:float=0.5, gamma:float=0.5, prune_tolerance:float=0.0,
+                       epsilon:float=1e-6) -> PrunedPenaltyRays:
+    """
+    Skips the window and friendly pairs of penalty_rays whose contribution bounds sum to at most
+    prune_tolerance, ranked as in reward_pairs; the kept pairs keep their order.
+    """
+    if prune_tolerance <= 0:
+        return PrunedPenaltyRays(penalty_rays, 0.0, 0.0)
+    window_bounds = beta / (np.asarray(penalty_rays.window_distances, dtype=float) + epsilon)**2
+    friendly_bounds = gamma / (np.asarray(penalty_rays.friendly_distances, dtype=float) + epsilon)**2
+    keep, _ = prune_negligible_pairs(np.concatenate([window_bounds, friendly_bounds]), prune_tolerance)
+    window_keep, friendly_keep = keep[:len(window_bounds)], keep[len(window_bounds):]
+    pruned = penalty_rays._replace(
+        windows=select_pair_rays(penalty_rays.windows, window_keep),
+        window_distances=tuple(np.compress(window_keep, penalty_rays.window_distances).tolist()),
+        friendlies=select_pair_rays(penalty_rays.friendlies, friendly_keep),
+        friendly_distances=tuple(np.compress(friendly_keep, penalty_rays.friendly_distances).tolist()))
+    return PrunedPenaltyRays(pruned, float(window_bounds[~window_keep].sum()),
+                             float(friendly_bounds[~friendly_keep].sum()))
+
+def get_pruned_penalty_rays(scene, disturbing_points:bool=True, beta:float=0.5, gamma:float=0.5,
+                            prune_tolerance:float=0.0) -> PrunedPenaltyRays:
+    """prune_penalty_rays of the PenaltyRays of a compiled scene, cached per scene like get_penalty_rays."""
+    if prune_tolerance <= 0:
+        return PrunedPenaltyRays(get_penalty_rays(scene, disturbing_points), 0.0, 0.0)
+    cache = _PENALTY_RAYS.setdefault(scene, {})
+    key = (disturbing_points, beta, gamma, prune_tolerance)
+    if key not in cache:
+        cache[key] = prune_penalty_rays(get_penalty_rays(scene, disturbing_points), beta, gamma, prune_tolerance)
+    return cache[key]
+
+def compute_precomputed_penalties(penalty_rays: PenaltyRays, moveable_walls: list, alpha:float=10, beta:float=0.5,
+                                  gamma:float=0.5) -> tuple[float, float, float]:
+    """
+    compute_separate_penalties for precomputed PenaltyRays. Only the rays that the office walls
+    leave open are tested against the movable walls; the result is identical.
+    """
+    wall_blockers = movable_wall_segments(moveable_walls)
+    visibilities = [pair_rays_visibility(pair_rays, wall_blockers)
+                    for pair_rays in (penalty_rays.disturbing, penalty_rays.windows, penalty_rays.friendlies)]
+    return accumulate_penalties(penalty_rays, *visibilities, alpha, beta, gamma)
+
+def accumulate_penalties(penalty_rays: PenaltyRays, disturbing_visibility, window_visibility, friendly_visibility,
+                         alpha:float=10, beta:float=0.5, gamma:float=0.5) -> tuple[float, float, float]:
+    """
+    Sums the three penalties from the visibility of every pair of penalty_rays, in the order of
+    compute_separate_penalties, so every scorer built on PenaltyRays returns identical values.
+
+    The visibilities are (P,) arrays, or (L, P) arrays for L layouts; the penalties are then (L,) arrays.
+    """
+    epsilon = 1e-6  # To avoid division by zero
+
+    def per_pair(visibility):
+        return visibility.tolist() if visibility.ndim == 1 else list(visibility.T)
+
+    exposure_to_disturbing_people = 0
+    for dist, visibility in zip(penalty_rays.disturbing_distances, per_pair(disturbing_visibility)):
+        exposure_to_disturbing_people += alpha * visibility / (dist + epsilon)
+
+    exposure_to_windows = 0
+    for dist, visibility in zip(penalty_rays.window_distances, per_pair(window_visibility)):
+        exposure_to_windows -= beta * visibility / (dist + epsilon)**2
+
+    exposure_to_non_disturbing = 0
+    for dist, visibility in zip(penalty_rays.friendly_distances, per_pair(friendly_visibility)):
+        exposure_to_non_disturbing -= gamma * visibility / (dist + epsilon)**2
+
+    return exposure_to_disturbing_people, exposure_to_windows, exposure_to_non_disturbing
+
+def layout_wall_segments(walls_batch):
+    """
+    Vectorized movable_wall_segments for L layouts of k walls.
+
+    Parameters:
+      walls_batch : array-like of shape (L, k, 3) with rows (x, y, angle).
+
+    Returns:
+      An array of shape (L, 4 * k, 2, 2) with the edges of every wall of every layout.
+    """
+    walls_batch = np.asarray(walls_batch, dtype=float)
+    layouts = len(walls_batch)
+    polys = rectangle_polygons(walls_batch.reshape(-1, 3)).reshape(layouts, -1, 4, 2)
+    return np.stack([polys, np.roll(polys, -1, axis=2)], axis=3).reshape(layouts, -1, 2, 2)
+
+def layout_chunk_size(penalty_rays: PenaltyRays, segments_per_layout:int, dtype=np.float64,
+                      memory_budget:int=DEFAULT_MEMORY_BUDGET) -> int:
+    """
+    Number of layouts per score_layouts chunk whose pair arrays, together with the ray tests of
+    MIN_LAYOUT_RAY_CHUNK open rays, fit memory_budget bytes.
+    """
+    pairs = sum(len(pair_rays.static_blocked)
+                for pair_rays in (penalty_rays.disturbing, penalty_rays.windows, penalty_rays.friendlies))
+    per_layout = (pairs * LAYOUT_PAIR_BYTES
+                  + segments_per_layout * MIN_LAYOUT_RAY_CHUNK * LAYOUT_TEST_BYTES[kernel_dtype(dtype)])
+    return max(1, int(memory_budget // per_layout))
+
+def score_layouts(scene, walls_batch, alpha:float=10, beta:float=0.5, gamma:float=0.5, disturbing_points:bool=True,
+                  chunk_size:int=None, prune_tolerance:float=0.0, dtype=np.float64,
+                  memory_budget:int=DEFAULT_MEMORY_BUDGET):
+    """
+    compute_scene_penalties for many layouts of the same scene at once.
+
+    Parameters:
+      scene             : compiled OfficeScene.
+      walls_batch       : array-like of shape (L, k, 3); L layouts of k movable walls (x, y, angle).
+      chunk_size        : number of layouts handled per kernel call; by default layout_chunk_size.
+      prune_tolerance   : bound on the error of the reward terms from skipping negligible pairs (see reward_pairs).
+      dtype             : np.float64 or np.float32 for the ray tests (visibility.layouts_pair_rays_visibility);
+                          float32 halves their memory and gives the same penalties.
+      memory_budget     : peak working memory in bytes of one chunk of layouts, ray tests included.
+
+    Returns:
+      An (L, 3) array; row l holds (exposure_to_disturbing_people, exposure_to_windows,
+      exposure_to_non_disturbing) of layout l, equal to compute_scene_penalties(scene, walls_batch[l]).
+    """
+    walls_batch = np.asarray(walls_batch, dtype=float)
+    walls_batch = walls_batch.reshape(len(walls_batch), -1, 3) if walls_batch.size else np.zeros((len(walls_batch), 0, 3))
+    penalty_rays = get_pruned_penalty_rays(scene, disturbing_points, beta, gamma, prune_tolerance).penalty_rays
+
+    if chunk_size is None:
+        chunk_size = layout_chunk_size(penalty_rays, 4 * walls_batch.shape[1], dtype, memory_budget)
+
+    penalties = np.zeros((len(walls_batch), 3))
+    for start in range(0, len(walls_batch), chunk_size):
+        segments = layout_wall_segments(walls_batch[start:start + chunk_size])
+        visibilities = [layouts_pair_rays_visibility(pair_rays, segments, dtype, memory_budget)
+                        for pair_rays in (penalty_rays.disturbing, penalty_rays.windows, penalty_rays.friendlies)]
+        for column, penalty in enumerate(accumulate_penalties(penalty_rays, *visibilities, alpha, beta, gamma)):
+            penalties[start:start + chunk_size, column] = penalty
+    return penalties
+
+def calculate_exposure_to_disturbing_people(persons, disturbing_persons, alpha, epsilon, blockers_all, person_sample_count, person_sample_radius, engine='rays', samples=None):
+    # Sample points and distances are indexed from the PenaltySamples of the plan.
+    if samples is None:
+        samples = penalty_samples((), persons, disturbing_persons, person_sample_count, person_sample_radius)
+    # Skip if the person is the same as the disturbing person.
+    pairs = [(p, d) for p in persons for d in disturbing_persons if p != d]
+    rows_p = samples.point_rows([p for p, _ in pairs])
+    rows_d = samples.point_rows([d for _, d in pairs])
+    # All pairs are scored in one pass of the selected engine.
+    visibilities = (pairs_visibility if engine == 'rays' else pairs_visibility_sweep)(
+        samples.person_samples[rows_p], samples.person_samples[rows_d], blockers_all)
     exposure_to_disturbing_persons = 0
-    for p in persons:
-        p_samples = generate_sample_points_around(p, person_sample_radius, person_sample_count)
-        for d in disturbing_persons:
-            # Skip if the person is the same as the disturbing person.
-            if p == d:
-                continue
-            d_samples = generate_sample_points_around(d, person_sample_radius, person_sample_count)
-            visibility = fraction_visible(p_samples, d_samples, blockers_all)
-            dist = euclidean_distance(p, d)
-            # The closer the disturbing person and the higher the visible fraction, the larger the penalty.
-            exposure_to_disturbing_persons += alpha * visibility / (dist + epsilon)
+    for dist, visibility in zip(samples.point_distances[rows_p, rows_d].tolist(), visibilities.tolist()):
+        # The closer the disturbing person and the higher the visible fraction, the larger the penalty.
+        exposure_to_disturbing_persons += alpha * visibility / (dist + epsilon)
     return exposure_to_disturbing_persons
 
-def calculate_exposure_to_windows(windows, persons, beta, epsilon, blockers_no_office, person_sample_count, person_sample_radius, window_sample_count):
+def calculate_exposure_to_windows(windows, persons, beta, epsilon, blockers_no_office, person_sample_count, person_sample_radius, window_sample_count, engine='rays', pairs=None, samples=None):
+    if samples is None:
+        samples = penalty_samples(windows, persons, (), person_sample_count, person_sample_radius, window_sample_count)
+    # By default every (person, window) pair; reward_pairs gives the pairs without the negligible ones.
+    if pairs is None:
+        pairs = [(p, window) for p in persons for window in windows]
+    rows_p = samples.point_rows([p for p, _ in pairs])
+    rows_w = samples.window_rows([window for _, window in pairs])
+    person_samples = samples.person_samples[rows_p]
+    if engine == 'sweep':
+        # The visible length of every window is computed exactly, without samples along it.
+        visibilities = windows_visibility_sweep(person_samples, samples.window_segments[rows_w], blockers_no_office)
+    else:
+        # Sample along the window.
+        visibilities = pairs_visibility(person_samples, samples.window_samples[rows_w], blockers_no_office)
     exposure_to_windows = 0
-    for p in persons:
-        p_samples = generate_sample_points_around(p, person_sample_radius, person_sample_count)
-        for window in windows:
-            # Get window endpoints and sample along the window.
-            p1, p2 = utils_window.get_window_coordinates_2d(window[0], window[1], window[2], window[3])
-            window_samples = sample_points_along_line(p1, p2, window_sample_count)
-            visibility = fraction_visible(p_samples, window_samples, blockers_no_office)
-            # Use window midpoint for distance computation.
-            mid = window_midpoint(window)
-            dist = euclidean_distance(p, mid)
-            # The closer the window and the more visible it is, the higher the benefit.
-            exposure_to_windows -= beta * visibility / (dist + epsilon)**2
+    # Distances are to the window midpoints.
+    for dist, visibility in zip(samples.window_distances[rows_p, rows_w].tolist(), visibilities.tolist()):
+        # The closer the window and the more visible it is, the higher the benefit.
+        exposure_to_windows -= beta * visibility / (dist + epsilon)**2
     return exposure_to_windows
 
-def calculate_exposure_to_friendlies(persons, disturbing_persons, gamma, epsilon, blockers_all, person_sample_count, person_sample_radius):
-    non_disturbing = [p for p in persons if p not in disturbing_persons]
-    n = len(non_disturbing)
+def calculate_exposure_to_friendlies(persons, disturbing_persons, gamma, epsilon, blockers_all, person_sample_count, person_sample_radius, engine='rays', pairs=None, samples=None):
+    if samples is None:
+        samples = penalty_samples((), persons, disturbing_persons, person_sample_count, person_sample_radius)
+    if pairs is None:
+        non_disturbing = [p for p in persons if p not in disturbing_persons]
+        n = len(non_disturbing)
+        pairs = [(non_disturbing[i], non_disturbing[j]) for i in range(n) for j in range(i + 1, n)]
+    rows_p = samples.point_rows([p for p, _ in pairs])
+    rows_q = samples.point_rows([q for _, q in pairs])
+    visibilities = (pairs_visibility if engine == 'rays' else pairs_visibility_sweep)(
+        samples.person_samples[rows_p], samples.person_samples[rows_q], blockers_all)
     exposure_to_non_disturbing = 0
-    for i in range(n):
-        for j in range(i + 1, n):
-            p = non_disturbing[i]
-            q = non_disturbing[j]
-            p_samples = generate_sample_points_around(p, person_sample_radius, person_sample_count)
-            q_samples = generate_sample_points_around(q, person_sample_radius, person_sample_count)
-            visibility = fraction_visible(p_samples, q_samples, blockers_all)
-            dist = euclidean_distance(p, q)
-            exposure_to_non_disturbing -= gamma * visibility / (dist + epsilon)**2
+    for dist, visibility in zip(samples.point_distances[rows_p, rows_q].tolist(), visibilities.tolist()):
+        exposure_to_non_disturbing -= gamma * visibility / (dist + epsilon)**2
     return exposure_to_non_disturbing
 
 # Helper functions
@@ -200,13 +692,14 @@ def fraction_visible(sample_points_a, sample_points_b, blockers):
     Compute the fraction of rays from sample_points_a to sample_points_b that are unblocked.
     Returns a value between 0.0 (fully blocked) and 1.0 (completely unobstructed).
     """
-    total = len(sample_points_a) * len(sample_points_b)
-    unblocked = 0
-    for a in sample_points_a:
-        for b in sample_points_b:
-            if not is_blocked(a, b, blockers):
-                unblocked += 1
-    return unblocked / total
+    return float(pairs_visibility([sample_points_a], [sample_points_b], blockers)[0])
+
+def fraction_visible_sweep(sample_points_a, sample_points_b, blockers):
+    """
+    fraction_visible with the visibility polygon of every point of sample_points_a: one angular
+    sweep per observer and a binary search per target instead of a ray test per pair of points.
+    """
+    return float(pairs_visibility_sweep([sample_points_a], [sample_points_b], blockers)[0])
 
 def window_midpoint(window):
     """
@@ -216,21 +709,23 @@ def window_midpoint(window):
     p1, p2 = utils_window.get_window_coordinates_2d(window[0], window[1], window[2], window[3])
     return ((p1[0] + p2[0]) / 2, (p1[1] + p2[1]) / 2)
 
-def compute_office_blockers(moveable_walls, include_office=True):
+def office_wall_segments(office_coordinates=None):
     """
-    Compute a list of line segments (each as ((x1, y1), (x2, y2))) that block line-of-sight.
+    Line segments (each as ((x1, y1), (x2, y2))) along the office outline of a plan.
+    Without office_coordinates, the outline is the OFFICE_LENGTH x OFFICE_WIDTH rectangle.
+    Compiled scenes hold the same segments as the array OfficeScene.office_walls.
+    """
+    if office_coordinates is None:
+        office_coordinates = (constants.OFFICE_RECTANGLE, (constants.OFFICE_LENGTH, constants.OFFICE_WIDTH))
+    corners = office_polygon(office_coordinates)
+    n = len(corners)
+    return [(tuple(corners[i]), tuple(corners[(i + 1) % n])) for i in range(n)]
+
+def movable_wall_segments(moveable_walls):
+    """
+    Line segments (each as ((x1, y1), (x2, y2))) along the edges of the movable walls.
     """
     blockers = []
-    if include_office:
-        # Office walls defined as a rectangle
-        office_walls = [
-            ((0, 0), (constants.OFFICE_LENGTH, 0)),
-            ((constants.OFFICE_LENGTH, 0), (constants.OFFICE_LENGTH, constants.OFFICE_WIDTH)),
-            ((constants.OFFICE_LENGTH, constants.OFFICE_WIDTH), (0, constants.OFFICE_WIDTH)),
-            ((0, constants.OFFICE_WIDTH), (0, 0))
-        ]
-        blockers.extend(office_walls)
-    # Add movable wall segments.
     for mw in moveable_walls:
         poly = get_rectangle_polygon(mw[0], mw[1], constants.MOVABLE_WALL_LENGTH, constants.MOVABLE_WALL_WIDTH, mw[2])
         n = len(poly)
@@ -240,20 +735,26 @@ def compute_office_blockers(moveable_walls, include_office=True):
             blockers.append(((p1[0], p1[1]), (p2[0], p2[1])))
     return blockers
 
+def compute_office_blockers(moveable_walls, include_office=True, office_coordinates=None):
+    """
+    Compute a list of line segments (each as ((x1, y1), (x2, y2))) that block line-of-sight:
+    the office walls of the given outline (see office_wall_segments) and the movable walls.
+    """
+    blockers = office_wall_segments(office_coordinates) if include_office else []
+    blockers.extend(movable_wall_segments(moveable_walls))
+    return blockers
+
 def line_of_sight(p, q, blockers):
     """
     Returns True if the line segment from point p to q is not blocked by any segment in blockers.
     (This remains for quick binary checks if needed.)
     """
-    for seg in blockers:
-        if segments_intersect(p, q, seg[0], seg[1]):
-            return False
-    return True
+    return not rays_blocked([p], [q], blockers)[0]
 
 # --- Example usage ---
 if __name__ == "__main__":   
 
-    office_coordinates, windows, desks, persons, disturbing_persons, moveable_walls = define_office_plan()
+    office_coordinates, windows, doors, desks, persons, disturbing_persons, objects, disturbing_points, moveable_walls = define_office_plan()
     
     # start_time = time.time()
     # for _ in range(1000):
@@ -261,5 +762,14 @@ if __name__ == "__main__":
     # end_time = time.time()
     # print(f"Elapsed time: {(end_time - start_time)/1000:.3f} seconds")
 
-    score = compute_office_penalty(windows, persons, disturbing_persons, moveable_walls)
-    print(f"Penalty Score: {score:.3f}")
+    for engine in VISIBILITY_ENGINES:
+        score = compute_office_penalty(windows, persons, disturbing_persons, moveable_walls,
+                                       office_coordinates=office_coordinates, engine=engine)
+        print(f"Penalty Score ({engine}): {score:.3f}")
+
+    prune_tolerance = 0.05
+    pairs = reward_pairs(windows, persons, disturbing_persons, prune_tolerance=prune_tolerance)
+    score = compute_office_penalty(windows, persons, disturbing_persons, moveable_walls,
+                                   office_coordinates=office_coordinates, prune_tolerance=prune_tolerance)
+    print(f"Penalty Score (pruned, tolerance {prune_tolerance}): {score:.3f}, "
+          f"skipped mass {pairs.skipped_windows + pairs.skipped_friendlies:.4f}")
@@ -0,0 +1,167 @@
+import path_helper
+path_helper.add_project_path()
+
+import numpy as np
+
+from office_score.penalty_score import get_penalty_rays, movable_wall_segments, accumulate_penalties
+from office_score.visibility import rays_blocked, RAY_BOX_PADDING
+from office_score.broad_phase import aabbs_overlap_batch, polygon_aabbs
+
+"""
+Module: penalty_state
+
+Incremental penalty scoring for a layout of movable walls in one office scene. For every
+ray that the office walls leave open, PenaltyState keeps how many movable walls block it
+and which rays every wall blocks. Moving a wall withdraws its old blocks from the counts
+and tests the new wall only against the rays whose bounding box overlaps it; the
+visibility of a pair changes only when one of its rays goes from open to blocked or back.
+
+The three sums are re-accumulated from the pair visibilities in the order of
+compute_separate_penalties, which is cheap next to the ray tests and keeps the result
+identical to a full recompute (float deltas would drift).
+"""
+
+class _RayGroup:
+    """Blocked counts of the open rays of one PairRays group."""
+
+    def __init__(self, pair_rays):
+        starts, ends, static_blocked, open_rays = pair_rays
+        num_pairs, rays_per_pair = static_blocked.shape if static_blocked.size else (len(static_blocked), 1)
+        self.rays_per_pair = rays_per_pair
+        self.starts = starts.reshape(-1, 2)[open_rays]
+        self.ends = ends.reshape(-1, 2)[open_rays]
+        self.aabbs = polygon_aabbs(np.stack([self.starts, self.ends], axis=1))
+        self.pair_of_ray = open_rays // rays_per_pair
+        self.block_counts = np.zeros(len(open_rays), dtype=int)
+        self.open_counts = rays_per_pair - np.count_nonzero(static_blocked, axis=1) if static_blocked.size \
+            else np.zeros(num_pairs, dtype=int)
+
+    def wall_blocks(self, segments, aabb):
+        """Indices of the open rays blocked by one wall, testing only the rays whose box overlaps the wall's."""
+        candidates = np.flatnonzero(aabbs_overlap_batch(self.aabbs, aabb))
+        return candidates[rays_blocked(self.starts[candidates], self.ends[candidates], segments)]
+
+    def add_blocks(self, rays):
+        newly_blocked = rays[self.block_counts[rays] == 0]
+        self.block_counts[rays] += 1
+        np.subtract.at(self.open_counts, self.pair_of_ray[newly_blocked], 1)
+
+    def remove_blocks(self, rays):
+        self.block_counts[rays] -= 1
+        reopened = rays[self.block_counts[rays] == 0]
+        np.add.at(self.open_counts, self.pair_of_ray[reopened], 1)
+
+    @property
+    def visibility(self):
+        return self.open_counts / self.rays_per_pair
+
+
+class PenaltyState:
+    """
+    Penalties of a list of movable walls (x, y, angle) in a compiled OfficeScene.
+
+    `penalties` always equals penalty_score.compute_scene_penalties(scene, walls, alpha, beta,
+    gamma, disturbing_points) exactly.
+    """
+
+    def __init__(self, scene, moveable_walls=(), alpha:float=10, beta:float=0.5, gamma:float=0.5,
+                 disturbing_points:bool=True):
+        self.scene = scene
+        self.alpha = alpha
+        self.beta = beta
+        self.gamma = gamma
+        self._penalty_rays = get_penalty_rays(scene, disturbing_points)
+        self._groups = [_RayGroup(pair_rays) for pair_rays in
+                        (self._penalty_rays.disturbing, self._penalty_rays.windows, self._penalty_rays.friendlies)]
+        self.walls = []
+        self._blocks = []   # per wall: the open rays it blocks, one index array per group
+        for wall in moveable_walls:
+            self.add_wall(wall)
+
+    def __len__(self):
+        return len(self.walls)
+
+    def _wall_blocks(self, wall):
+        segments = np.asarray(movable_wall_segments([wall]), dtype=float)
+        aabb = polygon_aabbs(segments.reshape(-1, 2)) + np.array([-1, -1, 1, 1]) * RAY_BOX_PADDING
+        return [group.wall_blocks(segments, aabb) for group in self._groups]
+
+    def _withdraw(self, i):
+        for group, rays in zip(self._groups, self._blocks[i]):
+            group.remove_blocks(rays)
+
+    def _set_wall(self, i, wall):
+        self.walls[i] = wall
+        self._blocks[i] = self._wall_blocks(wall)
+        for group, rays in zip(self._groups, self._blocks[i]):
+            group.add_blocks(rays)
+
+    def add_wall(self, wall):
+        """Appends a wall (x, y, angle) to the layout and returns its index."""
+        self.walls.append(None)
+        self._blocks.append(None)
+        self._set_wall(len(self.walls) - 1, wall)
+        return len(self.walls) - 1
+
+    def remove_wall(self, i):
+        """Removes wall i; the walls after it move up by one index."""
+        self._withdraw(i)
+        del self.walls[i]
+        del self._blocks[i]
+
+    def move_wall(self, i, x, y, angle):
+        """Moves wall i to (x, y, angle), re-testing only the rays near its new position."""
+        self._withdraw(i)
+        self._set_wall(i, (x, y, angle))
+
+    @property
+    def penalties(self) -> tuple[float, float, float]:
+        """(exposure_to_disturbing_people, exposure_to_windows, exposure_to_non_disturbing) of the current layout."""
+        return accumulate_penalties(self._penalty_rays, *(group.visibility for group in self._groups),
+                                    self.alpha, self.beta, self.gamma)
+
+    @property
+    def score(self) -> float:
+        """Sum of the three penalties."""
+        return sum(self.penalties)
+
+
+# --------------------------
+# Example usage: random single-wall moves against full recomputation
+# --------------------------
+if __name__ == "__main__":
+    import random
+    import time
+    from office_score.office_scene import load_office_scene
+    from office_score.penalty_score import compute_scene_penalties
+
+    random.seed(0)
+    for plan in (0, 4, 16, 21, 22):
+        scene = load_office_scene(plan)
+        max_x, max_y = scene.office_polygon.max(axis=0)
+
+        def random_wall():
+            return (random.uniform(0, max_x), random.uniform(0, max_y), random.uniform(-90, 90))
+
+        state = PenaltyState(scene, list(scene.moveable_walls) + [random_wall() for _ in range(5)])
+        moves = [(random.randrange(len(state)), *random_wall()) for _ in range(300)]
+
+        mismatches = 0
+        incremental_time = 0.0
+        full_time = 0.0
+        for i, x, y, angle in moves:
+            start_time = time.perf_counter()
+            state.move_wall(i, x, y, angle)
+            penalties = state.penalties
+            incremental_time += time.perf_counter() - start_time
+
+            start_time = time.perf_counter()
+            expected = compute_scene_penalties(scene, state.walls)
+            full_time += time.perf_counter() - start_time
+            mismatches += penalties != expected
+
+        state.remove_wall(0)
+        state.add_wall(random_wall())
+        mismatches += state.penalties != compute_scene_penalties(scene, state.walls)
+        print(f"Plan {plan:2d}: {len(state)} walls, {mismatches} mismatches, "
+              f"move {incremental_time / len(moves) * 1e3:.2f} ms vs full {full_time / len(moves) * 1e3:.2f} ms")
@@ -0,0 +1,280 @@
+import path_helper
+path_helper.add_project_path()
+
+import time
+from typing import NamedTuple
+import numpy as np
+
+import constants
+from office_score.batch_collisions import (detect_collisions_batch, rectangle_polygons, polygons_intersect_batch,
+                                           distance_points_to_segments)
+from office_score.clearance_map import get_clearance_map, MEDIAL_AXIS_SAMPLES
+from office_score.free_space import get_free_space_map, ANGLE_RANGE
+from office_score.optimisation import ObjectiveStats, SearchResult, valid_fixed_walls
+from office_score.penalty_score import score_layouts
+
+"""
+Module: population_search
+
+Population-based search for the added walls of a layout. basinhopping scores one layout
+at a time and polishes it with a gradient-based minimizer, although the penalty is
+piecewise constant (visibility is a count of open rays) and infinite wherever walls
+collide. Differential evolution needs neither gradients nor a feasible start: a whole
+generation of trial layouts is scored at once by BatchLayoutObjective, with one
+detect_collisions_batch call for the walls against the scene and one score_layouts call
+for the feasible layouts.
+
+Infeasible layouts are not discarded with an infinite score. They get a violation, the
+depth by which their walls reach into obstacles, the outline and each other, measured
+along the medial axis of every wall with the clearance map, plus CONTACT_VIOLATION for
+every collision the exact check finds. The sampled depth can miss a thin overlap; the
+collision count keeps every infeasible layout above zero and still orders those by how
+much they collide. Selection follows the feasibility rules: a smaller violation wins, and
+at equal violation (zero for feasible layouts) the smaller score wins. Infeasible trials
+thereby still lead the population towards free space.
+"""
+
+DEFAULT_POPULATION = 32           # layouts per generation
+DEFAULT_GENERATIONS = 200         # generations of differential_evolution_search
+DEFAULT_MUTATION = (0.5, 1.0)     # range of the differential weight F, drawn anew every generation
+DEFAULT_CROSSOVER = 0.7           # probability CR that a parameter comes from the mutant
+
+ANGLE_PERIOD = ANGLE_RANGE[1] - ANGLE_RANGE[0]   # walls are symmetric, angles wrap around every 180 degrees
+# Violation of one collision of the exact check, in the square metres of layout_penetration;
+# an overlap of 5 mm along a whole wall
+CONTACT_VIOLATION = 0.01
+
+
+class PopulationScores(NamedTuple):
+    """Scores of P layouts of a BatchLayoutObjective."""
+    scores: np.ndarray      # (P,) penalty score, np.inf where infeasible
+    violations: np.ndarray  # (P,) CONTACT_VIOLATION per collision plus the penetration, 0 where feasible
+
+
+def wrap_angles(angles):
+    """Angles in degrees mapped into ANGLE_RANGE."""
+    return (np.asarray(angles, dtype=float) - ANGLE_RANGE[0]) % ANGLE_PERIOD + ANGLE_RANGE[0]
+
+
+def medial_axes(walls):
+    """End points (..., 2, 2) of the medial axes of walls (..., 3)."""
+    walls = np.asarray(walls, dtype=float)
+    rad = np.radians(walls[..., 2])
+    half = constants.MOVABLE_WALL_LENGTH / 2 * np.stack([np.cos(rad), np.sin(rad)], axis=-1)
+    return np.stack([walls[..., :2] - half, walls[..., :2] + half], axis=-2)
+
+
+def layout_penetration(clearance_map, layouts, fixed_walls=(), samples:int=MEDIAL_AXIS_SAMPLES):
+    """
+    How deep the added walls of P layouts reach into the scene and into each other.
+
+    Every wall is taken as the capsule of radius MOVABLE_WALL_WIDTH / 2 around its medial axis.
+    Along the axis, the intrusion into obstacles, the outline and the other walls of the layout
+    (fixed walls included) is integrated, which gives square metres of overlap per wall.
+
+    Parameters:
+      clearance_map : ClearanceMap of the scene.
+      layouts       : (P, k, 3) added walls.
+      fixed_walls   : (F, 3) walls that are part of every layout.
+
+    Returns:
+      (P,) summed penetration; 0 for layouts whose capsules are clear at every sample.
+    """
+    layouts = np.asarray(layouts, dtype=float)
+    fixed_walls = np.asarray(fixed_walls, dtype=float).reshape(-1, 3)
+    half_width = constants.MOVABLE_WALL_WIDTH / 2
+    axes = medial_axes(layouts)                                   # (P, k, 2, 2)
+    t = np.linspace(0.0, 1.0, samples)[:, None]
+    points = axes[:, :, None, 0] + t * (axes[:, :, None, 1] - axes[:, :, None, 0])   # (P, k, S, 2)
+
+    obstacle = clearance_map.nearest(clearance_map.obstacle_distance, points)
+    outline = clearance_map.nearest(clearance_map.outline_distance, points)
+    intrusion = np.maximum(half_width - obstacle, 0) + np.maximum(half_width - outline, 0)
+
+    # The other added walls, then the fixed walls
+    count = layouts.shape[1]
+    for j in range(count):
+        distance = distance_points_to_segments(points, axes[:, None, None, j, 0], axes[:, None, None, j, 1])
+        distance[:, j] = np.inf
+        intrusion += np.maximum(2 * half_width - distance, 0)
+    for a, b in medial_axes(fixed_walls):
+        intrusion += np.maximum(2 * half_width - distance_points_to_segments(points, a, b), 0)
+    return intrusion.mean(axis=2).sum(axis=1) * constants.MOVABLE_WALL_LENGTH
+
+
+class BatchLayoutObjective:
+    """
+    LayoutObjective for a whole population: scores P parameter vectors [x1, y1, angle1, ..., xk, yk, anglek]
+    at once and returns PopulationScores. Feasibility is decided exactly, like is_valid_scene_layout;
+    the penalties are those of score_layouts. The stats count every layout as one evaluation and time
+    every call.
+
+    fixed_walls stay in every layout, by default the scene's movable walls; a ValueError is raised if
+    they collide (optimisation.valid_fixed_walls), since no layout could then be feasible.
+    """
+
+    def __init__(self, scene, fixed_walls=None, alpha:float=10, beta:float=0.5, gamma:float=0.5,
+                 disturbing_points:bool=False):
+        self.scene = scene
+        self.fixed_walls = np.asarray(valid_fixed_walls(scene, fixed_walls), dtype=float).reshape(-1, 3)
+        self.alpha = alpha
+        self.beta = beta
+        self.gamma = gamma
+        self.disturbing_points = disturbing_points
+        self.clearance_map = get_clearance_map(scene)
+        self.stats = ObjectiveStats()
+
+    def walls(self, params):
+        """The added walls of params as a list of (x, y, angle) tuples."""
+        return [tuple(wall) for wall in np.reshape(np.asarray(params, dtype=float), (-1, 3)).tolist()]
+
+    def collisions(self, layouts):
+        """(P,) number of collisions of the added walls (P, k, 3) with the scene, the fixed walls and each other."""
+        num_layouts, count = layouts.shape[:2]
+        _, matrix = detect_collisions_batch(layouts.reshape(-1, 3), self.scene, self.fixed_walls, return_matrix=True)
+        collisions = matrix.reshape(num_layouts, -1).sum(axis=1)
+        polys = rectangle_polygons(layouts.reshape(-1, 3)).reshape(num_layouts, count, 4, 2)
+        for i in range(count):
+            for j in range(i + 1, count):
+                collisions += polygons_intersect_batch(polys[:, i], polys[:, j])
+        return collisions
+
+    def __call__(self, population) -> PopulationScores:
+        start_time = time.perf_counter()
+        population = np.asarray(population, dtype=float)
+        layouts = population.reshape(len(population), -1, 3)
+        collisions = self.collisions(layouts)
+        feasible = collisions == 0
+        violations = CONTACT_VIOLATION * collisions
+        if not feasible.all():
+            violations[~feasible] += layout_penetration(self.clearance_map, layouts[~feasible], self.fixed_walls)
+        collision_end = time.perf_counter()
+
+        scores = np.full(len(layouts), np.inf)
+        if feasible.any():
+            candidates = layouts[feasible]
+            walls_batch = np.concatenate([np.broadcast_to(self.fixed_walls, (len(candidates),) + self.fixed_walls.shape),
+                                          candidates], axis=1)
+            scores[feasible] = score_layouts(self.scene, walls_batch, self.alpha, self.beta, self.gamma,
+                                             self.disturbing_points).sum(axis=1)
+        end_time = time.perf_counter()
+
+        stats = self.stats
+        stats.evaluations += len(layouts)
+        stats.infeasible += int(np.count_nonzero(~feasible))
+        stats.collision_time += collision_end - start_time
+        stats.penalty_time += end_time - collision_end
+        stats.evaluation_times.append(end_time - start_time)
+        if len(scores) and scores.min() < stats.best_score:
+            best = int(np.argmin(scores))
+            stats.best_score = float(scores[best])
+            stats.best_walls = tuple(self.walls(population[best]))
+        return PopulationScores(scores, violations)
+
+
+def ranks_before(scores_a, violations_a, scores_b, violations_b):
+    """Feasibility rules: True where a is at least as good as b, first by violation, then by score."""
+    return (violations_a < violations_b) | ((violations_a == violations_b) & (scores_a <= scores_b))
+
+
+def differential_evolution_search(scene, count:int=constants.NUMBER_OF_MOVABLE_WALLS,
+                                  population:int=DEFAULT_POPULATION, generations:int=DEFAULT_GENERATIONS,
+                                  mutation=DEFAULT_MUTATION, crossover:float=DEFAULT_CROSSOVER, time_budget=None,
+                                  seed=None, fixed_walls=None, alpha:float=10, beta:float=0.5, gamma:float=0.5,
+                                  disturbing_points:bool=False) -> SearchResult:
+    """
+    Places `count` walls with differential evolution (DE/rand/1/bin) on BatchLayoutObjective.
+
+    The first generation is drawn from the free-space map, so every wall is clear of the scene on
+    its own. x and y are kept inside the bounding box of the office, angles wrap around.
+
+    Parameters:
+      scene        : compiled OfficeScene.
+      count        : walls to place.
+      population   : layouts per generation (at least 4).
+      generations  : generations after the first one.
+      mutation     : (low, high) range of the differential weight, drawn every generation.
+      crossover    : probability that a parameter of the trial comes from the mutant.
+      time_budget  : wall-clock seconds, checked after every generation; None for no limit.
+      fixed_walls  : movable walls that stay in every layout; by default the scene's movable walls.
+                     Raises ValueError if they collide.
+
+    Returns:
+      SearchResult of the best layout; its score is np.inf if no feasible layout was found, and
+      its walls are then those of the smallest violation.
+    """
+    if population < 4:
+        raise ValueError(f"Differential evolution needs a population of at least 4, got {population}.")
+    start_time = time.perf_counter()
+    rng = np.random.default_rng(seed)
+    objective = BatchLayoutObjective(scene, fixed_walls, alpha, beta, gamma, disturbing_points)
+    low = np.tile([*scene.office_polygon.min(axis=0), ANGLE_RANGE[0]], count)
+    high = np.tile([*scene.office_polygon.max(axis=0), ANGLE_RANGE[1]], count)
+    is_angle = np.tile([False, False, True], count)
+
+    samples, _ = get_free_space_map(scene).sample(population * count, rng)
+    members = samples.reshape(population, 3 * count)
+    scores, violations = objective(members)
+
+    for _ in range(generations):
+        if time_budget is not None and time.perf_counter() - start_time >= time_budget:
+            break
+        # Three distinct partners per member, none of them the member itself
+        keys = rng.random((population, population))
+        np.fill_diagonal(keys, np.inf)
+        r1, r2, r3 = np.argsort(keys, axis=1)[:, :3].T
+
+        difference = members[r2] - members[r3]
+        difference[:, is_angle] = wrap_angles(difference[:, is_angle])
+        mutants = members[r1] + rng.uniform(*mutation) * difference
+        mutants[:, ~is_angle] = np.clip(mutants[:, ~is_angle], low[~is_angle], high[~is_angle])
+        mutants[:, is_angle] = wrap_angles(mutants[:, is_angle])
+
+        cross = rng.random(members.shape) < crossover
+        cross[np.arange(population), rng.integers(members.shape[1], size=population)] = True
+        trials = np.where(cross, mutants, members)
+
+        trial_scores, trial_violations = objective(trials)
+        replace = ranks_before(trial_scores, trial_violations, scores, violations)
+        members[replace] = trials[replace]
+        scores[replace] = trial_scores[replace]
+        violations[replace] = trial_violations[replace]
+
+    best = int(np.lexsort((scores, violations))[0])
+    elapsed = time.perf_counter() - start_time
+    return SearchResult(members[best].reshape(-1, 3), float(scores[best]), objective.stats.evaluations, elapsed,
+                        objective.stats)
+
+
+# --------------------------
+# Example usage: differential evolution against basinhopping on every bundled plan, same time budget
+# --------------------------
+if __name__ == "__main__":
+    import argparse
+    from office_score.office_scene import load_office_scene
+    from office_score.optimisation import start_search, DEFAULT_NITER
+
+    parser = argparse.ArgumentParser(description="Compare differential evolution with basinhopping on every plan.")
+    parser.add_argument('--budget', type=float, default=5.0, help="wall-clock seconds per optimizer and plan")
+    parser.add_argument('--walls', type=int, default=constants.NUMBER_OF_MOVABLE_WALLS)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    wins = 0
+    for plan in range(23):
+        scene = load_office_scene(plan)
+        # The preset walls of some plans collide; the comparison places walls in the empty plan
+        get_clearance_map(scene)
+        get_free_space_map(scene)
+        evolution = differential_evolution_search(scene, args.walls, generations=1_000_000, time_budget=args.budget,
+                                                  seed=args.seed, fixed_walls=())
+        hopping = start_search(scene, np.random.SeedSequence(args.seed), args.walls, niter=DEFAULT_NITER,
+                               deadline=time.time() + args.budget, fixed_walls=())
+        wins += evolution.score < hopping.score
+        print(f"Plan {plan:2d}: evolution {evolution.score:8.3f} in {evolution.elapsed:5.2f} s "
+              f"({evolution.evaluations / evolution.elapsed:6.0f} layouts/s, "
+              f"{evolution.stats.infeasible / evolution.evaluations:.0%} infeasible) | "
+              f"basinhopping {hopping.score:8.3f} in {hopping.elapsed:5.2f} s "
+              f"({hopping.evaluations / hopping.elapsed:6.0f} layouts/s, "
+              f"{hopping.stats.infeasible / hopping.evaluations:.0%} infeasible)")
+    print(f"Differential evolution found the better layout on {wins} of 23 plans.")
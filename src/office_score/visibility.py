@@ -0,0 +1,248 @@
+import path_helper
+path_helper.add_project_path()
+
+from typing import NamedTuple
+import numpy as np
+
+from office_score.batch_collisions import (segments_intersect_batch, segments_intersect_batch_float32, kernel_dtype,
+                                           DEFAULT_MEMORY_BUDGET)
+from office_score.broad_phase import aabbs_overlap_batch, polygon_aabbs
+
+"""
+Module: visibility
+
+Vectorized line-of-sight tests for the penalty score. A set of R rays is intersected
+with B blocker segments in one broadcasted (R x B) computation, using the same
+orientation tests as check_collisions.segments_intersect, so collinear and touching
+segments block exactly as in the scalar code.
+
+Occluders that never move (the office walls) are tested once per plan: PairRays keeps
+which rays of every scored pair they already block, and only the remaining open rays
+are tested against the movable walls of a layout.
+
+The kernels chunk their broadcast arrays to a memory budget in bytes. With dtype float32
+the ray tests run on float32 copies, and the few tests whose orientation lies within the
+float32 rounding bound of collinear are redone in float64, so the visibilities equal the
+float64 ones while the large arrays take half the memory.
+"""
+
+# Peak bytes per (ray, blocker) test of rays_blocked and per (layout, ray, segment) triple of
+# layouts_pair_rays_visibility when every box overlaps; measured with tracemalloc, per kernel dtype
+RAY_TEST_BYTES = {np.dtype(np.float64): 32, np.dtype(np.float32): 24}
+LAYOUT_TEST_BYTES = {np.dtype(np.float64): 136, np.dtype(np.float32): 88}
+
+# Padding of the blocker boxes of the box prefilter; covers the 1e-9 tolerance of the orientation test
+RAY_BOX_PADDING = 1e-6
+
+
+def blocker_segments(blockers):
+    """Blockers as a (B, 2, 2) array of segments, from a list of ((x1, y1), (x2, y2)) or an array."""
+    return np.asarray(blockers, dtype=float).reshape(-1, 2, 2)
+
+
+def coordinate_scale(*arrays):
+    """Largest absolute coordinate of the arrays, which the float32 rounding bounds scale with."""
+    return max((float(np.abs(array).max()) for array in arrays if array.size), default=0.0)
+
+
+def rays_blocked(starts, ends, blockers, dtype=np.float64, memory_budget=DEFAULT_MEMORY_BUDGET):
+    """
+    Tests every ray starts[r] -> ends[r] against every blocker segment.
+
+    Parameters:
+      starts, ends  : arrays of shape (R, 2).
+      blockers      : list of ((x1, y1), (x2, y2)) segments or a (B, 2, 2) array.
+      dtype         : np.float64 or np.float32 for the broadcast tests; the result is the same.
+      memory_budget : peak working memory in bytes the chunks of rays are sized against.
+
+    Returns:
+      An (R,) boolean array, True where the ray is blocked by any segment (penalty_score.is_blocked).
+    """
+    starts = np.asarray(starts, dtype=float).reshape(-1, 2)
+    ends = np.asarray(ends, dtype=float).reshape(-1, 2)
+    segments = blocker_segments(blockers)
+    dtype = kernel_dtype(dtype)
+    blocked = np.zeros(len(starts), dtype=bool)
+    if not len(segments):
+        return blocked
+
+    chunk_size = max(1, int(memory_budget // (len(segments) * RAY_TEST_BYTES[dtype])))
+    seg_a = segments[None, :, 0]
+    seg_b = segments[None, :, 1]
+    if dtype == np.float32:
+        scale = coordinate_scale(starts, ends, segments)
+        starts32, ends32, segments32 = (array.astype(np.float32) for array in (starts, ends, segments))
+    for start in range(0, len(starts), chunk_size):
+        stop = start + chunk_size
+        if dtype == np.float64:
+            blocked[start:stop] = segments_intersect_batch(starts[start:stop, None], ends[start:stop, None],
+                                                           seg_a, seg_b).any(axis=1)
+            continue
+        hit, uncertain = segments_intersect_batch_float32(starts32[start:stop, None], ends32[start:stop, None],
+                                                          segments32[None, :, 0], segments32[None, :, 1], scale)
+        chunk_blocked = hit.any(axis=1)
+        # A certain hit blocks in float64 too; rays with only uncertain candidates are redone in float64
+        redo = start + np.flatnonzero(~chunk_blocked & uncertain.any(axis=1))
+        chunk_blocked[redo - start] = segments_intersect_batch(starts[redo, None], ends[redo, None],
+                                                               seg_a, seg_b).any(axis=1)
+        blocked[start:stop] = chunk_blocked
+    return blocked
+
+
+class PairRays(NamedTuple):
+    """The n * m sample rays of P pairs, with the rays blocked by static occluders precomputed."""
+    starts: np.ndarray          # (P, R, 2)
+    ends: np.ndarray            # (P, R, 2)
+    static_blocked: np.ndarray  # (P, R) rays already blocked by the static occluders
+    open_rays: np.ndarray       # flat indices into the P * R rays that are still open
+
+
+def build_pair_rays(samples_a, samples_b, static_blockers=()):
+    """
+    Builds the rays from every sample of samples_a[p] to every sample of samples_b[p], in the
+    order of fraction_visible, and tests them once against the static occluders.
+
+    Parameters:
+      samples_a       : array-like of shape (P, n, 2), the sample points of the first member of every pair.
+      samples_b       : array-like of shape (P, m, 2), the sample points of the second member.
+      static_blockers : blocker segments that are the same for every layout.
+    """
+    samples_a = np.asarray(samples_a, dtype=float)
+    samples_b = np.asarray(samples_b, dtype=float)
+    if not len(samples_a):
+        empty = np.zeros((0, 0, 2))
+        return PairRays(empty, empty, np.zeros((0, 0), dtype=bool), np.zeros(0, dtype=int))
+    pairs, n = samples_a.shape[:2]
+    m = samples_b.shape[1]
+    starts = np.broadcast_to(samples_a[:, :, None, :], (pairs, n, m, 2)).reshape(pairs, n * m, 2)
+    ends = np.broadcast_to(samples_b[:, None, :, :], (pairs, n, m, 2)).reshape(pairs, n * m, 2)
+    static_blocked = rays_blocked(starts.reshape(-1, 2), ends.reshape(-1, 2), static_blockers).reshape(pairs, n * m)
+    return PairRays(starts, ends, static_blocked, np.flatnonzero(~static_blocked))
+
+
+def select_pair_rays(pair_rays, keep):
+    """The PairRays of the pairs selected by keep (a boolean mask or indices), in their order."""
+    starts, ends, static_blocked, _ = pair_rays
+    static_blocked = static_blocked[keep]
+    return PairRays(starts[keep], ends[keep], static_blocked, np.flatnonzero(~static_blocked))
+
+
+def pair_rays_visibility(pair_rays, blockers, dtype=np.float64, memory_budget=DEFAULT_MEMORY_BUDGET):
+    """
+    Fraction of unblocked rays of every pair, testing only the rays the static occluders left open.
+    dtype and memory_budget are passed to rays_blocked.
+
+    Returns:
+      A (P,) array, the same as fraction_visible with the static and the given blockers together.
+    """
+    starts, ends, static_blocked, open_rays = pair_rays
+    if not static_blocked.size:
+        return np.zeros(len(static_blocked))
+    blocked = static_blocked.copy()
+    blocked.ravel()[open_rays] = rays_blocked(starts.reshape(-1, 2)[open_rays], ends.reshape(-1, 2)[open_rays],
+                                              blockers, dtype, memory_budget)
+    return np.count_nonzero(~blocked, axis=1) / blocked.shape[1]
+
+
+def layouts_pair_rays_visibility(pair_rays, layout_blockers, dtype=np.float64, memory_budget=DEFAULT_MEMORY_BUDGET):
+    """
+    pair_rays_visibility for L layouts at once, every layout with its own blocker segments.
+
+    Parameters:
+      pair_rays       : PairRays of P pairs.
+      layout_blockers : array-like of shape (L, B, 2, 2), B blocker segments per layout.
+      dtype           : np.float64 or np.float32 for the exact ray tests; the result is the same.
+      memory_budget   : peak working memory in bytes the chunks of rays are sized against. The (L, P)
+                        counts and the per-ray arrays of the open rays, which do not grow with L * R,
+                        come on top.
+
+    Returns:
+      An (L, P) array; row l equals pair_rays_visibility(pair_rays, layout_blockers[l]).
+    """
+    starts, ends, static_blocked, open_rays = pair_rays
+    segments = np.asarray(layout_blockers, dtype=float)
+    segments = segments.reshape(len(segments), -1, 2, 2)
+    layouts, num_segments = segments.shape[:2]
+    dtype = kernel_dtype(dtype)
+    pairs, rays_per_pair = static_blocked.shape
+    if not static_blocked.size:
+        return np.zeros((layouts, pairs))
+
+    # Open rays per pair, less the ones a layout blocks; no (L, P, R) array is built
+    visible = np.repeat(np.count_nonzero(~static_blocked, axis=1)[None], layouts, axis=0).ravel()
+    if num_segments and len(open_rays):
+        open_starts = starts.reshape(-1, 2)[open_rays]
+        open_ends = ends.reshape(-1, 2)[open_rays]
+        open_pairs = open_rays // rays_per_pair
+        ray_boxes = polygon_aabbs(np.stack([open_starts, open_ends], axis=1))
+        segment_boxes = polygon_aabbs(segments) + np.array([-1, -1, 1, 1]) * RAY_BOX_PADDING
+        if dtype == np.float32:
+            scale = coordinate_scale(open_starts, open_ends, segments)
+            starts32, ends32, segments32 = (array.astype(np.float32) for array in (open_starts, open_ends, segments))
+        # The box tests are cheap; only the overlapping (layout, ray, segment) triples get the exact test
+        chunk_size = max(1, int(memory_budget // (layouts * num_segments * LAYOUT_TEST_BYTES[dtype])))
+        for start in range(0, len(open_rays), chunk_size):
+            stop = start + chunk_size
+            overlap = aabbs_overlap_batch(ray_boxes[None, start:stop, None], segment_boxes[:, None])
+            layout, ray, segment = np.nonzero(overlap)
+            ray += start
+            if dtype == np.float64:
+                hit = segments_intersect_batch(open_starts[ray], open_ends[ray], segments[layout, segment, 0],
+                                               segments[layout, segment, 1])
+            else:
+                hit, uncertain = segments_intersect_batch_float32(starts32[ray], ends32[ray],
+                                                                  segments32[layout, segment, 0],
+                                                                  segments32[layout, segment, 1], scale)
+                redo = np.flatnonzero(uncertain)
+                hit[redo] = segments_intersect_batch(open_starts[ray[redo]], open_ends[ray[redo]],
+                                                     segments[layout[redo], segment[redo], 0],
+                                                     segments[layout[redo], segment[redo], 1])
+            # A ray blocked by several segments of a layout counts once
+            blocked = np.unique(layout[hit] * len(open_rays) + ray[hit])
+            blocked_layout, blocked_ray = np.divmod(blocked, len(open_rays))
+            visible -= np.bincount(blocked_layout * pairs + open_pairs[blocked_ray], minlength=layouts * pairs)
+
+    return visible.reshape(layouts, pairs) / rays_per_pair
+
+
+def pairs_visibility(samples_a, samples_b, blockers):
+    """
+    Vectorized penalty_score.fraction_visible for many pairs of sample sets at once.
+
+    Parameters:
+      samples_a : array-like of shape (P, n, 2), the sample points of the first member of every pair.
+      samples_b : array-like of shape (P, m, 2), the sample points of the second member.
+      blockers  : blocker segments shared by all pairs.
+
+    Returns:
+      A (P,) array with the fraction of the n * m rays of every pair that are unblocked.
+    """
+    return pair_rays_visibility(build_pair_rays(samples_a, samples_b), blockers)
+
+
+# --------------------------
+# Example usage: float32 against float64 layout scoring under a memory budget
+# --------------------------
+if __name__ == "__main__":
+    import time
+    import tracemalloc
+    from office_score.office_scene import load_office_scene
+    from office_score.penalty_score import score_layouts
+
+    rng = np.random.default_rng(0)
+    memory_budget = 16 << 20
+    for plan in (0, 16, 21, 22):
+        scene = load_office_scene(plan)
+        max_x, max_y = scene.office_polygon.max(axis=0)
+        walls = np.stack([rng.uniform(0, max_x, (256, 3)), rng.uniform(0, max_y, (256, 3)),
+                          rng.uniform(-90, 90, (256, 3))], axis=2)
+        results = {}
+        for dtype in (np.float64, np.float32):
+            tracemalloc.start()
+            start_time = time.perf_counter()
+            results[dtype] = score_layouts(scene, walls, dtype=dtype, memory_budget=memory_budget)
+            elapsed = time.perf_counter() - start_time
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(f"Plan {plan:2d} {np.dtype(dtype).name}: {elapsed:.2f} s, peak {peak / 2**20:.1f} MB")
+        print(f"         max difference {np.abs(results[np.float64] - results[np.float32]).max()}")
@@ -0,0 +1,425 @@
+import path_helper
+path_helper.add_project_path()
+
+import bisect
+import math
+from typing import NamedTuple
+import numpy as np
+
+"""
+Module: visibility_polygon
+
+Exact visibility engine for the penalty score, as an alternative to the sampled rays of
+office_score.visibility. The region an observer point sees among blocker segments is a
+star-shaped polygon; it is computed with an angular sweep over the segment endpoints:
+the endpoints are sorted by angle and the segments crossing the current direction are
+kept ordered by distance, so the nearest one is known in every angular interval.
+For B segments, sorting the endpoints costs O(B log B) per observer. The active segments
+are a Python list kept sorted with bisect.insort and list.remove, which is O(A) per event
+for A active segments, so the sweep is O(B log B + B * A). That is O(B^2) in the worst
+case, when most segments cross the same directions. In office plans only a few segments
+cross any one direction, and the shifts are memmoves, so the sort dominates in practice.
+
+With the polygon of an observer, whether a target point is visible is a binary search
+over the angles plus one distance comparison, and the visible length of a window is
+the window clipped against the nearest segment of every interval, in closed form.
+Observers and targets can therefore be sampled much more densely than with rays,
+which cost n * m * B per pair.
+
+The sweep needs blockers that do not cross each other; split_crossing_segments cuts
+them at their crossings once per blocker set. As in the ray test, touching blocks: a
+target on a blocker or behind a blocker corner on the same ray is hidden, and an
+observer on a blocker sees nothing.
+"""
+
+# Segments whose endpoints are this close to collinear with the observer subtend no angle
+COLLINEAR_TOLERANCE = 1e-12
+# Points this close to a blocker touch it, like the 1e-9 orientation tolerance of segments_intersect
+SURFACE_TOLERANCE = 1e-9
+# Offset between the angles of consecutive observers in the stacked search keys; larger than 2 pi
+ANGLE_KEY_STRIDE = 8.0
+# Upper bound on the point queries handled per vectorized call; bounds peak memory.
+QUERY_BUDGET = 1 << 20
+# Points tested along a window seen edge-on, where it subtends no angle
+EDGE_ON_SAMPLES = 64
+
+
+class VisibilityPolygons(NamedTuple):
+    """
+    The visibility polygons of U observers in angular form, stacked.
+
+    Observer j owns the boundaries bounds[j] <= i < bounds[j + 1], whose angles ascend from -pi
+    to pi. Interval i covers the directions angles[i] <= phi < angles[i + 1]; segments[i] is the
+    nearest blocker there, NaN where nothing blocks and after the last boundary of every observer.
+    corners[i] is the distance to the nearest blocker endpoint exactly in direction angles[i],
+    inf if there is none. An observer on a blocker gets a zero-length segment at its position,
+    which hides everything.
+    """
+    origins: np.ndarray    # (U, 2)
+    bounds: np.ndarray     # (U + 1,)
+    angles: np.ndarray     # (A,)
+    segments: np.ndarray   # (A, 2, 2)
+    corners: np.ndarray    # (A,)
+
+    def search_keys(self):
+        """The angles shifted by ANGLE_KEY_STRIDE per observer, ascending over all observers."""
+        owners = np.repeat(np.arange(len(self.origins)), np.diff(self.bounds))
+        return self.angles + ANGLE_KEY_STRIDE * owners
+
+
+def split_crossing_segments(segments):
+    """
+    Cuts blocker segments (B, 2, 2) at every point where another segment crosses or touches
+    their interior, so the pieces meet at most at their endpoints. Both pieces of a crossing
+    share the same cut point.
+    """
+    segments = np.asarray(segments, dtype=float).reshape(-1, 2, 2)
+    starts = segments[:, 0]
+    directions = segments[:, 1] - segments[:, 0]
+    offsets = starts[None, :] - starts[:, None]                       # [i, j] = start_j - start_i
+    denominator = directions[:, None, 0] * directions[None, :, 1] - directions[:, None, 1] * directions[None, :, 0]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = (offsets[..., 0] * directions[None, :, 1] - offsets[..., 1] * directions[None, :, 0]) / denominator
+        u = (offsets[..., 0] * directions[:, None, 1] - offsets[..., 1] * directions[:, None, 0]) / denominator
+        points = starts[:, None] + t[..., None] * directions[:, None]
+    cuts = (denominator != 0) & (t > 0) & (t < 1) & (u >= 0) & (u <= 1)
+    # The cut point of a pair is computed once, from the segment with the lower index
+    lower = np.arange(len(segments))[:, None] < np.arange(len(segments))[None, :]
+    points = np.where(lower[..., None], points, points.transpose(1, 0, 2))
+
+    pieces = []
+    for i in range(len(segments)):
+        js = np.flatnonzero(cuts[i])
+        if not len(js):
+            pieces.append(segments[i])
+            continue
+        order = np.argsort(t[i, js])
+        vertices = np.concatenate([segments[i, :1], points[i, js[order]], segments[i, 1:]])
+        pieces.extend(np.stack([vertices[:-1], vertices[1:]], axis=1))
+    return np.array(pieces).reshape(-1, 2, 2)
+
+
+def _sweep(origin, segments):
+    """Angular sweep around one origin; returns its (angles, segments, corners) rows of VisibilityPolygons."""
+    relative = segments - origin + 0.0   # + 0.0 drops negative zeros, so no angle comes out as -pi
+    cross = relative[:, 0, 0] * relative[:, 1, 1] - relative[:, 0, 1] * relative[:, 1, 0]
+    on_segment = ((np.abs(cross) < SURFACE_TOLERANCE) &
+                  (relative[:, :, 0].min(axis=1) <= 0) & (relative[:, :, 0].max(axis=1) >= 0) &
+                  (relative[:, :, 1].min(axis=1) <= 0) & (relative[:, :, 1].max(axis=1) >= 0))
+    if on_segment.any():
+        return (np.array([-math.pi, math.pi]), np.stack([[origin, origin], np.full((2, 2), np.nan)]),
+                np.zeros(2))
+
+    # Every endpoint is a corner, including those of segments that point straight at the origin
+    endpoint_angles = np.arctan2(relative[..., 1], relative[..., 0]).ravel()
+    endpoint_distances = np.hypot(relative[..., 0], relative[..., 1]).ravel()
+    angles = np.unique(np.concatenate([[-math.pi, math.pi], endpoint_angles]))
+    corners = np.full(len(angles), np.inf)
+    np.minimum.at(corners, np.searchsorted(angles, endpoint_angles), endpoint_distances)
+
+    # Orient the segments that subtend an angle counterclockwise around the origin
+    spanning = np.abs(cross) > COLLINEAR_TOLERANCE
+    relative = np.where((cross < 0)[:, None, None], relative[:, ::-1], relative)[spanning]
+    start_angles = np.arctan2(relative[:, 0, 1], relative[:, 0, 0])
+    end_angles = np.arctan2(relative[:, 1, 1], relative[:, 1, 0])
+    # Segments crossing the direction -pi / pi are active from -pi to their end and from their start to pi
+    wraps = end_angles < start_angles
+
+    starts_at = [[] for _ in angles]
+    ends_at = [[] for _ in angles]
+    starts_at[0] = np.flatnonzero(wraps).tolist()
+    for i, k in enumerate(np.searchsorted(angles, start_angles).tolist()):
+        starts_at[k].append(i)
+    for i, k in enumerate(np.searchsorted(angles, end_angles).tolist()):
+        ends_at[k].append(i)
+
+    # Distance along direction phi to segment i: line_offsets[i] / (cos(phi) * dy[i] - sin(phi) * dx[i])
+    dx = (relative[:, 1, 0] - relative[:, 0, 0]).tolist()
+    dy = (relative[:, 1, 1] - relative[:, 0, 1]).tolist()
+    line_offsets = (relative[:, 0, 0] * relative[:, 1, 1] - relative[:, 0, 1] * relative[:, 1, 0]).tolist()
+
+    nearest = np.full(len(angles), -1)
+    active = []
+    angle_list = angles.tolist()
+    for k in range(len(angles) - 1):
+        mid = (angle_list[k] + angle_list[k + 1]) / 2
+        cos_mid = math.cos(mid)
+        sin_mid = math.sin(mid)
+
+        def distance(i):
+            return line_offsets[i] / (cos_mid * dy[i] - sin_mid * dx[i])
+
+        # O(len(active)) each; see the module docstring
+        for i in ends_at[k]:
+            active.remove(i)
+        # Segments that do not cross keep their order, so the list stays sorted by distance
+        for i in starts_at[k]:
+            bisect.insort(active, i, key=distance)
+        if active:
+            nearest[k] = active[0]
+
+    nearest_segments = np.full((len(angles), 2, 2), np.nan)
+    nearest_segments[nearest >= 0] = relative[nearest[nearest >= 0]] + origin
+    return angles, nearest_segments, corners
+
+
+def visibility_polygons(origins, segments) -> VisibilityPolygons:
+    """
+    Visibility polygons of observer points (U, 2) among blocker segments (B, 2, 2) that do not
+    cross each other (see split_crossing_segments), one angular sweep per observer.
+    """
+    origins = np.asarray(origins, dtype=float).reshape(-1, 2)
+    segments = np.asarray(segments, dtype=float).reshape(-1, 2, 2)
+    sweeps = [_sweep(origin, segments) for origin in origins]
+    bounds = np.concatenate([[0], np.cumsum([len(angles) for angles, _, _ in sweeps], dtype=int)])
+    if not sweeps:
+        return VisibilityPolygons(origins, bounds, np.zeros(0), np.zeros((0, 2, 2)), np.zeros(0))
+    angles, nearest, corners = (np.concatenate(rows) for rows in zip(*sweeps))
+    return VisibilityPolygons(origins, bounds, angles, nearest, corners)
+
+
+def _blocker_distances(segments, origins, directions):
+    """
+    Distance from origins along unit directions (..., 2) to the lines of segments (..., 2, 2); inf for
+    NaN segments and NaN for zero-length ones.
+    """
+    offsets = segments[..., 0, :] - origins
+    lines = segments[..., 1, :] - segments[..., 0, :]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        distance = ((offsets[..., 0] * lines[..., 1] - offsets[..., 1] * lines[..., 0]) /
+                    (directions[..., 0] * lines[..., 1] - directions[..., 1] * lines[..., 0]))
+    return np.where(np.isnan(segments[..., 0, 0]), np.inf, distance)
+
+
+def _directions(phi):
+    return np.stack([np.cos(phi), np.sin(phi)], axis=-1)
+
+
+def _intervals(polygons, keys, observers, phi, side):
+    """Interval of every observer containing direction phi; with side='left' the one ending at phi."""
+    index = np.searchsorted(keys, phi + ANGLE_KEY_STRIDE * observers, side=side) - 1
+    return np.clip(index, polygons.bounds[observers], polygons.bounds[observers + 1] - 2)
+
+
+def points_visible(polygons, observers, points, keys=None):
+    """
+    Which points are visible from their observers.
+
+    Parameters:
+      polygons  : VisibilityPolygons.
+      observers : (Q,) index of the observer of every query.
+      points    : (Q, 2) target points.
+      keys      : polygons.search_keys(), if already computed.
+
+    Returns:
+      A (Q,) boolean array, True where the point lies strictly inside the observer's polygon.
+    """
+    if keys is None:
+        keys = polygons.search_keys()
+    observers = np.asarray(observers, dtype=int)
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    origins = polygons.origins[observers]
+    relative = points - origins
+    phi = np.arctan2(relative[:, 1], relative[:, 0])
+    distance = np.hypot(relative[:, 0], relative[:, 1])
+    interval = _intervals(polygons, keys, observers, phi, 'right')
+
+    limit = _blocker_distances(polygons.segments[interval], origins, _directions(phi))
+    visible = distance < limit - SURFACE_TOLERANCE
+    # Rays through a blocker corner touch it
+    for corner in (interval, interval + 1):
+        grazing = distance * np.abs(np.sin(phi - polygons.angles[corner])) < SURFACE_TOLERANCE
+        visible &= ~(grazing & (distance >= polygons.corners[corner] - SURFACE_TOLERANCE))
+    return visible
+
+
+def _visible_lengths(polygons, keys, observers, windows, low, high):
+    """
+    Visible length of every window (Q, 2, 2) seen by its observer in the directions low..high,
+    which do not cross -pi / pi. Every interval overlapping the directions is clipped, and split
+    where the window line meets the line of the interval's blocker.
+    """
+    first = _intervals(polygons, keys, observers, low, 'right')
+    last = _intervals(polygons, keys, observers, high, 'left')
+    counts = np.maximum(last - first + 1, 0)
+    query = np.repeat(np.arange(len(observers)), counts)
+    interval = first[query] + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+
+    origins = polygons.origins[observers[query]]
+    window = windows[query]
+    blockers = polygons.segments[interval]
+    lo = np.maximum(polygons.angles[interval], low[query])
+    hi = np.minimum(polygons.angles[interval + 1], high[query])
+
+    window_line = window[:, 1] - window[:, 0]
+    blocker_lines = blockers[:, 1] - blockers[:, 0]
+    offsets = blockers[:, 0] - window[:, 0]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = ((offsets[:, 0] * blocker_lines[:, 1] - offsets[:, 1] * blocker_lines[:, 0]) /
+             (window_line[:, 0] * blocker_lines[:, 1] - window_line[:, 1] * blocker_lines[:, 0]))
+        meet = window[:, 0] - origins + t[:, None] * window_line
+    meet_phi = np.arctan2(meet[:, 1], meet[:, 0])
+    meet_phi = np.where(np.isfinite(meet_phi) & (meet_phi > lo) & (meet_phi < hi), meet_phi, hi)
+    bounds = np.stack([lo, meet_phi, hi], axis=1)
+
+    directions = _directions(bounds)
+    window_points = _blocker_distances(window[:, None], origins[:, None], directions)[..., None] * directions
+    piece_lengths = np.hypot(*np.moveaxis(np.diff(window_points, axis=1), -1, 0))
+
+    mid_directions = _directions((bounds[:, 1:] + bounds[:, :-1]) / 2)
+    window_distance = _blocker_distances(window[:, None], origins[:, None], mid_directions)
+    blocker_distance = _blocker_distances(blockers[:, None], origins[:, None], mid_directions)
+    visible = np.where(window_distance < blocker_distance, piece_lengths, 0.0).sum(axis=1)
+    return np.bincount(query, visible, minlength=len(observers))
+
+
+def visible_window_fractions(polygons, observers, windows):
+    """
+    Fraction of the length of every window segment that is visible from its observer.
+
+    Parameters:
+      polygons  : VisibilityPolygons.
+      observers : (Q,) index of the observer of every query.
+      windows   : (Q, 2, 2) window segments ((x1, y1), (x2, y2)).
+
+    Returns:
+      A (Q,) array; the window is clipped against the nearest blocker of every angular interval.
+    """
+    observers = np.asarray(observers, dtype=int)
+    windows = np.asarray(windows, dtype=float).reshape(-1, 2, 2)
+    keys = polygons.search_keys()
+    relative = windows - polygons.origins[observers][:, None]
+    phi = np.arctan2(relative[..., 1], relative[..., 0])
+    lengths = np.hypot(*(windows[:, 1] - windows[:, 0]).T)
+
+    # Windows crossing the direction -pi / pi of their observer are seen in two angular ranges
+    below = relative[..., 1] < 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = relative[:, 0, 1] / (relative[:, 0, 1] - relative[:, 1, 1])
+    crosses = (below[:, 0] != below[:, 1]) & (relative[:, 0, 0] + t * (relative[:, 1, 0] - relative[:, 0, 0]) < 0)
+    upper_phi = np.where(below[:, 0], phi[:, 1], phi[:, 0])
+    lower_phi = np.where(below[:, 0], phi[:, 0], phi[:, 1])
+    low = np.where(crosses, upper_phi, phi.min(axis=1))
+    high = np.where(crosses, math.pi, phi.max(axis=1))
+    seen = crosses | (high - low < math.pi)
+    # An observer on the line of a window sees it edge-on; its points are then tested one by one
+    edge_on = ~seen | (high == low)
+    seen &= ~edge_on
+
+    visible = np.zeros(len(windows))
+    visible[seen] = _visible_lengths(polygons, keys, observers[seen], windows[seen], low[seen], high[seen])
+    if crosses.any():
+        visible[crosses] += _visible_lengths(polygons, keys, observers[crosses], windows[crosses],
+                                             np.full(np.count_nonzero(crosses), -math.pi), lower_phi[crosses])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fractions = np.where(lengths > 0, visible / lengths, 0.0)
+    if edge_on.any():
+        t = np.linspace(0, 1, EDGE_ON_SAMPLES)[None, :, None]
+        points = windows[edge_on, :1] + t * (windows[edge_on, 1:] - windows[edge_on, :1])
+        hits = points_visible(polygons, np.repeat(observers[edge_on], EDGE_ON_SAMPLES), points.reshape(-1, 2), keys)
+        fractions[edge_on] = hits.reshape(-1, EDGE_ON_SAMPLES).mean(axis=1)
+    return fractions
+
+
+# --------------------------
+# Pair visibilities
+# --------------------------
+def _observer_polygons(samples, blockers):
+    """The polygons of the distinct points of samples (P, n, 2) and the observer index of every sample."""
+    samples = np.asarray(samples, dtype=float)
+    origins, inverse = np.unique(samples.reshape(-1, 2), axis=0, return_inverse=True)
+    return visibility_polygons(origins, split_crossing_segments(blockers)), inverse.reshape(samples.shape[:2])
+
+
+def pairs_visibility_sweep(samples_a, samples_b, blockers):
+    """
+    Fraction of the sample pairs (a, b) of every pair that see each other, from the visibility
+    polygons of the samples of the first members; the exact counterpart of visibility.pairs_visibility.
+
+    Parameters:
+      samples_a : array-like of shape (P, n, 2).
+      samples_b : array-like of shape (P, m, 2).
+      blockers  : blocker segments shared by all pairs.
+
+    Returns:
+      A (P,) array.
+    """
+    samples_a = np.asarray(samples_a, dtype=float)
+    samples_b = np.asarray(samples_b, dtype=float)
+    if not len(samples_a):
+        return np.zeros(0)
+    polygons, observers = _observer_polygons(samples_a, blockers)
+    keys = polygons.search_keys()
+    pairs, n = observers.shape
+    m = samples_b.shape[1]
+
+    visible = np.zeros(pairs, dtype=int)
+    chunk_size = max(1, QUERY_BUDGET // (n * m))
+    for start in range(0, pairs, chunk_size):
+        chunk_observers = observers[start:start + chunk_size]
+        queries = (len(chunk_observers), n, m)
+        hits = points_visible(polygons, np.broadcast_to(chunk_observers[:, :, None], queries).ravel(),
+                              np.broadcast_to(samples_b[start:start + chunk_size, None], queries + (2,)), keys)
+        visible[start:start + chunk_size] = np.count_nonzero(hits.reshape(len(chunk_observers), -1), axis=1)
+    return visible / (n * m)
+
+
+def windows_visibility_sweep(samples, windows, blockers):
+    """
+    Mean visible fraction of the window segment of every pair over the observer samples.
+
+    Parameters:
+      samples  : array-like of shape (P, n, 2), the observer samples of every pair.
+      windows  : array-like of shape (P, 2, 2), the window segment of every pair.
+      blockers : blocker segments shared by all pairs.
+
+    Returns:
+      A (P,) array.
+    """
+    samples = np.asarray(samples, dtype=float)
+    if not len(samples):
+        return np.zeros(0)
+    windows = np.asarray(windows, dtype=float).reshape(-1, 2, 2)
+    polygons, observers = _observer_polygons(samples, blockers)
+    fractions = visible_window_fractions(polygons, observers.ravel(), np.repeat(windows, observers.shape[1], axis=0))
+    return fractions.reshape(observers.shape).mean(axis=1)
+
+
+# --------------------------
+# Example usage: agreement with the ray test and cost against dense rays
+# --------------------------
+if __name__ == "__main__":
+    import time
+    from office_score.office_scene import load_office_scene
+    from office_score.penalty_score import movable_wall_segments, generate_sample_points_around
+    from office_score.visibility import rays_blocked, pairs_visibility
+
+    rng = np.random.default_rng(0)
+    for plan in (0, 4, 16, 21, 22):
+        scene = load_office_scene(plan)
+        max_x, max_y = scene.office_polygon.max(axis=0)
+        walls = np.column_stack([rng.uniform(0, max_x, 5), rng.uniform(0, max_y, 5), rng.uniform(-90, 90, 5)])
+        blockers = np.concatenate([scene.office_walls, np.asarray(movable_wall_segments(walls.tolist()))])
+
+        # Single points against the ray test
+        origins = np.column_stack([rng.uniform(0, max_x, 50), rng.uniform(0, max_y, 50)])
+        polygons = visibility_polygons(origins, split_crossing_segments(blockers))
+        observers = np.repeat(np.arange(len(origins)), 400)
+        points = np.column_stack([rng.uniform(0, max_x, len(observers)), rng.uniform(0, max_y, len(observers))])
+        mismatches = np.count_nonzero(points_visible(polygons, observers, points) !=
+                                      ~rays_blocked(origins[observers], points, blockers))
+
+        # All person pairs, 64 samples per person
+        pairs = [(p, q) for p in scene.persons for q in scene.persons if p != q]
+        samples_a = [generate_sample_points_around(p, .5, 64) for p, _ in pairs]
+        samples_b = [generate_sample_points_around(q, .5, 64) for _, q in pairs]
+        start_time = time.perf_counter()
+        sweep = pairs_visibility_sweep(samples_a, samples_b, blockers)
+        sweep_time = time.perf_counter() - start_time
+        start_time = time.perf_counter()
+        rays = pairs_visibility(samples_a, samples_b, blockers)
+        rays_time = time.perf_counter() - start_time
+
+        print(f"Plan {plan:2d}: {mismatches} point mismatches, {len(pairs)} pairs of 64 x 64 samples: "
+              f"max difference {np.abs(sweep - rays).max(initial=0):.2e}, "
+              f"sweep {sweep_time*1000:.0f} ms vs rays {rays_time*1000:.0f} ms")